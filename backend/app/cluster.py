@@ -0,0 +1,30 @@
+"""
+Multi-core deployment entry point: one HTTP router, N engine worker processes.
+
+Usage (from backend/):
+    python -m app.cluster --workers 4 --port 8000
+
+Each user_id is consistently hashed to one engine worker, so velocity and
+impossible travel see all of a user's transactions. Do not use
+`uvicorn --workers N` instead: every uvicorn worker would keep its own,
+partial copy of each user's state.
+"""
+import argparse
+import os
+import uvicorn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run CreditGuard with user-pinned engine workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="engine worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # Read by app.main at import time
+    os.environ["CREDITGUARD_ENGINE_WORKERS"] = str(args.workers)
+    uvicorn.run("app.main:app", host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
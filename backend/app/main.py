@@ -2,11 +2,29 @@
 CreditGuard API - FastAPI application for fraud detection.
 Clean REST API with clear separation of concerns.
 """
-from fastapi import FastAPI, HTTPException
+import json
+import os
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import TypeAdapter, ValidationError
+from starlette.requests import ClientDisconnect
 from app.schemas import Transaction, FraudResult
+from app.services.cluster import ClusterEngine
 from app.services.fraud_engine import FraudEngine
-from typing import List
+from app.services.jobs import INPUT_FILE, job_manager_from_env
+from app.services.metrics import CONTENT_TYPE, HTTPMetricsMiddleware, metrics, result_cache_gauges, state_store_gauges
+from app.services.microbatch import MicroBatcher
+from app.utils.ndjson import NDJSONStreamingResponse, LineTooLong, evaluate_chunk, iter_chunks, iter_lines
+from app.utils.formats import (
+    ARROW_FILE, ARROW_STREAM, MSGPACK, NDJSON, BodyFormatError, UnsupportedFormat,
+    compress, media_type, read_arrow, results_arrow, unpack_msgpack, wants_arrow,
+)
+from app.utils.serialization import (
+    parse_transaction, parse_transactions, result_json, results_json, transaction_records,
+)
+from typing import Any, AsyncIterator, Callable, List, Optional, Sequence
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -24,8 +42,108 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency and status counts for GET /metrics
+app.add_middleware(HTTPMetricsMiddleware)
+
+# Engine processes: >1 pins each user to one of N FraudEngine worker processes
+# (consistent hashing, see app.cluster); uvicorn --workers N would split users' state
+ENGINE_WORKERS = int(os.getenv("CREDITGUARD_ENGINE_WORKERS", "1"))
+
 # Initialize fraud detection engine (singleton pattern)
-fraud_engine = FraudEngine()
+fraud_engine = ClusterEngine(ENGINE_WORKERS) if ENGINE_WORKERS > 1 else FraudEngine()
+
+# Transactions evaluated per engine call on the streaming endpoint
+STREAM_CHUNK_SIZE = 1000
+
+# Worker processes for large /batch-evaluate calls (1 = single process)
+BATCH_WORKERS = int(os.getenv("CREDITGUARD_BATCH_WORKERS", "1"))
+
+# Default /evaluate mode: 1 = decision-only (stop once the risk level is fixed), 0 = full explanation
+DECISION_ONLY = os.getenv("CREDITGUARD_DECISION_ONLY", "0") == "1"
+
+# Micro-batching for /evaluate: concurrent requests within this window (ms) are
+# evaluated as one batch (0 = off, each request evaluated on its own)
+MICROBATCH_WINDOW_MS = float(os.getenv("CREDITGUARD_MICROBATCH_WINDOW_MS", "0"))
+MICROBATCH_MAX = int(os.getenv("CREDITGUARD_MICROBATCH_MAX", "256"))
+micro_batcher = (
+    MicroBatcher(fraud_engine, MICROBATCH_WINDOW_MS / 1000, MICROBATCH_MAX) if MICROBATCH_WINDOW_MS > 0 else None
+)
+
+# Background batch jobs (POST /jobs): worker threads evaluating chunks into result files
+job_manager = job_manager_from_env(fraud_engine)
+job_manager.start()
+
+# Request bodies are read and decoded by the endpoints (fast path, see
+# _read_body); these keep validation fallback and the documented schema
+_TRANSACTION = TypeAdapter(Transaction)
+_TRANSACTIONS = TypeAdapter(List[Transaction])
+_TRANSACTION_SCHEMA = Transaction.model_json_schema()
+
+
+_BINARY_SCHEMA = {"type": "string", "format": "binary"}
+
+
+def _request_body(schema: dict, alternatives: Sequence[str] = ()) -> dict:
+    """openapi_extra documenting a required JSON body with this schema (and alternative binary media types)."""
+    content = {"application/json": {"schema": schema}}
+    content.update({media: {"schema": _BINARY_SCHEMA} for media in alternatives})
+    return {"requestBody": {"required": True, "content": content}}
+
+
+async def _read_body(request: Request, parse: Callable[[bytes], Any], adapter: TypeAdapter) -> Any:
+    """
+    The JSON body decoded by the fast path (app.utils.serialization), or, if it
+    does not accept it, parsed and validated as FastAPI would for a body
+    parameter of the adapter's type (same result, same 422 errors).
+    """
+    body = await request.body()
+    parsed = parse(body)
+    if parsed is not None:
+        return parsed
+    data = None
+    if body:
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError(
+                [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+                body=e.doc,
+            )
+    return _validated(data, adapter)
+
+
+async def _read_batch(request: Request) -> Sequence[Transaction]:
+    """
+    A /batch-evaluate body in its Content-Type's format: JSON (default),
+    MessagePack (same structure, checked like JSON) or Arrow IPC (one row per
+    transaction, validated by column and kept as columns).
+    """
+    content_type = media_type(request.headers.get("content-type"))
+    if content_type not in MSGPACK and content_type not in (ARROW_STREAM, ARROW_FILE):
+        return await _read_body(request, parse_transactions, _TRANSACTIONS)
+    body = await request.body()
+    try:
+        if content_type in MSGPACK:
+            data = unpack_msgpack(body)
+            transactions = transaction_records(data)
+            return _validated(data, _TRANSACTIONS) if transactions is None else transactions
+        return read_arrow(body, file_format=content_type == ARROW_FILE)
+    except UnsupportedFormat as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except BodyFormatError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors])
+
+
+def _validated(data: Any, adapter: TypeAdapter) -> Any:
+    """Decoded body values validated as FastAPI does for a body parameter of the adapter's type."""
+    if data is None:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        return adapter.validate_python(data, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)], body=data
+        )
 
 
 @app.get("/")
@@ -38,41 +156,245 @@ def root():
     }
 
 
-@app.post("/evaluate", response_model=FraudResult)
-def evaluate_transaction(transaction: Transaction) -> FraudResult:
+@app.get("/ready")
+def ready():
+    """
+    Readiness check (separate from the / liveness check).
+    503 until the engine has loaded its per-user state (warm start from a
+    snapshot, all cluster workers up); route traffic only once this is 200.
+    """
+    if not fraud_engine.ready:
+        raise HTTPException(status_code=503, detail="Engine state is loading")
+    return {"status": "ready"}
+
+
+@app.post("/evaluate", response_model=FraudResult, openapi_extra=_request_body(_TRANSACTION_SCHEMA))
+async def evaluate_transaction(request: Request, explain: Optional[bool] = None, reasons: bool = True) -> Response:
     """
     Evaluate a single transaction for fraud.
 
     Process:
-    1. Validate transaction data (Pydantic)
+    1. Decode and validate the transaction (fast path, Pydantic as fallback)
     2. Pass to fraud engine
-    3. Return risk assessment
+    3. Return risk assessment, encoded straight to JSON bytes
+
+    With CREDITGUARD_MICROBATCH_WINDOW_MS set, concurrent requests share one
+    batch engine call (same results, fewer thread pool round trips).
+
+    `explain=false` asks for decision-only evaluation: rules stop once the risk
+    level is fixed (`complete` is false if any were skipped); `explain=true`
+    always runs and explains every rule. Without it, CREDITGUARD_DECISION_ONLY
+    decides. Micro-batched requests are always fully explained.
+    `reasons=false` leaves out the triggers' reason text (never rendered).
+    A retry carrying the same user_id and `transaction_id` gets the first
+    result back without being evaluated again (app.services.idempotency).
 
     Returns:
         FraudResult with risk level and triggered rules
     """
+    transaction = await _read_body(request, parse_transaction, _TRANSACTION)
     try:
-        result = fraud_engine.evaluate(transaction)
-        return result
+        if micro_batcher is not None:
+            result = await micro_batcher.evaluate(transaction)
+        else:
+            decision_only = DECISION_ONLY if explain is None else not explain
+            result = await run_in_threadpool(fraud_engine.evaluate, transaction, decision_only)
+        # Serialized here (not by response_model): reason text is rendered only if asked for
+        return Response(result_json(result, reasons), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Evaluation failed: {str(e)}")
 
 
-@app.post("/batch-evaluate", response_model=List[FraudResult])
-def batch_evaluate_transactions(transactions: List[Transaction]) -> List[FraudResult]:
+@app.post(
+    "/batch-evaluate", response_model=List[FraudResult],
+    openapi_extra={
+        **_request_body(
+            {"type": "array", "items": _TRANSACTION_SCHEMA, "title": "Transactions"},
+            alternatives=(MSGPACK[0], ARROW_STREAM, ARROW_FILE),
+        ),
+        "responses": {"200": {"content": {ARROW_STREAM: {"schema": _BINARY_SCHEMA}}}},
+    },
+)
+async def batch_evaluate_transactions(request: Request, reasons: bool = True) -> Response:
     """
     Evaluate multiple transactions (batch processing).
 
     Useful for testing or processing historical data.
-    Trade-off: Simple sequential processing vs. parallel/async for production.
+    Uses the engine's columnar batch mode: rules run as vectorized masks,
+    results match evaluating each transaction in order.
+    Set CREDITGUARD_BATCH_WORKERS > 1 to shard large batches by user across
+    a process pool (same results, throughput scales with cores).
+    `reasons=false` leaves out the triggers' reason text.
+
+    Content negotiation:
+    - Content-Type: application/json (default), application/msgpack, or
+      application/vnd.apache.arrow.stream / .file (columns feed the columnar
+      engine directly)
+    - Accept: application/vnd.apache.arrow.stream returns results as Arrow
+      columns (if pyarrow is installed), otherwise JSON
+    - Accept-Encoding: JSON responses are compressed with zstd or gzip
     """
+    transactions = await _read_batch(request)
+    arrow = wants_arrow(request.headers.get("accept"))
     try:
-        results = [fraud_engine.evaluate(txn) for txn in transactions]
-        return results
+        return await run_in_threadpool(
+            _batch_response, transactions, reasons, arrow, request.headers.get("accept-encoding")
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Batch evaluation failed: {str(e)}")
 
 
+def _batch_response(transactions: Sequence[Transaction], reasons: bool, arrow: bool, accept_encoding: Optional[str]) -> Response:
+    """Evaluate a batch and encode its results (in a worker thread: both scale with the batch)."""
+    results = fraud_engine.evaluate_batch(transactions, workers=BATCH_WORKERS)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if arrow:
+        return Response(results_arrow(results, reasons), media_type=ARROW_STREAM, headers=headers)
+    body, encoding = compress(results_json(results, reasons), accept_encoding)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.post("/batch-evaluate/stream", response_class=NDJSONStreamingResponse)
+async def batch_evaluate_stream(request: Request, reasons: bool = True) -> NDJSONStreamingResponse:
+    """
+    Evaluate a newline-delimited JSON (NDJSON) upload, streaming NDJSON results.
+
+    Process:
+    1. Read the request body incrementally, one transaction per line
+    2. Evaluate every STREAM_CHUNK_SIZE lines through the batch engine
+    3. Write one result line per input line as soon as its chunk is done
+
+    Memory stays bounded by the chunk size regardless of upload size.
+    Invalid lines produce {"line": n, "detail": [...]} in place of a result;
+    a fatal error ends the stream with {"error": "..."}.
+    `reasons=false` leaves out the triggers' reason text.
+    """
+
+    async def results() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in iter_chunks(iter_lines(request.stream()), STREAM_CHUNK_SIZE):
+                yield await run_in_threadpool(evaluate_chunk, fraud_engine, chunk, reasons)
+        except ClientDisconnect:
+            return
+        except LineTooLong as e:
+            yield (json.dumps({"error": str(e)}) + "\n").encode()
+        except Exception as e:
+            yield (json.dumps({"error": f"Batch evaluation failed: {str(e)}"}) + "\n").encode()
+
+    return NDJSONStreamingResponse(results())
+
+
+@app.post(
+    "/jobs", status_code=202,
+    openapi_extra=_request_body(
+        {"type": "array", "items": _TRANSACTION_SCHEMA, "title": "Transactions"},
+        alternatives=("application/x-ndjson", MSGPACK[0], ARROW_STREAM, ARROW_FILE),
+    ),
+)
+async def submit_job(request: Request, reasons: bool = True) -> Response:
+    """
+    Submit a batch for background evaluation; returns the job (202) with a Location header.
+
+    Accepts every /batch-evaluate body format (validated up front, 422 as
+    there) and NDJSON (application/x-ndjson), which is spilled to disk as it
+    arrives and validated line by line as on /batch-evaluate/stream.
+    The job is evaluated in chunks by a worker pool (CREDITGUARD_JOB_WORKERS);
+    poll GET /jobs/{id} for progress and read results with
+    GET /jobs/{id}/results (pages) or GET /jobs/{id}/results/stream.
+    `reasons=false` leaves out the triggers' reason text.
+    """
+    if media_type(request.headers.get("content-type")) in NDJSON:
+        job = job_manager.create("ndjson", reasons)
+        try:
+            job.total = await _spill_ndjson(request, job.path(INPUT_FILE))
+        except LineTooLong as e:
+            job_manager.discard(job)
+            raise HTTPException(status_code=413, detail=str(e))
+        except ClientDisconnect:
+            job_manager.discard(job)
+            raise
+        job_manager.submit(job)
+    else:
+        transactions = await _read_batch(request)
+        job = job_manager.submit(job_manager.create("batch", reasons), transactions)
+    return Response(
+        json.dumps(job.describe()), status_code=202, media_type="application/json",
+        headers={"Location": f"/jobs/{job.id}"},
+    )
+
+
+async def _spill_ndjson(request: Request, path: str) -> int:
+    """Write an NDJSON body to path (line numbers kept, blank lines emptied); returns its transaction count."""
+    total = 0
+    written = 0
+    with open(path, "wb") as f:
+        async for chunk in iter_chunks(iter_lines(request.stream()), STREAM_CHUNK_SIZE):
+            parts = []
+            for line_number, line in chunk:
+                parts.append(b"\n" * (line_number - written - 1) + line)
+                written = line_number
+            f.write(b"\n".join(parts) + b"\n")
+            total += len(chunk)
+    return total
+
+
+def _job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/jobs")
+def list_jobs():
+    """Retained jobs (queued, running, or finished within CREDITGUARD_JOB_TTL_HOURS), oldest first."""
+    return {"jobs": [job.describe() for job in job_manager.list()]}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Job status, progress (processed of total transactions) and throughput."""
+    return _job(job_id).describe()
+
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=100_000)) -> Response:
+    """
+    A page of results, in input order: {"status", "offset", "next_offset", "results": [...]}.
+
+    Only results already evaluated are returned; `next_offset` is where the
+    next page starts (null once the job has finished and every result was read).
+    """
+    job = _job(job_id)
+    finished = job.finished
+    try:
+        lines = job_manager.page(job, offset, limit)
+    except FileNotFoundError:  # deleted meanwhile
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    end = offset + len(lines)
+    next_offset = None if finished and end >= job.processed else end
+    header = json.dumps({"status": job.status, "offset": offset, "next_offset": next_offset})
+    return Response(
+        header[:-1].encode() + b', "results": [' + b",".join(lines) + b"]}", media_type="application/json"
+    )
+
+
+@app.get("/jobs/{job_id}/results/stream", response_class=NDJSONStreamingResponse)
+def stream_job_results(job_id: str) -> NDJSONStreamingResponse:
+    """All results as NDJSON, in input order, following the job until it finishes."""
+    return NDJSONStreamingResponse(job_manager.stream(_job(job_id)))
+
+
+@app.delete("/jobs/{job_id}", status_code=204)
+def delete_job(job_id: str) -> Response:
+    """Cancel a job (if still queued or running) and delete its results."""
+    if not job_manager.delete(job_id):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return Response(status_code=204)
+
+
 @app.get("/rules")
 def list_rules():
     """
@@ -90,6 +412,47 @@ def list_rules():
     }
 
 
+@app.get("/stats")
+def stats():
+    """Engine internals: size and evictions of the per-user state store (per worker in cluster mode)."""
+    engine_stats = fraud_engine.stats()
+    if micro_batcher is not None:
+        engine_stats["micro_batching"] = micro_batcher.stats()
+    engine_stats["jobs"] = job_manager.stats()
+    return engine_stats
+
+
+@app.get("/metrics", response_class=Response)
+def prometheus_metrics() -> Response:
+    """
+    Prometheus metrics: per-rule latency (sampled) and trigger counts, engine
+    and per-route latency, batch sizes, state store size and evictions,
+    idempotency cache hits, misses and size, jobs.
+    In cluster mode the engine series are summed over the engine workers and
+    state store series are labelled by worker.
+    """
+    gauges = []
+    snapshots = []
+    engine_stats = fraud_engine.stats()
+    if isinstance(fraud_engine, ClusterEngine):
+        snapshots = fraud_engine.worker_metrics()
+        for worker in engine_stats["workers"]:
+            if "state_store" in worker:
+                gauges += state_store_gauges(worker["state_store"], {"worker": str(worker["worker"])})
+            if "idempotency" in worker:
+                gauges += result_cache_gauges(worker["idempotency"], {"worker": str(worker["worker"])})
+    else:
+        gauges += state_store_gauges(engine_stats["state_store"])
+        if "idempotency" in engine_stats:
+            gauges += result_cache_gauges(engine_stats["idempotency"])
+    job_stats = job_manager.stats()
+    gauges += [
+        ("creditguard_jobs", "gauge", "Background jobs by status", {"status": status}, job_stats[status])
+        for status in ("queued", "running")
+    ]
+    return Response(metrics.render(snapshots, gauges), media_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
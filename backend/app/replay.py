@@ -0,0 +1,65 @@
+"""
+Offline replay: evaluate historical transaction files with the batch engine, no HTTP server.
+
+Usage (from backend/):
+    python -m app.replay transactions.ndjson --output results.ndjson --report report.json
+
+Inputs can be NDJSON/JSONL, JSON arrays or CSV (header row with the
+Transaction field names), optionally gzipped, and larger than memory: they
+are streamed, put in timestamp order with an external merge sort if they are
+not already, and evaluated in chunks through FraudEngine.evaluate_batch().
+The replay starts from empty rule state and writes no event log or snapshot.
+"""
+import argparse
+import json
+import os
+import sys
+from contextlib import nullcontext
+from app.services.fraud_engine import FraudEngine
+from app.services.replay import FORMATS, replay
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay transaction files through the CreditGuard engine")
+    parser.add_argument("inputs", nargs="+", help="input files (.ndjson, .jsonl, .json, .csv, optionally .gz), replayed as one stream")
+    parser.add_argument("--output", help="NDJSON results file ('-' for stdout; default: none, report only)")
+    parser.add_argument("--report", help="write the summary report (JSON) here as well as to stderr")
+    parser.add_argument("--format", choices=FORMATS, help="input format (default: from the extension)")
+    parser.add_argument(
+        "--order", choices=("auto", "sort", "keep"), default="auto",
+        help="auto: sort by timestamp unless already sorted; sort: always; keep: input order",
+    )
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="transactions per engine batch call")
+    parser.add_argument("--run-size", type=int, default=500_000, help="transactions sorted in memory per spilled run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="batch worker processes")
+    parser.add_argument("--temp-dir", help="directory for sorted runs (default: system temp)")
+    parser.add_argument("--no-reasons", action="store_true", help="leave the triggers' reason text out of results")
+    args = parser.parse_args()
+
+    # Replays start from empty state and must not touch the service's log or snapshot
+    os.environ.pop("CREDITGUARD_EVENT_LOG_DIR", None)
+    os.environ.pop("CREDITGUARD_SNAPSHOT_PATH", None)
+
+    engine = FraudEngine()
+    engine.wait_ready()
+    if args.output == "-":
+        output = nullcontext(sys.stdout.buffer)
+    elif args.output:
+        output = open(args.output, "wb", buffering=1 << 20)
+    else:
+        output = nullcontext(None)
+    with output as f:
+        report = replay(
+            engine, args.inputs, f, order=args.order, chunk_size=args.chunk_size, run_size=args.run_size,
+            workers=args.workers, reasons=not args.no_reasons, temp_dir=args.temp_dir, file_format=args.format,
+        )
+
+    summary = json.dumps(report.to_dict(), indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(summary + "\n")
+    print(summary, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
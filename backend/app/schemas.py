@@ -3,18 +3,22 @@ Pydantic schemas for request/response validation.
 Clean data models with type safety.
 """
 from datetime import datetime, timezone
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional
+from pydantic import BaseModel, Field, FieldSerializationInfo, field_serializer, field_validator
+from typing import List, Optional, Tuple, Union
+from typing_extensions import NotRequired, TypedDict
 
 
 class Transaction(BaseModel):
     """Incoming transaction data for fraud evaluation."""
-    user_id: str = Field(..., description="Unique user identifier")
+    user_id: str = Field(..., max_length=128, description="Unique user identifier")
     amount: float = Field(..., gt=0, description="Transaction amount")
     currency: str = Field(..., min_length=3, max_length=3, description="ISO currency code")
     country: str = Field(..., min_length=2, max_length=2, description="ISO country code")
-    merchant: str = Field(..., description="Merchant name or category")
+    merchant: str = Field(..., max_length=256, description="Merchant name or category")
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), description="Transaction timestamp (UTC)")
+    latitude: Optional[float] = Field(None, ge=-90, le=90, description="Transaction latitude (optional, precise travel distance)")
+    longitude: Optional[float] = Field(None, ge=-180, le=180, description="Transaction longitude (optional, precise travel distance)")
+    transaction_id: Optional[str] = Field(None, min_length=1, max_length=128, description="Gateway transaction id (optional): a retry with the same user_id and transaction_id gets the first result back, without being evaluated again")
 
     @field_validator('timestamp')
     @classmethod
@@ -39,6 +43,42 @@ class Transaction(BaseModel):
         }
 
 
+class TransactionRecord:
+    """
+    Compact transaction decoded by the fast JSON path (app.utils.serialization),
+    which has already enforced every Transaction constraint; timestamp is UTC.
+    Reads like a Transaction.
+    """
+    __slots__ = ("user_id", "amount", "currency", "country", "merchant", "timestamp", "latitude", "longitude", "transaction_id")
+
+    def __init__(
+        self, user_id: str, amount: float, currency: str, country: str, merchant: str, timestamp: datetime,
+        latitude: Optional[float] = None, longitude: Optional[float] = None, transaction_id: Optional[str] = None,
+    ):
+        self.user_id = user_id
+        self.amount = amount
+        self.currency = currency
+        self.country = country
+        self.merchant = merchant
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.transaction_id = transaction_id
+
+    def to_transaction(self) -> Transaction:
+        """The Transaction (request model) for this record."""
+        return Transaction.model_construct(**{field: getattr(self, field) for field in self.__slots__})
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (TransactionRecord, Transaction)):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"TransactionRecord({fields})"
+
+
 class RuleTrigger(BaseModel):
     """Individual rule that was triggered during evaluation."""
     rule_name: str
@@ -46,6 +86,47 @@ class RuleTrigger(BaseModel):
     score_contribution: int
 
 
+class RenderedTrigger(TypedDict):
+    """A trigger as serialized in responses (RuleTrigger fields; reason left out on request)."""
+    rule_name: str
+    reason: NotRequired[str]
+    score_contribution: int
+
+
+class TriggerRecord:
+    """
+    Lightweight trigger as returned by rules: rule name, score and the raw
+    values of the reason. The reason text (template.format(*params)) is only
+    rendered when read or when the result is serialized.
+    Reads like a RuleTrigger.
+    """
+    __slots__ = ("rule_name", "score_contribution", "template", "params")
+
+    def __init__(self, rule_name: str, score_contribution: int, template: str, params: Tuple = ()):
+        self.rule_name = rule_name
+        self.score_contribution = score_contribution
+        self.template = template
+        self.params = params
+
+    @property
+    def reason(self) -> str:
+        return self.template.format(*self.params)
+
+    def to_rule_trigger(self) -> RuleTrigger:
+        """The RuleTrigger (response model) for this trigger."""
+        return RuleTrigger(rule_name=self.rule_name, reason=self.reason, score_contribution=self.score_contribution)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (TriggerRecord, RuleTrigger)):
+            return NotImplemented
+        return (self.rule_name, self.score_contribution, self.reason) == (
+            other.rule_name, other.score_contribution, other.reason
+        )
+
+    def __repr__(self) -> str:
+        return f"TriggerRecord(rule_name={self.rule_name!r}, score_contribution={self.score_contribution}, params={self.params!r})"
+
+
 class FraudResult(BaseModel):
     """Fraud evaluation result with risk level and triggered rules."""
     user_id: str
@@ -53,3 +134,22 @@ class FraudResult(BaseModel):
     total_score: int
     triggered_rules: List[RuleTrigger]
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    complete: bool = Field(True, description="False if decision-only evaluation skipped rules once the risk level was fixed (total_score and triggered_rules then cover only the rules run)")
+
+    @field_serializer("triggered_rules")
+    def _render_triggers(
+        self, triggered_rules: List[Union[RuleTrigger, TriggerRecord]], info: FieldSerializationInfo
+    ) -> List[RenderedTrigger]:
+        """
+        Engine results hold TriggerRecords (see build_result); reasons are rendered
+        here, or left out with context={"reasons": False} (see app.utils.serialization).
+        """
+        if info.context and not info.context.get("reasons", True):
+            return [
+                {"rule_name": trigger.rule_name, "score_contribution": trigger.score_contribution}
+                for trigger in triggered_rules
+            ]
+        return [
+            {"rule_name": trigger.rule_name, "reason": trigger.reason, "score_contribution": trigger.score_contribution}
+            for trigger in triggered_rules
+        ]
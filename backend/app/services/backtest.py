@@ -0,0 +1,312 @@
+"""
+Backtesting many rule configurations in one pass over a dataset.
+Every chunk of transactions is turned into columns and run through the
+stateful rules once; each candidate configuration (weights, thresholds, risk
+bands) is then a few vectorized operations over those shared columns.
+Trade-off: Covers the built-in rules' parameters only (custom rules and
+reason text are left out) vs a full engine run per configuration.
+"""
+import itertools
+import os
+import tempfile
+import time
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from app.schemas import Transaction
+from app.services.batch import TransactionBatch
+from app.services.rules.country_change_rule import CountryChangeRule
+from app.services.rules.impossible_travel_rule import ImpossibleTravelRule
+from app.services.rules.round_amount_rule import RoundAmountRule
+from app.services.rules.velocity_rule import VelocityRule
+from app.services.state_store import UserStateStore
+
+# Rule keys in configurations -> rule names (as in /rules), in engine order
+RULES = {
+    "impossible_travel": "Impossible Travel Rule",
+    "velocity": "Velocity Rule",
+    "country_risk": "Country Risk Rule",
+    "round_amount": "Round Amount Rule",
+    "high_amount": "High Amount Rule",
+    "unusual_time": "Unusual Time Rule",
+}
+# FraudEngine's weights
+DEFAULT_WEIGHTS = {
+    "impossible_travel": 70, "velocity": 50, "country_risk": 40, "round_amount": 35, "high_amount": 30, "unusual_time": 25,
+}
+RISK_LEVELS = ("LOW", "MEDIUM", "HIGH")
+
+SCORE_DTYPE = np.dtype("<i4")
+
+
+class BacktestConfig:
+    """
+    One candidate configuration. Defaults are the engine's: HighAmountRule
+    threshold, VelocityRule max_transactions / time_window_minutes,
+    UnusualTimeRule hours [start, end), and the calculate_risk_level bands
+    (MEDIUM from medium_score, HIGH from high_score).
+    """
+
+    PARAMETERS = (
+        "high_amount_threshold", "velocity_max_transactions", "velocity_window_minutes",
+        "unusual_start_hour", "unusual_end_hour", "medium_score", "high_score",
+    )
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        weights: Optional[Dict[str, int]] = None,
+        high_amount_threshold: float = 1000.0,
+        velocity_max_transactions: int = 3,
+        velocity_window_minutes: int = 10,
+        unusual_start_hour: int = 1,
+        unusual_end_hour: int = 5,
+        medium_score: int = 50,
+        high_score: int = 100,
+    ):
+        unknown = set(weights or ()) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown rules in weights: {sorted(unknown)} (expected {list(RULES)})")
+        self.name = name or "default"
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.high_amount_threshold = float(high_amount_threshold)
+        self.velocity_max_transactions = int(velocity_max_transactions)
+        self.velocity_window_minutes = int(velocity_window_minutes)
+        self.unusual_start_hour = int(unusual_start_hour)
+        self.unusual_end_hour = int(unusual_end_hour)
+        self.medium_score = int(medium_score)
+        self.high_score = int(high_score)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BacktestConfig":
+        unknown = set(data) - {"name", "weights", *cls.PARAMETERS}
+        if unknown:
+            raise ValueError(f"Unknown configuration keys: {sorted(unknown)}")
+        return cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "weights": dict(self.weights), **{key: getattr(self, key) for key in self.PARAMETERS}}
+
+
+def config_grid(axes: Dict[str, Any]) -> List[BacktestConfig]:
+    """
+    Every combination of the values in `axes`, e.g.
+    {"high_amount_threshold": [500, 1000], "weights": {"velocity": [40, 50, 60]}}
+    gives 6 configurations. A single value counts as a one-value axis. Each
+    configuration is named after its values on the axes with more than one.
+    """
+    names: List[str] = []
+    values: List[List[Any]] = []
+    for key, value in axes.items():
+        if key == "weights":
+            for rule, weights in value.items():
+                names.append(f"weights.{rule}")
+                values.append(weights if isinstance(weights, list) else [weights])
+        else:
+            names.append(key)
+            values.append(value if isinstance(value, list) else [value])
+
+    configs = []
+    for combination in itertools.product(*values):
+        data: Dict[str, Any] = {"weights": {}}
+        for key, value in zip(names, combination):
+            if key.startswith("weights."):
+                data["weights"][key[len("weights."):]] = value
+            else:
+                data[key] = value
+        varied = [f"{key}={value}" for key, value, axis in zip(names, combination, values) if len(axis) > 1]
+        data["name"] = ",".join(varied) or "default"
+        configs.append(BacktestConfig.from_dict(data))
+    return configs
+
+
+def configs_from_json(data: Any) -> List[BacktestConfig]:
+    """A grid (JSON object of axes, see config_grid) or an explicit list of configuration objects."""
+    if isinstance(data, dict):
+        return config_grid(data)
+    if isinstance(data, list):
+        return [BacktestConfig.from_dict({"name": f"config-{i}", **item}) for i, item in enumerate(data)]
+    raise ValueError("expected a JSON object (grid) or a list of configurations")
+
+
+class Backtest:
+    """
+    Scores transactions, chunk by chunk in evaluation order, under every configuration.
+
+    Per chunk, configuration-independent work runs once: building the
+    TransactionBatch, the impossible travel, country and round amount rules'
+    triggers, and one velocity window count per distinct window (each window
+    keeps its own per-user history). Configurations then differ only in
+    NumPy expressions over those columns, so the cost per extra configuration
+    is a few passes over a score row rather than a rule run.
+
+    Rule state is private to the backtest (starts empty, never touches the
+    engine's store). With the default configuration, scores and risk levels
+    equal FraudEngine.evaluate_batch() over the same transactions from empty
+    state (built-in rules only).
+    """
+
+    def __init__(
+        self, configs: Sequence[BacktestConfig], max_users: int = 1_000_000, ttl: timedelta = timedelta(hours=24),
+    ):
+        if not configs:
+            raise ValueError("at least one configuration is needed")
+        self.configs = list(configs)
+        windows = sorted({config.velocity_window_minutes for config in self.configs})
+        self._velocity = [
+            VelocityRule(max_transactions=0, time_window_minutes=window, state_store=UserStateStore(
+                ttl=ttl, max_users=max_users, sweep_interval_seconds=0,
+            ))
+            for window in windows
+        ]
+        for rule in self._velocity:
+            rule.state_store.require_horizon(rule.state_horizon)
+        # Travel state shares the first window's store (different fields, like the engine)
+        self._travel = ImpossibleTravelRule(state_store=self._velocity[0].state_store)
+        self._travel.state_store.require_horizon(self._travel.state_horizon)
+        self._country = CountryChangeRule()
+        self._round = RoundAmountRule()
+
+        def column(values, dtype) -> np.ndarray:
+            return np.array(values, dtype=dtype)[:, None]
+
+        configs = self.configs
+        self._weights = {rule: column([config.weights[rule] for config in configs], np.int32) for rule in RULES}
+        self._window = column([windows.index(config.velocity_window_minutes) for config in configs], np.int64)[:, 0]
+        self._max_transactions = column([config.velocity_max_transactions for config in configs], np.int64)
+        self._thresholds = column([config.high_amount_threshold for config in configs], np.float64)
+        self._start_hours = column([config.unusual_start_hour for config in configs], np.int64)
+        self._end_hours = column([config.unusual_end_hour for config in configs], np.int64)
+        self._medium = column([config.medium_score for config in configs], np.int32)
+        self._high = column([config.high_score for config in configs], np.int32)
+
+        self.transactions = 0
+        self.seconds = 0.0
+        self._levels = np.zeros((len(configs), len(RISK_LEVELS)), dtype=np.int64)
+        self._score_sums = np.zeros(len(configs), dtype=np.int64)
+        self._triggers = {rule: np.zeros(len(configs), dtype=np.int64) for rule in RULES}
+
+    def add(self, transactions: Sequence[Transaction]) -> np.ndarray:
+        """
+        Evaluate the next chunk (in evaluation order) under every configuration.
+
+        Returns:
+            int32 scores, shape (configurations, len(transactions))
+        """
+        start = time.perf_counter()
+        batch = TransactionBatch(transactions)
+        size = batch.size
+
+        def mask(rows: Iterable[int]) -> np.ndarray:
+            fired = np.zeros(size, dtype=bool)
+            fired[list(rows)] = True
+            return fired
+
+        # Shared by every configuration
+        travel = mask(self._travel.evaluate_batch(batch))
+        country = mask(self._country.evaluate_batch(batch))
+        round_amount = mask(self._round.evaluate_batch(batch))
+        window_counts = np.stack([rule.window_counts(batch) for rule in self._velocity])
+
+        # Per configuration (rows), per transaction (columns)
+        fired = {
+            "impossible_travel": travel[None, :],
+            "velocity": window_counts[self._window] > self._max_transactions,
+            "country_risk": country[None, :],
+            "round_amount": round_amount[None, :],
+            "high_amount": batch.amounts[None, :] > self._thresholds,
+            "unusual_time": (batch.hours[None, :] >= self._start_hours) & (batch.hours[None, :] < self._end_hours),
+        }
+        scores = np.zeros((len(self.configs), size), dtype=SCORE_DTYPE)
+        for rule, rows in fired.items():
+            scores += rows * self._weights[rule]
+            self._triggers[rule] += np.count_nonzero(rows, axis=1)
+
+        high = np.count_nonzero(scores >= self._high, axis=1)
+        medium = np.count_nonzero(scores >= self._medium, axis=1) - high
+        self._levels += np.stack([size - medium - high, medium, high], axis=1)
+        self._score_sums += scores.sum(axis=1, dtype=np.int64)
+        self.transactions += size
+        self.seconds += time.perf_counter() - start
+        return scores
+
+    @staticmethod
+    def risk_levels(scores: np.ndarray, config: BacktestConfig) -> np.ndarray:
+        """Risk level index (0 = LOW, 1 = MEDIUM, 2 = HIGH, see RISK_LEVELS) of one configuration's scores."""
+        return (scores >= config.medium_score).astype(np.int8) + (scores >= config.high_score)
+
+    def summary(self) -> Dict[str, Any]:
+        """Per configuration: risk level counts and shares, mean score and each rule's trigger count."""
+        results = []
+        for index, config in enumerate(self.configs):
+            levels = self._levels[index].tolist()
+            results.append({
+                **config.to_dict(),
+                "risk_levels": dict(zip(RISK_LEVELS, levels)),
+                "risk_level_shares": {
+                    level: count / self.transactions if self.transactions else 0.0
+                    for level, count in zip(RISK_LEVELS, levels)
+                },
+                "mean_score": int(self._score_sums[index]) / self.transactions if self.transactions else None,
+                "triggered_rules": {RULES[rule]: int(counts[index]) for rule, counts in self._triggers.items()},
+            })
+        return {
+            "configs": len(self.configs),
+            "transactions": self.transactions,
+            "seconds": self.seconds,
+            "transactions_per_second": self.transactions / self.seconds if self.seconds else None,
+            "results": results,
+        }
+
+
+class ScoreWriter:
+    """
+    The configurations × transactions score matrix as an .npy file, written
+    chunk by chunk although the number of transactions is only known at the end.
+
+    Chunks are appended to a spill file transaction-major (one row of scores
+    per transaction), then transposed block by block into the .npy file on
+    close(). With `records_path`, the input record number of every column is
+    saved as an int64 .npy as well.
+    """
+
+    def __init__(self, path: str, configs: int, records_path: Optional[str] = None, block: int = 1 << 16):
+        self.path = path
+        self.configs = configs
+        self.records_path = records_path
+        self.block = block
+        self.count = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        self._rows = tempfile.NamedTemporaryFile(dir=directory, prefix=".scores-", suffix=".rows", delete=False)
+        self._records = (
+            tempfile.NamedTemporaryFile(dir=directory, prefix=".records-", suffix=".rows", delete=False)
+            if records_path else None
+        )
+
+    def write(self, scores: np.ndarray, records: Optional[Sequence[int]] = None) -> None:
+        self._rows.write(np.ascontiguousarray(scores.T, dtype=SCORE_DTYPE).tobytes())
+        if self._records is not None:
+            self._records.write(np.asarray(records, dtype="<i8").tobytes())
+        self.count += scores.shape[1]
+
+    def close(self) -> None:
+        try:
+            self._rows.close()
+            matrix = np.lib.format.open_memmap(self.path, mode="w+", dtype=SCORE_DTYPE, shape=(self.configs, self.count))
+            if self.count:
+                rows = np.memmap(self._rows.name, dtype=SCORE_DTYPE, mode="r", shape=(self.count, self.configs))
+                for start in range(0, self.count, self.block):
+                    matrix[:, start:start + self.block] = rows[start:start + self.block].T
+                del rows
+            matrix.flush()
+            del matrix
+            if self._records is not None:
+                self._records.close()
+                records = np.fromfile(self._records.name, dtype="<i8")
+                np.save(self.records_path, records)
+        finally:
+            os.remove(self._rows.name)
+            if self._records is not None:
+                os.remove(self._records.name)
@@ -0,0 +1,426 @@
+"""
+Multi-process deployment: users pinned to engine worker processes by consistent hashing.
+Trade-off: One IPC round trip per request vs per-user state that survives
+using every core (uvicorn --workers N would split each user's history).
+"""
+import atexit
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from app.schemas import Transaction, FraudResult
+from app.services.batch import take_rows, user_ids_of
+from app.services.metrics import Snapshot, metrics
+
+# Spawned (not forked) workers: the API process runs threads, which fork does not copy safely
+_CONTEXT = multiprocessing.get_context("spawn")
+
+# Rule metadata for /rules (the rules themselves live in the workers)
+RuleInfo = namedtuple("RuleInfo", ["name", "score_weight"])
+
+
+class HashRing:
+    """
+    Consistent hash ring over worker indices.
+
+    Each worker owns `replicas` points on a crc32 ring; a user belongs to the
+    first point clockwise from crc32(user_id). When a worker is down its users
+    move to the next live worker on the ring, and only they move.
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64):
+        self.nodes = nodes
+        self.replicas = replicas
+        points = sorted(
+            (zlib.crc32(f"worker-{node}:{replica}".encode()), node)
+            for node in range(nodes) for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, user_id: str, alive: Optional[Sequence[bool]] = None) -> int:
+        """Worker owning user_id, skipping workers marked not alive."""
+        position = bisect_right(self._hashes, zlib.crc32(user_id.encode("utf-8")))
+        for step in range(len(self._owners)):
+            node = self._owners[(position + step) % len(self._owners)]
+            if alive is None or alive[node]:
+                return node
+        raise RuntimeError("No engine workers available")
+
+
+# --- Engine worker process ---------------------------------------------------
+
+
+def _serve(index: int, address: str, authkey: bytes) -> None:
+    """Worker main: one FraudEngine, one thread per router connection."""
+    from app.services.fraud_engine import FraudEngine
+
+    # Each worker snapshots and logs its own users; SIGTERM exits normally so the final snapshot runs
+    if os.getenv("CREDITGUARD_SNAPSHOT_PATH"):
+        os.environ["CREDITGUARD_SNAPSHOT_PATH"] += f".worker-{index}"
+    if os.getenv("CREDITGUARD_EVENT_LOG_DIR"):
+        os.environ["CREDITGUARD_EVENT_LOG_DIR"] = os.path.join(os.environ["CREDITGUARD_EVENT_LOG_DIR"], f"worker-{index}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    engine = FraudEngine()
+    # Accept connections only once warm-started: the router treats a listening worker as ready
+    engine.wait_ready()
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        while True:
+            connection = listener.accept()
+            threading.Thread(
+                target=_handle, args=(engine, connection), name=f"engine-{index}", daemon=True
+            ).start()
+
+
+def _handle(engine, connection: Connection) -> None:
+    """Answer (operation, args) messages with ("ok", value) or ("error", message)."""
+    with connection:
+        while True:
+            try:
+                operation, args = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _OPERATIONS[operation](engine, *args))
+            except Exception as e:
+                reply = ("error", f"{type(e).__name__}: {e}")
+            connection.send(reply)
+
+
+def _evaluate(engine, transactions: List[Transaction], decision_only: bool = False) -> List[FraudResult]:
+    if len(transactions) == 1:
+        return [engine.evaluate(transactions[0], decision_only)]
+    return engine.evaluate_batch(transactions)
+
+
+def _hand_off(engine, owner: int, nodes: int, replicas: int) -> List[Dict[str, Any]]:
+    """Export and drop the state of every user that `owner` owns on the full ring."""
+    store = engine.state_store
+    if store.shared:
+        return [{} for _ in engine.rules]
+    if not store.tracks_user_ids:
+        raise RuntimeError(f"{type(store).__name__} cannot list its users to hand them off")
+    ring = HashRing(nodes, replicas)
+    users = [user_id for user_id in store.users() if ring.node_for(user_id) == owner]
+    with store.users_locked(users):
+        states = [rule.export_user_state(users) for rule in engine.rules]
+        store.discard(users)
+    return states
+
+
+def _take_over(engine, states: List[Dict[str, Any]]) -> None:
+    for rule, rule_states in zip(engine.rules, states):
+        if rule_states:
+            rule.import_user_state(rule_states)
+    # Imported state is not in this worker's event log: make it durable now
+    if any(states):
+        engine.checkpoint()
+
+
+_OPERATIONS = {
+    "evaluate": _evaluate,
+    "hand_off": _hand_off,
+    "take_over": _take_over,
+    "rules": lambda engine: [(rule.name, rule.score_weight) for rule in engine.rules],
+    "stats": lambda engine: engine.stats(),
+    "metrics": lambda engine: metrics.snapshot(),
+}
+
+
+# --- Router side -------------------------------------------------------------
+
+
+class WorkerUnavailable(ConnectionError):
+    """Raised when an engine worker process cannot be reached."""
+
+
+class _Worker:
+    """Router-side handle: process, socket address and a pool of open connections."""
+
+    def __init__(self, index: int, address: str):
+        self.index = index
+        self.address = address
+        self.process: Optional[multiprocessing.Process] = None
+        self.restarts = 0
+        self.connections: "queue.SimpleQueue[Connection]" = queue.SimpleQueue()
+
+
+class ClusterEngine:
+    """
+    FraudEngine stand-in that routes each user to a fixed engine worker process.
+
+    Drop-in for the API layer: evaluate(), evaluate_batch(), rules and stats().
+    Workers are FraudEngine processes listening on unix sockets; the router
+    hashes user_id onto a HashRing, so all of a user's transactions - and
+    therefore their velocity and travel state - stay in one process.
+
+    Batches are split by worker, sent to all workers at once and reassembled
+    in input order. Results match a single FraudEngine.
+
+    Worker restarts (supervisor thread):
+    1. A worker that dies is marked down; its users route to the next live
+       worker on the ring (their state in the dead process is lost)
+    2. The worker is restarted on the same socket
+    3. Traffic pauses while every live worker hands back the state of users
+       the restarted worker owns, which the restarted worker imports
+    4. The worker is marked live again and owns its users as before
+    """
+
+    # Seconds to wait for a (re)started worker to accept connections
+    START_TIMEOUT_SECONDS = 30.0
+
+    # Supervisor liveness check period
+    SUPERVISE_INTERVAL_SECONDS = 0.5
+
+    def __init__(self, workers: int, replicas: int = 64):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.ring = HashRing(workers, replicas)
+        self._authkey = os.urandom(32)
+        self._socket_dir = tempfile.mkdtemp(prefix="creditguard-")
+        self._workers = [
+            _Worker(index, os.path.join(self._socket_dir, f"engine-{index}.sock"))
+            for index in range(workers)
+        ]
+        self._alive = [False] * workers
+
+        # Gate: requests run concurrently; a rebalance waits for them and holds new ones back
+        self._gate = threading.Condition()
+        self._in_flight = 0
+        self._paused = False
+
+        for worker in self._workers:
+            self._start(worker)
+            self._alive[worker.index] = True
+        self.rules = [RuleInfo(*info) for info in self._call(self._workers[0], "rules")]
+
+        self._stop = threading.Event()
+        self._supervisor = threading.Thread(target=self._supervise, name="cluster-supervisor", daemon=True)
+        self._supervisor.start()
+        atexit.register(self.close)
+
+    # --- FraudEngine interface ----------------------------------------------
+
+    def evaluate(self, transaction: Transaction, decision_only: bool = False) -> FraudResult:
+        return self._route([transaction], decision_only)[0]
+
+    def evaluate_batch(self, transactions: List[Transaction], workers: int = 1) -> List[FraudResult]:
+        """
+        Evaluate a batch across the engine workers, in input order.
+
+        `workers` is accepted for interface compatibility; parallelism comes
+        from the engine worker processes.
+        """
+        return self._route(transactions)
+
+    # --- Routing ------------------------------------------------------------
+
+    def _route(self, transactions: List[Transaction], decision_only: bool = False) -> List[FraudResult]:
+        """Evaluate rows on their users' workers, retrying rows of failed workers."""
+        results: List[Optional[FraudResult]] = [None] * len(transactions)
+        pending = list(range(len(transactions)))
+        with self._routing():
+            # Retry rows whose worker failed: they route to the next live worker
+            for _ in range(len(self._workers) + 1):
+                if not pending:
+                    break
+                pending = self._evaluate_rows(transactions, pending, results, decision_only)
+        if pending:
+            raise WorkerUnavailable("No engine worker could evaluate the batch")
+        return results
+
+    @property
+    def ready(self) -> bool:
+        """True while every worker is up (started workers have warm-started) and no rebalance runs."""
+        return all(self._alive) and not self._paused
+
+    def stats(self) -> Dict[str, object]:
+        """Per-worker liveness, restarts and state store stats."""
+        workers = []
+        for worker in self._workers:
+            entry: Dict[str, object] = {
+                "worker": worker.index,
+                "pid": worker.process.pid if worker.process else None,
+                "alive": self._alive[worker.index],
+                "restarts": worker.restarts,
+            }
+            if self._alive[worker.index]:
+                try:
+                    entry.update(self._call(worker, "stats"))
+                except WorkerUnavailable:
+                    entry["alive"] = False
+            workers.append(entry)
+        return {"workers": workers}
+
+    def worker_metrics(self) -> List[Snapshot]:
+        """Metrics snapshots of the live engine workers (engine and rule series are recorded there)."""
+        snapshots = []
+        for worker in self._workers:
+            if self._alive[worker.index]:
+                try:
+                    snapshots.append(self._call(worker, "metrics"))
+                except WorkerUnavailable:
+                    pass
+        return snapshots
+
+    def close(self) -> None:
+        """Stop the supervisor and the engine workers."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        for worker in self._workers:
+            self._alive[worker.index] = False
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def _evaluate_rows(self, transactions, rows: List[int], results: List, decision_only: bool = False) -> List[int]:
+        """Send rows to their workers (all at once), fill results; returns rows to retry."""
+        by_worker: Dict[int, List[int]] = {}
+        user_ids = user_ids_of(transactions)
+        for row in rows:
+            node = self.ring.node_for(user_ids[row], self._alive)
+            by_worker.setdefault(node, []).append(row)
+
+        sent = []
+        failed: List[int] = []
+        for node, node_rows in by_worker.items():
+            worker = self._workers[node]
+            try:
+                connection = self._checkout(worker)
+                connection.send(("evaluate", (take_rows(transactions, node_rows), decision_only)))
+                sent.append((worker, connection, node_rows))
+            except (OSError, EOFError, WorkerUnavailable):
+                self._mark_down(worker)
+                failed.extend(node_rows)
+
+        # Every reply is read (and its connection returned) before an error is raised
+        error = None
+        for worker, connection, node_rows in sent:
+            try:
+                status, value = connection.recv()
+            except (OSError, EOFError):
+                connection.close()
+                self._mark_down(worker)
+                failed.extend(node_rows)
+                continue
+            worker.connections.put(connection)
+            if status == "error":
+                error = error or value
+                continue
+            for row, result in zip(node_rows, value):
+                results[row] = result
+        if error is not None:
+            raise RuntimeError(error)
+        return failed
+
+    @contextmanager
+    def _routing(self) -> Iterator[None]:
+        """Count an in-flight request (waits while a rebalance is moving state)."""
+        with self._gate:
+            self._gate.wait_for(lambda: not self._paused)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._gate:
+                self._in_flight -= 1
+                self._gate.notify_all()
+
+    def _call(self, worker: _Worker, operation: str, *args) -> Any:
+        """One request/reply round trip to a worker."""
+        try:
+            connection = self._checkout(worker)
+            connection.send((operation, args))
+            status, value = connection.recv()
+        except (OSError, EOFError) as e:
+            raise WorkerUnavailable(f"Engine worker {worker.index} unavailable: {e}") from e
+        worker.connections.put(connection)
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    def _checkout(self, worker: _Worker) -> Connection:
+        try:
+            return worker.connections.get_nowait()
+        except queue.Empty:
+            return Client(worker.address, family="AF_UNIX", authkey=self._authkey)
+
+    # --- Supervision --------------------------------------------------------
+
+    def _start(self, worker: _Worker) -> None:
+        """(Re)start a worker process and wait until it accepts connections."""
+        if os.path.exists(worker.address):
+            os.unlink(worker.address)
+        worker.connections = queue.SimpleQueue()
+        worker.process = _CONTEXT.Process(
+            target=_serve, args=(worker.index, worker.address, self._authkey),
+            name=f"creditguard-engine-{worker.index}", daemon=True,
+        )
+        worker.process.start()
+
+        deadline = time.monotonic() + self.START_TIMEOUT_SECONDS
+        while True:
+            try:
+                worker.connections.put(Client(worker.address, family="AF_UNIX", authkey=self._authkey))
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not worker.process.is_alive() or time.monotonic() > deadline:
+                    raise WorkerUnavailable(f"Engine worker {worker.index} failed to start")
+                time.sleep(0.05)
+
+    def _mark_down(self, worker: _Worker) -> None:
+        self._alive[worker.index] = False
+
+    def _supervise(self) -> None:
+        while not self._stop.wait(self.SUPERVISE_INTERVAL_SECONDS):
+            for worker in self._workers:
+                if self._stop.is_set():
+                    return
+                if self._alive[worker.index] and worker.process.is_alive():
+                    continue
+                try:
+                    self._restart(worker)
+                except WorkerUnavailable:
+                    continue  # retried on the next round
+
+    def _restart(self, worker: _Worker) -> None:
+        """Restart a dead worker, then move its users' state back to it."""
+        self._mark_down(worker)
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        self._start(worker)
+        worker.restarts += 1
+
+        with self._gate:
+            self._paused = True
+            self._gate.wait_for(lambda: self._in_flight == 0)
+        try:
+            for other in self._workers:
+                if other is worker or not self._alive[other.index]:
+                    continue
+                try:
+                    states = self._call(other, "hand_off", worker.index, self.ring.nodes, self.ring.replicas)
+                except WorkerUnavailable:
+                    self._mark_down(other)  # restarted (and rebalanced) in its own turn
+                    continue
+                self._call(worker, "take_over", states)
+            self._alive[worker.index] = True
+        finally:
+            with self._gate:
+                self._paused = False
+                self._gate.notify_all()
@@ -0,0 +1,67 @@
+"""
+Feature extraction: everything rules read about a transaction, computed once.
+Trade-off: A fixed record built for every transaction vs each rule re-deriving
+fields and fetching per-user state on its own.
+"""
+from typing import Optional, Tuple
+from app.schemas import Transaction
+from app.services.batch import MICROSECONDS_PER_HOUR, to_epoch_us
+from app.services.state_store import NIL, StateStore
+
+
+class TransactionFeatures:
+    """
+    Compact per-transaction record shared by every rule's evaluate().
+
+    Transaction fields:
+    - transaction: the validated Transaction (for fields not extracted here)
+    - user_id, amount, country, merchant, latitude, longitude
+    - timestamp_us: int microseconds since epoch (exact)
+    - hour: UTC hour of day (0-23)
+    - whole_dollar: amount has no cents
+
+    Per-user state, fetched before any rule runs (NIL / None without a store):
+    - slot: the user's state store slot (touched at timestamp_us)
+    - last_transaction: (country, epoch us) of the user's previous transaction
+    - last_position: (latitude, longitude) of it, fetched only when this
+      transaction has coordinates
+
+    The batch path's equivalent is TransactionBatch (one column per feature).
+    """
+
+    __slots__ = (
+        "transaction", "user_id", "amount", "country", "merchant", "latitude", "longitude",
+        "timestamp_us", "hour", "whole_dollar", "slot", "last_transaction", "last_position",
+    )
+
+    def __init__(self, transaction: Transaction):
+        self.transaction = transaction
+        self.user_id = transaction.user_id
+        self.amount = transaction.amount
+        self.country = transaction.country
+        self.merchant = transaction.merchant
+        self.latitude = transaction.latitude
+        self.longitude = transaction.longitude
+        self.timestamp_us = to_epoch_us(transaction.timestamp)
+        self.hour = self.timestamp_us // MICROSECONDS_PER_HOUR % 24
+        self.whole_dollar = self.amount % 1.0 == 0.0
+        self.slot = NIL
+        self.last_transaction: Optional[Tuple[str, int]] = None
+        self.last_position: Optional[Tuple[float, float]] = None
+
+
+def extract_features(transaction: Transaction, state_store: Optional[StateStore] = None) -> TransactionFeatures:
+    """
+    Feature record for one transaction.
+
+    With a state store, the user's slot is touched and their stored state read
+    into the record; call this and run the rules under
+    state_store.user_lock(transaction.user_id) (slots are only valid under it).
+    """
+    features = TransactionFeatures(transaction)
+    if state_store is not None:
+        features.slot = state_store.touch(features.user_id, features.timestamp_us)
+        features.last_transaction = state_store.last_transaction(features.slot)
+        if features.latitude is not None and features.longitude is not None:
+            features.last_position = state_store.last_position(features.slot)
+    return features
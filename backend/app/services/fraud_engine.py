@@ -2,8 +2,20 @@
 Fraud Engine: Orchestrates rule evaluation and scoring.
 Clean separation: Rules define logic, Engine coordinates execution.
 """
-from typing import List
-from app.schemas import Transaction, FraudResult, RuleTrigger
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.schemas import Transaction, FraudResult, TriggerRecord
+from app.services.batch import evaluate_rules, take_rows, transaction_ids_of, user_ids_of
+from app.services.event_log import encode_payload, event_log_from_env
+from app.services.features import extract_features
+from app.services.idempotency import result_cache_from_env
+from app.services.metrics import BATCH_SIZE, ENGINE_SECONDS, EVALUATIONS, RULE_SECONDS, RULE_TRIGGERS, metrics
+from app.services.parallel import evaluate_sharded
+from app.services.rule_schedule import RuleScheduler
+from app.services.snapshot import snapshotter_from_env
+from app.services.state_store import state_store_from_env
 from app.services.rules.base_rule import BaseRule
 from app.services.rules.high_amount_rule import HighAmountRule
 from app.services.rules.country_change_rule import CountryChangeRule
@@ -11,7 +23,7 @@ from app.services.rules.velocity_rule import VelocityRule
 from app.services.rules.impossible_travel_rule import ImpossibleTravelRule
 from app.services.rules.unusual_time_rule import UnusualTimeRule
 from app.services.rules.round_amount_rule import RoundAmountRule
-from app.utils.scoring import calculate_risk_level
+from app.utils.scoring import build_result
 
 
 class FraudEngine:
@@ -23,6 +35,16 @@ class FraudEngine:
     _instance = None
     _initialized = False
 
+    # Below this size, process startup and pickling cost more than sharding saves
+    PARALLEL_MIN_BATCH = 10_000
+
+    # Below this size, building columns costs more than the vectorized rules save
+    # (per-row is ~1.5x faster at 64 rows, break-even near 256): rows take the per-transaction path
+    COLUMNAR_MIN_BATCH = 256
+
+    # Logged transactions replayed per batch evaluation on startup
+    REPLAY_CHUNK = 10_000
+
     def __new__(cls):
         """Singleton pattern: Ensure only one instance exists."""
         if cls._instance is None:
@@ -46,10 +68,13 @@ class FraudEngine:
         if FraudEngine._initialized:
             return
 
+        # Per-user state for stateful rules: bounded by TTL + max users, backend chosen by CREDITGUARD_STATE_*
+        self.state_store = state_store_from_env()
+
         self.rules: List[BaseRule] = [
             # Critical fraud signals
-            ImpossibleTravelRule(score_weight=70),
-            VelocityRule(max_transactions=3, time_window_minutes=10, score_weight=50),
+            ImpossibleTravelRule(score_weight=70, state_store=self.state_store),
+            VelocityRule(max_transactions=3, time_window_minutes=10, score_weight=50, state_store=self.state_store),
 
             # Geographic and behavioral patterns
             CountryChangeRule(score_weight=40),
@@ -59,43 +84,278 @@ class FraudEngine:
             HighAmountRule(threshold=1000.0, score_weight=30),
             UnusualTimeRule(score_weight=25),
         ]
+        for rule in self.rules:
+            self.state_store.require_horizon(rule.state_horizon)
+
+        # Rule order and early exit for decision-only evaluation (measured cost and hit rate)
+        self.scheduler = RuleScheduler()
+
+        # Results by (user_id, transaction_id): retried transactions are answered from here
+        # without touching rule state (None: CREDITGUARD_IDEMPOTENCY_MAX_ENTRIES=0)
+        self.result_cache = result_cache_from_env()
+
+        # Durability: every evaluated transaction goes to the event log (CREDITGUARD_EVENT_LOG_DIR),
+        # state is snapshotted periodically (CREDITGUARD_SNAPSHOT_PATH)
+        self.event_log = event_log_from_env()
+        self.snapshotter = snapshotter_from_env(self.state_store, self.event_log)
+        self.replayed_events = 0
+
+        # Warm start (snapshot + log replay) in the background, so startup stays fast;
+        # evaluations wait until it is done
+        self._ready = threading.Event()
+        if self.snapshotter is None and self.event_log is None:
+            self._ready.set()
+        else:
+            threading.Thread(target=self._warm_start, name="warm-start", daemon=True).start()
 
         FraudEngine._initialized = True
 
+    @property
+    def ready(self) -> bool:
+        """True once per-user state is loaded (warm start finished)."""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def _warm_start(self) -> None:
+        """Restore per-user state: the latest snapshot, then the logged events after it."""
+        try:
+            # State that outlived the restart (shared memory segment) is already current
+            if not len(self.state_store):
+                position = self.snapshotter.warm_start() if self.snapshotter is not None else 0
+                if self.event_log is not None:
+                    self.replayed_events = self._replay(position)
+                    self.event_log.advance(position)
+            if self.snapshotter is not None:
+                self.snapshotter.start()
+        finally:
+            self._ready.set()
+
+    def _replay(self, position: int) -> int:
+        """Re-run the stateful rules over logged events from `position` (results discarded)."""
+        stateful = [rule for rule in self.rules if rule.state_horizon > timedelta(0)]
+        replayed = 0
+        chunk: List[Transaction] = []
+        for transaction in self.event_log.replay(position):
+            chunk.append(transaction)
+            if len(chunk) == self.REPLAY_CHUNK:
+                evaluate_rules(stateful, chunk)
+                replayed += len(chunk)
+                chunk = []
+        if chunk:
+            evaluate_rules(stateful, chunk)
+            replayed += len(chunk)
+        return replayed
+
+    def checkpoint(self) -> None:
+        """Snapshot now (e.g. after importing state that is not in the event log)."""
+        if self.snapshotter is not None:
+            self.snapshotter.snapshot()
+
+    def stats(self) -> Dict[str, object]:
+        """Engine internals: size and evictions of the per-user state store, durability status."""
+        stats: Dict[str, object] = {
+            "ready": self.ready, "state_store": self.state_store.stats(), "rule_schedule": self.scheduler.stats()
+        }
+        if self.result_cache is not None:
+            stats["idempotency"] = self.result_cache.stats()
+        if self.snapshotter is not None:
+            stats["snapshots"] = self.snapshotter.stats()
+        if self.event_log is not None:
+            stats["event_log"] = dict(self.event_log.stats(), replayed_events=self.replayed_events)
+        return stats
+
     def add_rule(self, rule: BaseRule) -> None:
-        """Add a custom rule to the engine (extensibility)."""
+        """
+        Add a custom rule to the engine (extensibility).
+        Its evaluate() receives the same feature record as the built-in rules.
+        """
+        self.state_store.require_horizon(rule.state_horizon)
         self.rules.append(rule)
 
-    def evaluate(self, transaction: Transaction) -> FraudResult:
+    def evaluate(self, transaction: Transaction, decision_only: bool = False) -> FraudResult:
         """
         Evaluate transaction against all rules.
 
         Process:
-        1. Run each rule's evaluate() method
-        2. Collect triggered rules
-        3. Sum scores
-        4. Map to risk level
+        1. Extract the transaction's features and per-user state once
+        2. Run each rule's evaluate() method on them
+        3. Collect triggered rules
+        4. Sum scores
+        5. Map to risk level
+
+        Args:
+            decision_only: Stop once the risk level cannot change (see
+                RuleScheduler). Stateful rules still always run; the result's
+                `complete` is False if rules were skipped.
 
         Returns:
             FraudResult with risk assessment
+
+        Every call's latency and triggers are counted (app.services.metrics);
+        each rule is timed on sampled calls only.
+
+        A transaction with a transaction_id that was already evaluated for this
+        user (within the result cache's TTL) gets the stored result back: no rule
+        runs, no state changes and nothing is logged.
+        """
+        if not self._ready.is_set():
+            self._ready.wait()
+        start = time.perf_counter()
+        triggered_rules: List[TriggerRecord] = []
+        cache = self.result_cache if transaction.transaction_id is not None else None
+
+        # The user's lock covers reading their state, every rule's update and the log append
+        # (per user, log order = the order state was updated). The event is encoded first:
+        # one that cannot be logged fails here, before any state changes.
+        log = self.event_log
+        event = encode_payload(transaction) if log is not None else None
+        with self.state_store.user_lock(transaction.user_id):
+            if cache is not None:
+                cached = cache.get(transaction.user_id, transaction.transaction_id)
+                if cached is not None:
+                    return cached
+            features = extract_features(transaction, self.state_store)
+
+            if decision_only:
+                triggered_rules, complete = self.scheduler.evaluate(self.rules, features)
+            elif metrics.sample():
+                for rule in self.rules:
+                    rule_start = time.perf_counter()
+                    trigger = rule.evaluate(features)
+                    RULE_SECONDS.observe((rule.name,), time.perf_counter() - rule_start)
+                    if trigger:
+                        triggered_rules.append(trigger)
+                complete = True
+            else:
+                # Evaluate each rule
+                for rule in self.rules:
+                    trigger = rule.evaluate(features)
+                    if trigger:
+                        triggered_rules.append(trigger)
+                complete = True
+            if log is not None:
+                log.extend_encoded((event,))
+            result = build_result(transaction.user_id, triggered_rules, complete)
+            if cache is not None:
+                # Stored before the lock is released: a concurrent retry waits for it, then hits
+                cache.put(transaction.user_id, transaction.transaction_id, result)
+
+        ENGINE_SECONDS.observe(("evaluate",), time.perf_counter() - start)
+        EVALUATIONS.inc(("decision" if decision_only else "full",))
+        for trigger in triggered_rules:
+            RULE_TRIGGERS.inc((trigger.rule_name,))
+        return result
+
+    def evaluate_batch(self, transactions: List[Transaction], workers: int = 1) -> List[FraudResult]:
         """
-        triggered_rules: List[RuleTrigger] = []
+        Evaluate a batch of transactions in columnar mode.
+
+        Process:
+        1. Convert the batch into NumPy columns once (TransactionBatch)
+        2. Run each rule's evaluate_batch() - vectorized masks where supported
+        3. Group triggers by row, keeping rule order
+        4. Score and map to risk level per row
+
+        Batches under COLUMNAR_MIN_BATCH skip 1-2: each row runs through the rules'
+        per-transaction evaluate(), still under one lock acquisition for the batch.
+
+        Results are identical to calling evaluate() on each transaction in order.
+        Stateful rules (velocity, impossible travel) group the batch by user,
+        seed from their stored per-user state and write the final state back.
+        Rules without a vectorized path fall back to per-transaction evaluation
+        in input order.
 
-        # Evaluate each rule
+        Args:
+            workers: >1 shards users across a process pool (large batches only).
+                Rules must be picklable, and stateful rules must implement the
+                export/import_user_state hooks.
+
+        The batch's users are locked for the whole call, so concurrent requests
+        for them wait instead of interleaving with the batch (other users proceed).
+
+        Transactions with a transaction_id already evaluated for their user (by an
+        earlier call, or earlier in this batch) get that result back and are not
+        evaluated again, exactly as with evaluate().
+        """
+        if not self._ready.is_set():
+            self._ready.wait()
+        start = time.perf_counter()
+        transaction_ids = transaction_ids_of(transactions) if self.result_cache is not None else None
+        with self.state_store.users_locked(set(user_ids_of(transactions))):
+            if transaction_ids is None:
+                results = self._evaluate_rows(transactions, workers)
+            else:
+                results = self._evaluate_idempotent(transactions, transaction_ids, workers)
+        ENGINE_SECONDS.observe(("evaluate_batch",), time.perf_counter() - start)
+        BATCH_SIZE.observe((), len(transactions))
+        return results
+
+    def _evaluate_rows(self, transactions: Sequence[Transaction], workers: int) -> List[FraudResult]:
+        """Columnar evaluation and logging of a batch (its users' locks held)."""
+        # Encoded before any rule runs: a batch with an event that cannot be logged changes nothing
+        events = [encode_payload(transaction) for transaction in transactions] if self.event_log is not None else None
+        if workers > 1 and len(transactions) >= self.PARALLEL_MIN_BATCH:
+            results = evaluate_sharded(self.rules, transactions, workers)
+            # The pool's processes do not report metrics: count triggers here
+            for result in results:
+                for trigger in result.triggered_rules:
+                    RULE_TRIGGERS.inc((trigger.rule_name,))
+        elif len(transactions) < self.COLUMNAR_MIN_BATCH:
+            results = [self._evaluate_row(transaction) for transaction in transactions]
+        else:
+            results = evaluate_rules(self.rules, transactions, record_metrics=True)
+        if events is not None:
+            self.event_log.extend_encoded(events)
+        EVALUATIONS.inc(("batch",), len(transactions))
+        return results
+
+    def _evaluate_row(self, transaction: Transaction) -> FraudResult:
+        """One row of a small batch through the per-transaction rules (its user's lock held)."""
+        features = extract_features(transaction, self.state_store)
+        triggered_rules = []
         for rule in self.rules:
-            trigger = rule.evaluate(transaction)
+            trigger = rule.evaluate(features)
             if trigger:
                 triggered_rules.append(trigger)
+                RULE_TRIGGERS.inc((trigger.rule_name,))
+        return build_result(transaction.user_id, triggered_rules)
 
-        # Calculate total score
-        total_score = sum(trigger.score_contribution for trigger in triggered_rules)
-
-        # Determine risk level
-        risk_level = calculate_risk_level(total_score)
-
-        return FraudResult(
-            user_id=transaction.user_id,
-            risk_level=risk_level,
-            total_score=total_score,
-            triggered_rules=triggered_rules
-        )
+    def _evaluate_idempotent(
+        self, transactions: Sequence[Transaction], transaction_ids: Sequence[Optional[str]], workers: int
+    ) -> List[FraudResult]:
+        """
+        A batch with transaction_ids: cached rows are answered from the result
+        cache, repeats within the batch get the result of their first occurrence,
+        and only the remaining rows are evaluated (in input order).
+        """
+        cache = self.result_cache
+        user_ids = user_ids_of(transactions)
+        results: List[Optional[FraudResult]] = [None] * len(transactions)
+        pending: List[int] = []
+        first_rows: Dict[Tuple[str, str], int] = {}
+        repeats: List[Tuple[int, Tuple[str, str]]] = []
+        for row, transaction_id in enumerate(transaction_ids):
+            if transaction_id is None:
+                pending.append(row)
+                continue
+            key = (user_ids[row], transaction_id)
+            if key in first_rows:
+                repeats.append((row, key))
+                continue
+            cached = cache.get(*key)
+            if cached is None:
+                first_rows[key] = row
+                pending.append(row)
+            else:
+                results[row] = cached
+        if pending:
+            evaluated = transactions if len(pending) == len(transactions) else take_rows(transactions, pending)
+            for row, result in zip(pending, self._evaluate_rows(evaluated, workers)):
+                results[row] = result
+        for key, row in first_rows.items():
+            cache.put(*key, results[row])
+        for row, key in repeats:
+            results[row] = cache.get(*key) or results[first_rows[key]]
+        return results
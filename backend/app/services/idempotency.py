@@ -0,0 +1,112 @@
+"""
+Idempotent evaluation: results of transactions that carry a transaction_id,
+kept so that a retried transaction gets its first result back without being
+evaluated (or counted in per-user rule state) again.
+Trade-off: A per-process cache (a retry reaching another API process, or one
+arriving after a restart, is evaluated again) vs a shared store to run.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.schemas import FraudResult
+from app.services.metrics import IDEMPOTENCY_LOOKUPS
+
+_HIT = ("hit",)
+_MISS = ("miss",)
+
+
+class ResultCache:
+    """
+    (user_id, transaction_id) -> FraudResult, least recently used first.
+
+    Bounded by `max_entries` (the least recently used entry is evicted) and by
+    `ttl_seconds` from when a result was stored (expired entries are dropped
+    when looked up, or when they reach the front of the LRU order). Keys
+    include the user_id, so a transaction_id reused by another user is a
+    different transaction.
+
+    The engine looks a transaction up and stores its result under the user's
+    lock, so a retry arriving while the first attempt is still being
+    evaluated waits for it and then hits.
+    """
+
+    def __init__(self, max_entries: int = 100_000, ttl_seconds: float = 3600.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, FraudResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_expired = 0
+        self.evicted_capacity = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str, transaction_id: str) -> Optional[FraudResult]:
+        """The stored result for this transaction, or None (counted as a hit or a miss)."""
+        key = (user_id, transaction_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.evicted_expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        IDEMPOTENCY_LOOKUPS.inc(_MISS if entry is None else _HIT)
+        return None if entry is None else entry[1]
+
+    def put(self, user_id: str, transaction_id: str, result: FraudResult) -> None:
+        now = time.monotonic()
+        key = (user_id, transaction_id)
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            entries = self._entries
+            while entries:
+                oldest, (expires, _) = next(iter(entries.items()))
+                if expires <= now:
+                    self.evicted_expired += 1
+                elif len(entries) > self.max_entries:
+                    self.evicted_capacity += 1
+                else:
+                    break
+                del entries[oldest]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted_expired": self.evicted_expired,
+            "evicted_capacity": self.evicted_capacity,
+        }
+
+
+def result_cache_from_env() -> Optional[ResultCache]:
+    """
+    Cache configured from CREDITGUARD_IDEMPOTENCY_* environment variables,
+    or None if CREDITGUARD_IDEMPOTENCY_MAX_ENTRIES is 0 (transaction_id ignored).
+    """
+    max_entries = int(os.getenv("CREDITGUARD_IDEMPOTENCY_MAX_ENTRIES", "100000"))
+    if max_entries <= 0:
+        return None
+    ttl_seconds = float(os.getenv("CREDITGUARD_IDEMPOTENCY_TTL_MINUTES", "60")) * 60
+    return ResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
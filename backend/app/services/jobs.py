@@ -0,0 +1,374 @@
+"""
+Background batch jobs: datasets submitted once, evaluated in chunks by a local
+worker pool, results spilled to disk and read back in pages or as a stream.
+Trade-off: Jobs live in this process (lost on restart, not shared between API
+processes) vs no external queue or result store to run.
+"""
+import atexit
+import fcntl
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.schemas import Transaction
+from app.services.batch import take_rows
+from app.utils.ndjson import evaluate_chunk, read_lines
+from app.utils.serialization import result_json
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+INPUT_FILE = "input.ndjson"
+RESULTS_FILE = "results.ndjson"
+# uint64 end offset of every result line in RESULTS_FILE (line i spans index[i-1]:index[i])
+INDEX_FILE = "results.index"
+
+LOCK_FILE = "LOCK"
+PROCESS_PREFIX = "process-"
+_OFFSET = np.dtype("<u8")
+
+
+class Job:
+    """
+    One submitted dataset: either transactions already decoded (JSON, MessagePack,
+    Arrow bodies) or an NDJSON upload spilled to `directory` (see JobManager.create).
+
+    Results are one JSON line per input transaction, in input order (invalid
+    NDJSON lines get {"line": n, "detail": [...]} as on the streaming endpoint).
+    `processed` only counts results already flushed to disk, so pages and
+    streams never read past it.
+    """
+
+    def __init__(self, directory: str, source: str, reasons: bool = True):
+        self.id = os.path.basename(directory)
+        self.directory = directory
+        self.source = source
+        self.reasons = reasons
+        self.status = QUEUED
+        self.total = 0
+        self.processed = 0
+        self.result_bytes = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.transactions: Optional[Sequence[Transaction]] = None  # dropped once evaluated
+        self.cancelled = threading.Event()
+        self.deleted = False
+        self.progress = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def describe(self) -> Dict[str, object]:
+        """Status, progress and throughput (results per second since the job started)."""
+        seconds = None
+        if self.started_at is not None:
+            seconds = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "status": self.status,
+            "source": self.source,
+            "reasons": self.reasons,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": self.processed / self.total if self.total else (1.0 if self.finished else 0.0),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": seconds,
+            "transactions_per_second": self.processed / seconds if seconds else None,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on `workers` daemon threads, one job per thread at a time.
+
+    A job is evaluated `chunk_size` transactions per engine.evaluate_batch()
+    call, in input order, so its results match one /batch-evaluate call; the
+    pool overlaps different jobs. Each chunk's result lines are appended to the
+    job's results file and their end offsets to its index file, which is all a
+    page read needs: memory does not grow with job size (except for the
+    decoded input of non-NDJSON jobs, held until the job has run).
+
+    Finished jobs are removed `ttl_seconds` after they finish (checked on
+    submission and listing).
+
+    API processes may share `directory`: each keeps its jobs in its own
+    process-* subdirectory, flock-ed on <subdirectory>/LOCK while the process
+    lives. On startup, under the lock on <directory>/LOCK, subdirectories whose
+    lock is free (their process has exited) are removed and this one is created.
+    """
+
+    def __init__(
+        self, engine, directory: str, workers: int = 2, chunk_size: int = 10_000, ttl_seconds: float = 24 * 3600
+    ):
+        self.engine = engine
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+
+        os.makedirs(directory, exist_ok=True)
+        guard = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            _remove_stale(directory)
+            self.directory = tempfile.mkdtemp(prefix=PROCESS_PREFIX, dir=directory)
+            self._lock_fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        finally:
+            os.close(guard)
+
+    def start(self) -> None:
+        """Start the worker threads (and their shutdown at exit)."""
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Cancel outstanding jobs and stop the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancelled.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.close(self._lock_fd)
+
+    def create(self, source: str, reasons: bool = True) -> Job:
+        """
+        A new job with its (empty) directory, not yet queued. NDJSON uploads are
+        written to job.path(INPUT_FILE) and counted in job.total before submit().
+        """
+        directory = os.path.join(self.directory, uuid.uuid4().hex)
+        os.makedirs(directory)
+        return Job(directory, source, reasons)
+
+    def submit(self, job: Job, transactions: Optional[Sequence[Transaction]] = None) -> Job:
+        """Queue a job created by create(); transactions are its input unless it has an NDJSON file."""
+        if transactions is not None:
+            job.transactions = transactions
+            job.total = len(transactions)
+        self._expire()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def discard(self, job: Job) -> None:
+        """Remove a job that was created but never submitted (e.g. a failed upload)."""
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        self._expire()
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    def delete(self, job_id: str) -> bool:
+        """Cancel a job if it has not finished and remove it with its files. False if unknown."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+            job.deleted = True
+            job.cancelled.set()
+            running = job.status == RUNNING
+        if running:  # removed by its worker after the current chunk
+            return True
+        if job.status == QUEUED:
+            self._finish(job, CANCELLED)
+        shutil.rmtree(job.directory, ignore_errors=True)
+        return True
+
+    def page(self, job: Job, offset: int, limit: int) -> List[bytes]:
+        """Up to `limit` result lines (JSON bytes) from result number `offset` on, as far as processed."""
+        end = min(offset + limit, job.processed)
+        if offset >= end:
+            return []
+        with open(job.path(INDEX_FILE), "rb") as index:
+            index.seek(max(offset - 1, 0) * _OFFSET.itemsize)
+            ends = np.frombuffer(index.read((end - max(offset - 1, 0)) * _OFFSET.itemsize), dtype=_OFFSET)
+        if offset == 0:
+            ends = np.concatenate(([0], ends))
+        with open(job.path(RESULTS_FILE), "rb") as results:
+            results.seek(int(ends[0]))
+            data = results.read(int(ends[-1] - ends[0]))
+        return data.rstrip(b"\n").split(b"\n")
+
+    def stream(self, job: Job, poll_seconds: float = 1.0, block_bytes: int = 1 << 20) -> Iterator[bytes]:
+        """The results file as NDJSON, following it until the job finishes (or is deleted)."""
+        position = 0
+        try:
+            with open(job.path(RESULTS_FILE), "rb") as results:
+                while True:
+                    finished = job.finished
+                    available = job.result_bytes
+                    while position < available:
+                        block = results.read(min(block_bytes, available - position))
+                        position += len(block)
+                        yield block
+                    if finished or job.deleted:
+                        return
+                    with job.progress:
+                        if job.result_bytes == position and not job.finished:
+                            job.progress.wait(poll_seconds)
+        except FileNotFoundError:  # deleted before the stream started
+            return
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "directory": self.directory,
+            "workers": self.workers,
+            "chunk_size": self.chunk_size,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "retained": len(statuses),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancelled.is_set():
+                continue
+            try:
+                self._evaluate(job)
+            except Exception as e:
+                logger.exception("job %s failed", job.id)
+                job.error = f"Batch evaluation failed: {str(e)}"
+                self._finish(job, FAILED)
+            if job.deleted:
+                shutil.rmtree(job.directory, ignore_errors=True)
+
+    def _evaluate(self, job: Job) -> None:
+        with self._lock:
+            if job.cancelled.is_set():
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        with open(job.path(RESULTS_FILE), "wb") as results, open(job.path(INDEX_FILE), "wb") as index:
+            for output in self._chunks(job):
+                if job.cancelled.is_set():
+                    self._finish(job, CANCELLED)
+                    return
+                ends = np.flatnonzero(np.frombuffer(output, dtype=np.uint8) == ord("\n")) + (job.result_bytes + 1)
+                results.write(output)
+                index.write(ends.astype(_OFFSET).tobytes())
+                results.flush()
+                index.flush()
+                with job.progress:
+                    job.processed += len(ends)
+                    job.result_bytes += len(output)
+                    job.progress.notify_all()
+        job.transactions = None
+        self._finish(job, CANCELLED if job.cancelled.is_set() else DONE)
+
+    def _chunks(self, job: Job) -> Iterator[bytes]:
+        """Result lines of each chunk of the job's input, evaluated as the iterator advances."""
+        if job.transactions is None:
+            with open(job.path(INPUT_FILE), "rb") as source:
+                chunk: List[Tuple[int, bytes]] = []
+                for line in read_lines(source):
+                    chunk.append(line)
+                    if len(chunk) >= self.chunk_size:
+                        yield evaluate_chunk(self.engine, chunk, job.reasons)
+                        chunk = []
+                if chunk:
+                    yield evaluate_chunk(self.engine, chunk, job.reasons)
+            return
+        transactions = job.transactions
+        for start in range(0, len(transactions), self.chunk_size):
+            rows = range(start, min(start + self.chunk_size, len(transactions)))
+            results = self.engine.evaluate_batch(take_rows(transactions, rows))
+            yield b"\n".join(result_json(result, job.reasons) for result in results) + b"\n"
+
+    def _finish(self, job: Job, status: str) -> None:
+        with job.progress:
+            job.status = status
+            job.finished_at = time.time()
+            job.progress.notify_all()
+        if status == DONE:
+            self.completed += 1
+        elif status == FAILED:
+            self.failed += 1
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished and job.finished_at < cutoff]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.directory, ignore_errors=True)
+
+
+def _remove_stale(directory: str) -> None:
+    """Remove the process-* subdirectories of `directory` that no live process holds locked."""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.startswith(PROCESS_PREFIX) or not os.path.isdir(path):
+            continue
+        try:
+            fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDWR)
+        except FileNotFoundError:
+            fd = None
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue  # still in use
+        finally:
+            if fd is not None:
+                os.close(fd)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def job_manager_from_env(engine) -> JobManager:
+    """JobManager configured from CREDITGUARD_JOB_* environment variables (not started)."""
+    directory = os.getenv("CREDITGUARD_JOB_DIR") or os.path.join(tempfile.gettempdir(), "creditguard-jobs")
+    return JobManager(
+        engine,
+        directory,
+        workers=int(os.getenv("CREDITGUARD_JOB_WORKERS", "2")),
+        chunk_size=int(os.getenv("CREDITGUARD_JOB_CHUNK_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("CREDITGUARD_JOB_TTL_HOURS", "24")) * 3600,
+    )
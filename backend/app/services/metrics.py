@@ -0,0 +1,278 @@
+"""
+Engine and API instrumentation, exposed in the Prometheus text format (GET /metrics).
+Trade-off: Per-rule timings are sampled (every CREDITGUARD_METRICS_SAMPLE_EVERY-th
+call) vs exact per-call timing of every rule on the hot path.
+"""
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: 1us .. 10s
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+    1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 1_000_000)
+
+# (metric name, label values) -> counter value, or histogram [per-bucket counts..., +Inf count, sum]
+Snapshot = Dict[str, Dict[Tuple[str, Tuple[str, ...]], Any]]
+
+
+class _Shard:
+    """One thread's counters and histograms: only that thread writes them."""
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+
+
+class Metrics:
+    """
+    Registry of counters and histograms.
+
+    Updates take no lock: every thread writes its own shard (registered on the
+    thread's first update), and a scrape sums the shards. Reading a shard while
+    its thread updates it can see one update half applied (a bucket counted,
+    the sum not yet), which the next scrape corrects.
+    """
+
+    def __init__(self, sample_every: int = 16):
+        self.sample_every = sample_every
+        self._calls = itertools.count()
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()  # shard registration only
+        self._metrics: Dict[str, "_Metric"] = {}
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> "Counter":
+        return self._register(Counter(self, name, help, tuple(labels)))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> "Histogram":
+        return self._register(Histogram(self, name, help, tuple(labels), tuple(buckets)))
+
+    def sample(self) -> bool:
+        """True for every sample_every-th call (time this one); never if sample_every is 0."""
+        return self.sample_every > 0 and next(self._calls) % self.sample_every == 0
+
+    def shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def snapshot(self) -> Snapshot:
+        """Every series summed over the threads' shards (picklable, for merging across processes)."""
+        with self._lock:
+            shards = list(self._shards)
+        counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        histograms: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        for shard in shards:
+            # dict() copies atomically under the GIL, so a concurrent first update cannot break the iteration
+            for key, value in dict(shard.counters).items():
+                counters[key] = counters.get(key, 0) + value
+            for key, counts in dict(shard.histograms).items():
+                total = histograms.get(key)
+                histograms[key] = list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self, snapshots: Iterable[Snapshot] = (), gauges: Iterable[Tuple[str, str, str, Dict[str, str], float]] = ()) -> str:
+        """
+        Prometheus text exposition of this registry's series plus `snapshots`
+        (summed in, e.g. from engine worker processes), then `gauges` given as
+        (name, type, help, labels, value).
+        """
+        merged = self.snapshot()
+        for snapshot in snapshots:
+            for key, value in snapshot["counters"].items():
+                merged["counters"][key] = merged["counters"].get(key, 0) + value
+            for key, counts in snapshot["histograms"].items():
+                total = merged["histograms"].get(key)
+                merged["histograms"][key] = list(counts) if total is None else [a + b for a, b in zip(total, counts)]
+
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            series = merged["histograms" if isinstance(metric, Histogram) else "counters"]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for (series_name, values), value in sorted(series.items()):
+                if series_name == name:
+                    metric.render(lines, dict(zip(metric.labels, values)), value)
+
+        # Samples of one metric must be contiguous (gauges may come per worker)
+        declared = set()
+        for name, kind, help, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: "_Metric"):
+        self._metrics[metric.name] = metric
+        return metric
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, registry: Metrics, name: str, help: str, labels: Tuple[str, ...]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        counters = self.registry.shard().counters
+        key = (self.name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def render(self, lines: List[str], labels: Dict[str, str], value: float) -> None:
+        lines.append(f"{self.name}{_labels(labels)} {_number(value)}")
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry: Metrics, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        super().__init__(registry, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        histograms = self.registry.shard().histograms
+        key = (self.name, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, lines: List[str], labels: Dict[str, str], counts: List[float]) -> None:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(labels)} {_number(counts[-1])}")
+        lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics(sample_every=int(os.getenv("CREDITGUARD_METRICS_SAMPLE_EVERY", "16")))
+
+RULE_SECONDS = metrics.histogram(
+    "creditguard_rule_seconds", "Sampled time of one rule's evaluate() call", ("rule",)
+)
+RULE_BATCH_SECONDS = metrics.histogram(
+    "creditguard_rule_batch_seconds", "Time of one rule's evaluate_batch() call (whole batch)", ("rule",)
+)
+RULE_TRIGGERS = metrics.counter(
+    "creditguard_rule_triggers_total", "Transactions each rule triggered on", ("rule",)
+)
+EVALUATIONS = metrics.counter(
+    "creditguard_evaluations_total", "Transactions evaluated, by mode (full, decision, batch)", ("mode",)
+)
+ENGINE_SECONDS = metrics.histogram(
+    "creditguard_engine_seconds", "FraudEngine call latency, including waits for user locks", ("operation",)
+)
+BATCH_SIZE = metrics.histogram(
+    "creditguard_batch_size", "Transactions per FraudEngine.evaluate_batch() call", buckets=SIZE_BUCKETS
+)
+IDEMPOTENCY_LOOKUPS = metrics.counter(
+    "creditguard_idempotency_lookups_total", "Result cache lookups of transactions with a transaction_id, by result (hit, miss)",
+    ("result",),
+)
+HTTP_SECONDS = metrics.histogram(
+    "creditguard_http_request_seconds", "Request latency by route (streaming responses until their last byte)",
+    ("method", "path"),
+)
+HTTP_REQUESTS = metrics.counter(
+    "creditguard_http_requests_total", "Requests by route and status code", ("method", "path", "status")
+)
+
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware recording every request's latency and status by route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the (shared) scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_SECONDS.observe((scope["method"], path), time.perf_counter() - start)
+            HTTP_REQUESTS.inc((scope["method"], path, str(status)))
+
+
+def state_store_gauges(stats: Dict[str, Any], labels: Optional[Dict[str, str]] = None) -> List[Tuple[str, str, str, Dict[str, str], float]]:
+    """Gauges (and eviction counters) from a state store's stats() (users tracked for velocity/travel)."""
+    labels = labels or {}
+    gauges = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key.startswith("evicted_"):
+            gauges.append((
+                "creditguard_state_store_evicted_total", "counter", "Users evicted from the state store, by reason",
+                {**labels, "reason": key[len("evicted_"):]}, value,
+            ))
+        else:
+            gauges.append((f"creditguard_state_store_{key}", "gauge", f"State store {key.replace('_', ' ')}", labels, value))
+    return gauges
+
+
+def result_cache_gauges(stats: Dict[str, Any], labels: Optional[Dict[str, str]] = None) -> List[Tuple[str, str, str, Dict[str, str], float]]:
+    """Size and evictions of the idempotency result cache, from its stats()."""
+    labels = labels or {}
+    return [
+        ("creditguard_idempotency_entries", "gauge", "Results cached by transaction_id", labels, stats["entries"]),
+        *(
+            ("creditguard_idempotency_evicted_total", "counter", "Cached results evicted, by reason",
+             {**labels, "reason": reason}, stats[f"evicted_{reason}"])
+            for reason in ("expired", "capacity")
+        ),
+    ]
@@ -0,0 +1,379 @@
+"""
+Offline replay of historical transaction files through the batch engine.
+Inputs are read in streaming chunks, ordered by timestamp with an external
+merge sort (sorted runs spilled to disk) and evaluated chunk by chunk.
+Trade-off: Spilling runs costs a write and a read of the input vs memory
+bounded by the run size for any file size.
+"""
+import csv
+import gzip
+import heapq
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from pydantic import ValidationError
+from app.schemas import Transaction
+from app.services.event_log import decode_events, encode_event
+from app.utils.ndjson import MAX_LINE_BYTES, read_lines
+from app.utils.serialization import parse_transaction, result_json, transaction_records
+
+NDJSON, JSON, CSV = "ndjson", "json", "csv"
+FORMATS = (NDJSON, JSON, CSV)
+_EXTENSIONS = {".ndjson": NDJSON, ".jsonl": NDJSON, ".json": JSON, ".csv": CSV}
+
+# CSV columns parsed as numbers (everything else stays a string for validation)
+_CSV_NUMBERS = ("amount", "latitude", "longitude")
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Invalid records kept as examples in the report
+MAX_INVALID_SAMPLES = 100
+
+# (record number, transaction): the record number is the position in the input
+Record = Tuple[int, Transaction]
+
+
+class ReplayReport:
+    """Counters and timings of one replay, summarized by to_dict()."""
+
+    def __init__(self, inputs: Sequence[str]):
+        self.inputs = list(inputs)
+        self.records = 0
+        self.invalid = 0
+        self.invalid_samples: List[Dict[str, Any]] = []
+        self.order: Optional[str] = None
+        self.already_sorted: Optional[bool] = None
+        self.sorted_runs = 0
+        self.evaluated = 0
+        self.risk_levels: Counter = Counter()
+        self.triggered_rules: Counter = Counter()
+        self.total_score = 0
+        self.first_timestamp: Optional[datetime] = None
+        self.last_timestamp: Optional[datetime] = None
+        self.evaluate_seconds = 0.0
+        self.write_seconds = 0.0
+        self.seconds = 0.0
+
+    def reject(self, path: str, position: Dict[str, int], errors: List[Dict[str, Any]]) -> None:
+        self.invalid += 1
+        if len(self.invalid_samples) < MAX_INVALID_SAMPLES:
+            self.invalid_samples.append({"file": path, **position, "detail": errors})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "inputs": self.inputs,
+            "order": self.order,
+            "already_sorted": self.already_sorted,
+            "sorted_runs": self.sorted_runs,
+            "records": self.records,
+            "invalid": self.invalid,
+            "evaluated": self.evaluated,
+            "risk_levels": dict(self.risk_levels),
+            "triggered_rules": dict(self.triggered_rules.most_common()),
+            "mean_score": self.total_score / self.evaluated if self.evaluated else None,
+            "first_timestamp": self.first_timestamp.isoformat() if self.first_timestamp else None,
+            "last_timestamp": self.last_timestamp.isoformat() if self.last_timestamp else None,
+            "seconds": self.seconds,
+            "evaluate_seconds": self.evaluate_seconds,
+            "write_seconds": self.write_seconds,
+            "transactions_per_second": self.evaluated / self.seconds if self.seconds else None,
+            "invalid_samples": self.invalid_samples,
+        }
+
+
+def input_format(path: str) -> str:
+    """Format of an input file from its extension (.gz stripped): ndjson/jsonl, json or csv."""
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in _EXTENSIONS:
+        raise ValueError(f"{path}: unknown input format (expected .ndjson, .jsonl, .json or .csv, optionally .gz)")
+    return _EXTENSIONS[extension]
+
+
+def _open(path: str) -> BinaryIO:
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_transactions(path: str, report: ReplayReport, file_format: Optional[str] = None) -> Iterator[Record]:
+    """
+    Valid transactions of one file, streamed in file order. Invalid records are
+    counted (with examples) in the report and skipped; record numbers continue
+    from report.records, so they are unique across the inputs of a replay.
+
+    A .json file holds one array of transaction objects (parsed item by item)
+    or, if it starts with an object, one object per line.
+    """
+    file_format = file_format or input_format(path)
+    with _open(path) as file:
+        if file_format == JSON and file.peek(1 << 12).lstrip()[:1] == b"{":
+            file_format = NDJSON
+        if file_format == NDJSON:
+            items = ((line_number, "line", line) for line_number, line in read_lines(file))
+        elif file_format == JSON:
+            items = ((index, "index", item) for index, item in _json_array(file))
+        else:
+            items = _csv_rows(file)
+
+        for position, kind, item in items:
+            record = report.records
+            report.records += 1
+            try:
+                yield record, _transaction(item)
+            except ValidationError as e:
+                errors = e.errors(include_url=False, include_context=False, include_input=False)
+                report.reject(path, {kind: position, "record": record}, errors)
+
+
+def _transaction(item: Any) -> Transaction:
+    """A raw NDJSON line or decoded object as a Transaction (fast path first, as the API does)."""
+    if isinstance(item, bytes):
+        transaction = parse_transaction(item)
+        return Transaction.model_validate_json(item) if transaction is None else transaction
+    transactions = transaction_records([item])
+    return Transaction.model_validate(item) if transactions is None else transactions[0]
+
+
+def _csv_rows(file: BinaryIO) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """CSV rows (header row = field names) as transaction objects; empty cells are left out."""
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8", newline=""))
+    for row in reader:
+        item: Dict[str, Any] = {field: value for field, value in row.items() if field is not None and value != ""}
+        for field in _CSV_NUMBERS:
+            if field in item:
+                try:
+                    item[field] = float(item[field])
+                except ValueError:
+                    pass  # reported by validation
+        yield reader.line_num, "line", item
+
+
+def _json_array(file: BinaryIO, max_item_chars: int = MAX_LINE_BYTES, block_chars: int = 1 << 20) -> Iterator[Tuple[int, Any]]:
+    """(index, value) for each item of a top-level JSON array, decoded without loading the whole file."""
+    text = io.TextIOWrapper(file, encoding="utf-8")
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    opened = False
+    after_item = False
+    index = 0
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position == len(buffer) and not eof:
+            buffer, position, eof = _read_more(text, buffer, position, block_chars)
+            continue
+        char = buffer[position:position + 1]
+        if not opened:
+            if char != "[":
+                raise ValueError("expected a JSON array of transactions")
+            opened = True
+            position += 1
+            continue
+        if not char:
+            raise ValueError(f"unexpected end of JSON array after {index} items")
+        if after_item:
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"expected ',' or ']' after item {index - 1}")
+            after_item = False
+            position += 1
+            continue
+        if char == "]" and index == 0:
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+            # A value ending at the buffer's end may continue in the next block (numbers)
+            incomplete = end == len(buffer) and not eof
+        except json.JSONDecodeError as e:
+            if eof or len(buffer) - position > max_item_chars:
+                raise ValueError(f"invalid JSON in item {index}: {e}") from None
+            incomplete = True
+        if incomplete:
+            buffer, position, eof = _read_more(text, buffer, position, block_chars)
+            continue
+        yield index, item
+        index += 1
+        position = end
+        after_item = True
+
+
+def _read_more(text: io.TextIOWrapper, buffer: str, position: int, block_chars: int) -> Tuple[str, int, bool]:
+    """The unread rest of buffer plus the next block; eof once the file is exhausted."""
+    more = text.read(block_chars)
+    return buffer[position:] + more, 0, not more
+
+
+def _timestamp(record: Record) -> datetime:
+    return record[1].timestamp
+
+
+def is_sorted(records: Iterable[Record]) -> bool:
+    """True if the records are in timestamp order (stops at the first that is not)."""
+    previous = None
+    for _, transaction in records:
+        if previous is not None and transaction.timestamp < previous:
+            return False
+        previous = transaction.timestamp
+    return True
+
+
+def sort_by_timestamp(records: Iterable[Record], directory: str, run_size: int, report: ReplayReport) -> Iterator[Record]:
+    """
+    Records in timestamp order, ties in input order (external merge sort).
+
+    Up to `run_size` records are sorted in memory at a time; if the input is
+    larger, each sorted run is spilled to `directory` in the event log's record
+    format and the runs are merged with a heap, reading them back in blocks.
+    """
+    runs: List[str] = []
+    run: List[Record] = []
+    try:
+        for record in records:
+            run.append(record)
+            if len(run) >= run_size:
+                runs.append(_spill(run, directory, len(runs)))
+                run = []
+        if not runs:
+            run.sort(key=_timestamp)
+            yield from run
+            return
+        if run:
+            runs.append(_spill(run, directory, len(runs)))
+            run = []
+        report.sorted_runs = len(runs)
+        # heapq.merge is stable across its inputs, and runs are in input order
+        yield from heapq.merge(*(_read_run(path) for path in runs), key=_timestamp)
+    finally:
+        for path in runs:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _spill(run: List[Record], directory: str, number: int) -> str:
+    """Sort a run and write it to a run file; returns its path."""
+    run.sort(key=_timestamp)
+    path = os.path.join(directory, f"run-{number:06d}.log")
+    with open(path, "wb") as f:
+        f.writelines(encode_event(record, transaction) for record, transaction in run)
+    return path
+
+
+def _read_run(path: str, block_bytes: int = 1 << 20) -> Iterator[Record]:
+    with open(path, "rb") as f:
+        buffer = b""
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                if buffer:
+                    raise ValueError(f"{path}: truncated run file")
+                return
+            buffer += block
+            consumed = 0
+            for record, consumed, transaction in decode_events(buffer):
+                yield record, transaction
+            buffer = buffer[consumed:]
+
+
+def ordered_records(
+    paths: Sequence[str],
+    report: ReplayReport,
+    directory: str,
+    order: str = "auto",
+    run_size: int = 500_000,
+    file_format: Optional[str] = None,
+) -> Iterator[Record]:
+    """
+    Valid records of `paths` as one stream, in the evaluation order `order`
+    asks for (see replay()); sorted runs are spilled to `directory`. With
+    "auto", the inputs are read once here to check whether they are sorted.
+    """
+    def records(counts: ReplayReport) -> Iterator[Record]:
+        for path in paths:
+            yield from read_transactions(path, counts, file_format)
+
+    if order == "auto":
+        report.already_sorted = is_sorted(records(ReplayReport(paths)))
+        order = "keep" if report.already_sorted else "sort"
+    report.order = order
+    if order == "sort":
+        return sort_by_timestamp(records(report), directory, run_size, report)
+    return records(report)
+
+
+def replay(
+    engine,
+    paths: Sequence[str],
+    output: Optional[BinaryIO] = None,
+    order: str = "auto",
+    chunk_size: int = 100_000,
+    run_size: int = 500_000,
+    workers: int = 1,
+    reasons: bool = True,
+    temp_dir: Optional[str] = None,
+    file_format: Optional[str] = None,
+) -> ReplayReport:
+    """
+    Evaluate every transaction of `paths` with engine.evaluate_batch(), `chunk_size` at a time.
+
+    Args:
+        order: "sort" evaluates in timestamp order (external merge sort), "keep"
+            in input order, "auto" checks the input first and sorts only if needed
+        workers: passed to evaluate_batch() (>1 shards large chunks across processes)
+        output: receives one NDJSON result per transaction, in evaluation order,
+            with the transaction's input position as "record"
+
+    Returns:
+        ReplayReport (counts, risk levels, rule hits, timings)
+    """
+    report = ReplayReport(paths)
+    start = time.perf_counter()
+    directory = tempfile.mkdtemp(prefix="creditguard-replay-", dir=temp_dir)
+    try:
+        ordered = ordered_records(paths, report, directory, order, run_size, file_format)
+        chunk: List[Record] = []
+        for record in ordered:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                _evaluate(engine, chunk, output, workers, reasons, report)
+                chunk = []
+        if chunk:
+            _evaluate(engine, chunk, output, workers, reasons, report)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _evaluate(engine, chunk: List[Record], output: Optional[BinaryIO], workers: int, reasons: bool, report: ReplayReport) -> None:
+    transactions = [transaction for _, transaction in chunk]
+    start = time.perf_counter()
+    results = engine.evaluate_batch(transactions, workers=workers)
+    report.evaluate_seconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for result in results:
+        report.risk_levels[result.risk_level] += 1
+        report.total_score += result.total_score
+        report.triggered_rules.update(trigger.rule_name for trigger in result.triggered_rules)
+    first = min(transaction.timestamp for transaction in transactions)
+    last = max(transaction.timestamp for transaction in transactions)
+    if report.first_timestamp is None or first < report.first_timestamp:
+        report.first_timestamp = first
+    if report.last_timestamp is None or last > report.last_timestamp:
+        report.last_timestamp = last
+    report.evaluated += len(results)
+    if output is not None:
+        # {"record": n, ...result fields}
+        output.writelines(
+            b'{"record":%d,%s\n' % (record, result_json(result, reasons)[1:])
+            for (record, _), result in zip(chunk, results)
+        )
+    report.write_seconds += time.perf_counter() - start
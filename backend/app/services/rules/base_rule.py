@@ -3,8 +3,14 @@ Abstract base class for fraud detection rules.
 Strategy pattern: Each rule is independent and pluggable.
 """
 from abc import ABC, abstractmethod
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional
+from contextlib import nullcontext
+from datetime import timedelta
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures, extract_features
+from app.services.state_store import StateStore
+from typing import Any, Dict, Iterable, Optional
+import numpy as np
 
 
 class BaseRule(ABC):
@@ -13,17 +19,87 @@ class BaseRule(ABC):
     Each rule evaluates a transaction and returns a trigger if suspicious.
     """
 
+    # Per-user state this rule reads and writes (stateful rules set it)
+    state_store: Optional[StateStore] = None
+
     def __init__(self, score_weight: int):
         self.score_weight = score_weight
 
     @abstractmethod
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        """
+        Evaluate a transaction against this rule.
+
+        Args:
+            features: The transaction's feature record (see extract_features),
+                shared by all rules; per-user state in it is read before any rule
+                runs, and the caller holds the user's lock
+
+        Returns:
+            TriggerRecord if rule is triggered (reason rendered lazily), None otherwise.
+        """
+        pass
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        """
+        Evaluate every transaction in a columnar batch.
+
+        Default: per-transaction evaluate() in input order, so any rule works in
+        batch mode. Vectorizable rules override this with NumPy masks and only
+        build triggers for the rows that fire.
+
+        Features are read from the rule's state store, or else the batch's (as
+        evaluate() gets the engine's). Stateful rules write back the batch's
+        final state, possibly before this rule runs, so features.last_transaction
+        and last_position come from TransactionBatch.previous_transactions():
+        each row's previous transaction, as evaluating the rows one by one would
+        see it. Other state a rule reads from the store by slot is its current state.
+
+        Returns:
+            {row index: TriggerRecord} for triggered rows only.
+        """
+        triggers: Dict[int, TriggerRecord] = {}
+        store = self.state_store if self.state_store is not None else batch.state_store
+        previous = None
+        if store is not None and batch.size:
+            with store.users_locked(batch.user_groups.users):
+                previous = batch.previous_transactions(store)
+            positions = np.empty(batch.size, dtype=np.int64)
+            positions[batch.user_groups.order] = np.arange(batch.size)
+        for row, transaction in enumerate(batch.transactions):
+            with store.user_lock(transaction.user_id) if store is not None else nullcontext():
+                features = extract_features(transaction, store)
+                if previous is not None:
+                    previous.fill(features, int(positions[row]))
+                trigger = self.evaluate(features)
+            if trigger:
+                triggers[row] = trigger
+        return triggers
+
+    @property
+    def state_horizon(self) -> timedelta:
+        """
+        How long per-user state can influence a later transaction.
+        State idle longer than this can be evicted without changing results.
         """
-        Evaluate transaction against this rule.
+        return timedelta(0)
+
+    def export_user_state(self, user_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Per-user state for the given users, so they can be evaluated elsewhere
+        (e.g. a worker process). Stateless rules have none.
 
         Returns:
-            RuleTrigger if rule is triggered, None otherwise.
+            {user_id: picklable state} for users that have state.
         """
+        return {}
+
+    def import_user_state(self, states: Dict[str, Any]) -> None:
+        """Install per-user state produced by export_user_state()."""
+        pass
+
+    def clear_state(self) -> None:
+        """Forget all per-user state."""
         pass
 
     @property
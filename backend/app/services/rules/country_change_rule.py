@@ -3,8 +3,11 @@ Rule: Flags transactions from high-risk countries.
 Trade-off: Using a static list instead of real-time risk data.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional, Set
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures
+from typing import Dict, Optional, Set
+import numpy as np
 
 
 class CountryChangeRule(BaseRule):
@@ -24,6 +27,8 @@ class CountryChangeRule(BaseRule):
     "LY",  # Libya
 }
 
+    REASON = "Transaction originated from high-risk country: {0}"
+
     def __init__(self, score_weight: int = 40):
         super().__init__(score_weight)
 
@@ -31,11 +36,15 @@ class CountryChangeRule(BaseRule):
     def name(self) -> str:
         return "Country Risk Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        if transaction.country in self.HIGH_RISK_COUNTRIES:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Transaction originated from high-risk country: {transaction.country}",
-                score_contribution=self.score_weight
-            )
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        if features.country in self.HIGH_RISK_COUNTRIES:
+            return self._trigger(features.country)
         return None
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        rows = np.flatnonzero(batch.country_mask(self.HIGH_RISK_COUNTRIES))
+        codes = batch.country_index[rows].tolist()
+        return {row: self._trigger(batch.countries[code]) for row, code in zip(rows.tolist(), codes)}
+
+    def _trigger(self, country: str) -> TriggerRecord:
+        return TriggerRecord(self.name, self.score_weight, self.REASON, (country,))
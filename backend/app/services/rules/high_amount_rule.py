@@ -3,13 +3,18 @@ Rule: Flags transactions with unusually high amounts.
 Simple threshold-based approach.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures
+from typing import Dict, Optional
+import numpy as np
 
 
 class HighAmountRule(BaseRule):
     """Detects transactions above a threshold amount."""
 
+    REASON = "Transaction amount ${0:.2f} exceeds threshold ${1:.2f}"
+
     def __init__(self, threshold: float = 1000.0, score_weight: int = 30):
         """
         Args:
@@ -23,11 +28,15 @@ class HighAmountRule(BaseRule):
     def name(self) -> str:
         return "High Amount Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        if transaction.amount > self.threshold:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Transaction amount ${transaction.amount:.2f} exceeds threshold ${self.threshold:.2f}",
-                score_contribution=self.score_weight
-            )
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        if features.amount > self.threshold:
+            return self._trigger(features.amount)
         return None
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        rows = np.flatnonzero(batch.amounts > self.threshold)
+        amounts = batch.amounts[rows].tolist()
+        return {row: self._trigger(amount) for row, amount in zip(rows.tolist(), amounts)}
+
+    def _trigger(self, amount: float) -> TriggerRecord:
+        return TriggerRecord(self.name, self.score_weight, self.REASON, (amount, self.threshold))
@@ -3,10 +3,15 @@ Rule: Detects geographically impossible transactions.
 Flags transactions that occur too quickly across distant locations.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional, Dict
-from datetime import datetime, timedelta
-from collections import defaultdict
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures
+from app.services.state_store import NIL, StateStore, default_store
+from app.utils.geo import MAX_DISTANCE_MILES, country_code, distance_matrix, haversine_miles
+from typing import Optional, Dict, Iterable, Tuple
+from datetime import timedelta
+import math
+import numpy as np
 
 
 class ImpossibleTravelRule(BaseRule):
@@ -16,11 +21,15 @@ class ImpossibleTravelRule(BaseRule):
     Example: Transaction in NYC at 2:00 PM, then London at 2:30 PM
     → Physically impossible to travel 3500 miles in 30 minutes
 
-    Trade-off: Using simplified country-distance model vs precise geolocation
+    Distances come from a precomputed matrix of ISO-3166 country centroids
+    (one array index per check). When both transactions carry lat/long, the
+    great-circle distance between the actual points is used instead.
+
+    Trade-off: Country centroids understate trips between border regions of
+    large countries, and overstate trips between neighbours' border towns
     """
 
-    # Approximate distances between countries (in miles)
-    # In production, would use precise lat/long and distance calculation
+    # Hand-tuned distances between major cities (in miles); override the centroid distance
     COUNTRY_DISTANCES = {
         ('US', 'GB'): 3500,
         ('US', 'FR'): 3800,
@@ -36,74 +45,185 @@ class ImpossibleTravelRule(BaseRule):
     # Maximum possible travel speed: 600 mph (commercial jet)
     MAX_SPEED_MPH = 600
 
-    # Store last transaction per user: {user_id: (country, timestamp)}
-    _last_transactions: Dict[str, tuple] = defaultdict(lambda: (None, None))
+    BACKDATED_REASON = "Suspicious timing: Transaction in {1} is backdated or simultaneous with previous {0} transaction (time difference: {2:.1f} hours). Possible timestamp manipulation."
+    IMPOSSIBLE_REASON = "Impossible travel: {0} → {1} in {2:.1f} hours (requires {3:.0f} mph, max possible: {4} mph)"
 
-    def __init__(self, score_weight: int = 70):
+    def __init__(self, score_weight: int = 70, state_store: Optional[StateStore] = None):
         """
         Args:
             score_weight: High weight - impossible travel is strong fraud signal
+            state_store: Per-user state (shared default store if omitted)
         """
         super().__init__(score_weight)
+        # Last transaction per user (country, timestamp) lives in the state store
+        self.state_store = state_store if state_store is not None else default_store
 
     @property
     def name(self) -> str:
         return "Impossible Travel Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        user_id = transaction.user_id
-        current_country = transaction.country
-        current_time = transaction.timestamp
-
-        # Get user's last transaction
-        last_country, last_time = self._last_transactions[user_id]
-
-        # Update storage
-        self._last_transactions[user_id] = (current_country, current_time)
+    @property
+    def state_horizon(self) -> timedelta:
+        # Beyond this gap even an antipodal trip is possible
+        longest = max(MAX_DISTANCE_MILES, *self.COUNTRY_DISTANCES.values())
+        return timedelta(hours=longest / self.MAX_SPEED_MPH)
+
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        current_country = features.country
+        current_time = features.timestamp_us
+
+        # User's last transaction was fetched with the features; replace it (the caller holds the user's lock)
+        last = features.last_transaction
+        last_position = features.last_position
+        self.state_store.set_last_transaction(
+            features.slot, current_country, current_time, features.latitude, features.longitude
+        )
 
         # First transaction for this user
-        if last_country is None or last_time is None:
+        if last is None:
             return None
+        last_country, last_time = last
 
         # Same country - no travel
         if current_country == last_country:
             return None
 
-        # Calculate time difference in hours
-        time_diff = (current_time - last_time).total_seconds() / 3600
+        # Calculate time difference in hours (exact microseconds, same as timedelta.total_seconds())
+        time_diff = (current_time - last_time) / 1_000_000 / 3600
 
-        # Get distance between countries
-        distance = self._get_distance(last_country, current_country)
+        # Get distance: between the actual points if both have coordinates, else between countries
+        if last_position is not None:
+            distance = float(haversine_miles(*last_position, features.latitude, features.longitude))
+        else:
+            distance = self._get_distance(last_country, current_country)
 
         if distance is None:
-            # Countries not in our distance matrix - can't determine
+            # Country not in the centroid table - can't determine
             return None
 
         # Calculate required speed
         if time_diff <= 0:
             # Negative or zero time = backdated or simultaneous transaction
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Suspicious timing: Transaction in {current_country} is backdated or simultaneous with previous {last_country} transaction (time difference: {time_diff:.1f} hours). Possible timestamp manipulation.",
-                score_contribution=self.score_weight
-            )
+            return self._backdated_trigger(last_country, current_country, time_diff)
 
         required_speed = distance / time_diff
 
         # Check if travel is impossible
         if required_speed > self.MAX_SPEED_MPH:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Impossible travel: {last_country} → {current_country} in {time_diff:.1f} hours (requires {required_speed:.0f} mph, max possible: {self.MAX_SPEED_MPH} mph)",
-                score_contribution=self.score_weight
-            )
+            return self._impossible_trigger(last_country, current_country, time_diff, required_speed)
 
         return None
 
-    def _get_distance(self, country1: str, country2: str) -> Optional[float]:
-        """Get distance between two countries (bidirectional lookup)."""
-        # Try both orderings
-        key1 = (country1, country2)
-        key2 = (country2, country1)
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        """
+        Vectorized travel check over a whole batch.
 
-        return self.COUNTRY_DISTANCES.get(key1) or self.COUNTRY_DISTANCES.get(key2)
+        Rows are grouped by user in input order, so each row's previous
+        transaction is the previous position in the group (array shift), or the
+        stored last transaction for a group's first row. Each user's last row is
+        written back as their stored state; the batch's users stay locked in between.
+        """
+        with self.state_store.users_locked(batch.user_groups.users):
+            return self._evaluate_batch_locked(batch)
+
+    def _evaluate_batch_locked(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        groups = batch.user_groups
+        order = groups.order
+        current_country = batch.country_index[order]
+        current_time = batch.timestamps_us[order]
+        latitudes, longitudes = batch.positions
+        current_latitude = latitudes[order]
+        current_longitude = longitudes[order]
+
+        # Previous transaction = shift by one within the group, or the stored one at its start
+        previous = batch.previous_transactions(self.state_store)
+        previous_country, previous_time = previous.country, previous.time_us
+        previous_latitude, previous_longitude = previous.latitude, previous.longitude
+        has_previous = previous.has_previous
+
+        # Vocabulary index -> centroid table code, then one matrix lookup per row
+        countries = previous.countries
+        codes = np.array([country_code(country) for country in countries], dtype=np.int64)
+        distance = self._distance_table()[codes[previous_country], codes[current_country]]
+
+        # Rows where both ends have coordinates use the distance between the points
+        located = ~np.isnan(previous_latitude) & ~np.isnan(current_latitude)
+        distance[located] = haversine_miles(
+            previous_latitude[located], previous_longitude[located],
+            current_latitude[located], current_longitude[located]
+        )
+        candidates = has_previous & (previous_country != current_country) & ~np.isnan(distance)
+
+        # Same arithmetic as evaluate(): exact microseconds -> seconds -> hours
+        time_diff = (current_time - previous_time) / 1_000_000 / 3600
+        with np.errstate(divide="ignore", invalid="ignore"):
+            required_speed = distance / time_diff
+        backdated = candidates & (time_diff <= 0)
+        impossible = candidates & (time_diff > 0) & (required_speed > self.MAX_SPEED_MPH)
+
+        triggers: Dict[int, TriggerRecord] = {}
+        for position in np.flatnonzero(backdated).tolist():
+            triggers[int(order[position])] = self._backdated_trigger(
+                countries[previous_country[position]], countries[current_country[position]],
+                float(time_diff[position])
+            )
+        for position in np.flatnonzero(impossible).tolist():
+            triggers[int(order[position])] = self._impossible_trigger(
+                countries[previous_country[position]], countries[current_country[position]],
+                float(time_diff[position]), float(required_speed[position])
+            )
+
+        # Write back each user's last transaction (recency = their latest timestamp)
+        latest = np.maximum.reduceat(current_time, groups.starts).tolist() if batch.size else []
+        for group, end in enumerate(groups.ends.tolist()):
+            slot = self.state_store.touch(groups.users[group], latest[group])
+            last = order[end - 1]
+            self.state_store.set_last_transaction(
+                slot, countries[current_country[end - 1]], int(current_time[end - 1]),
+                None if np.isnan(latitudes[last]) else float(latitudes[last]),
+                None if np.isnan(longitudes[last]) else float(longitudes[last]),
+            )
+        return triggers
+
+    def export_user_state(self, user_ids: Iterable[str]) -> Dict[str, Tuple]:
+        """{user_id: (last country, last epoch-microsecond timestamp, latitude, longitude)}"""
+        states = {}
+        for user_id in user_ids:
+            with self.state_store.user_lock(user_id):
+                slot = self.state_store.slot(user_id)
+                last = self.state_store.last_transaction(slot) if slot != NIL else None
+                if last is not None:
+                    states[user_id] = last + (self.state_store.last_position(slot) or (None, None))
+        return states
+
+    def import_user_state(self, states: Dict[str, Tuple]) -> None:
+        for user_id, (country, timestamp, latitude, longitude) in states.items():
+            with self.state_store.user_lock(user_id):
+                slot = self.state_store.touch(user_id, timestamp)
+                self.state_store.set_last_transaction(slot, country, timestamp, latitude, longitude)
+
+    def clear_state(self) -> None:
+        self.state_store.clear()
+
+    def _get_distance(self, country1: str, country2: str) -> Optional[float]:
+        """Distance between two countries (None if either is not in the centroid table)."""
+        distance = self._distance_table().item(country_code(country1), country_code(country2))
+        return None if math.isnan(distance) else distance
+
+    @classmethod
+    def _distance_table(cls) -> np.ndarray:
+        """Country distance matrix with COUNTRY_DISTANCES applied (built once per class)."""
+        if "_distances" not in cls.__dict__:
+            cls._distances = distance_matrix(cls.COUNTRY_DISTANCES)
+        return cls._distances
+
+    def _backdated_trigger(self, last_country: str, current_country: str, time_diff: float) -> TriggerRecord:
+        return TriggerRecord(
+            self.name, self.score_weight, self.BACKDATED_REASON, (last_country, current_country, time_diff)
+        )
+
+    def _impossible_trigger(self, last_country: str, current_country: str, time_diff: float, required_speed: float) -> TriggerRecord:
+        return TriggerRecord(
+            self.name, self.score_weight, self.IMPOSSIBLE_REASON,
+            (last_country, current_country, time_diff, required_speed, self.MAX_SPEED_MPH)
+        )
@@ -3,8 +3,11 @@ Rule: Detects round-amount transactions (card testing pattern).
 Fraudsters test stolen cards with small, round amounts before making large purchases.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures
+from typing import Dict, Optional
+import numpy as np
 
 
 class RoundAmountRule(BaseRule):
@@ -22,6 +25,9 @@ class RoundAmountRule(BaseRule):
     # Round amounts to check (in dollars)
     SUSPICIOUS_AMOUNTS = {1.0, 5.0, 10.0, 20.0, 50.0, 100.0}
 
+    SUSPICIOUS_REASON = "Suspicious round amount: ${0:.2f}. Card testers often use small, round amounts to verify stolen cards before larger fraud."
+    EXACT_DOLLAR_REASON = "Exact dollar amount: ${0:.0f}.00. Legitimate purchases typically include cents (e.g., $23.47 not $23.00)."
+
     def __init__(self, score_weight: int = 35):
         """
         Args:
@@ -33,24 +39,34 @@ class RoundAmountRule(BaseRule):
     def name(self) -> str:
         return "Round Amount Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        amount = transaction.amount
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        amount = features.amount
 
         # Check if amount is exactly a suspicious round number
         if amount in self.SUSPICIOUS_AMOUNTS:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Suspicious round amount: ${amount:.2f}. Card testers often use small, round amounts to verify stolen cards before larger fraud.",
-                score_contribution=self.score_weight
-            )
+            return self._suspicious_trigger(amount)
 
         # Also check for any exact dollar amount under $25 (e.g., $3.00, $7.00)
         # Real purchases rarely result in exact dollars
-        if amount <= 25.0 and amount % 1.0 == 0.0:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Exact dollar amount: ${amount:.0f}.00. Legitimate purchases typically include cents (e.g., $23.47 not $23.00).",
-                score_contribution=self.score_weight
-            )
+        if amount <= 25.0 and features.whole_dollar:
+            return self._exact_dollar_trigger(amount)
 
         return None
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        amounts = batch.amounts
+        suspicious = np.isin(amounts, list(self.SUSPICIOUS_AMOUNTS))
+        exact_dollar = ~suspicious & (amounts <= 25.0) & (np.mod(amounts, 1.0) == 0.0)
+
+        triggers: Dict[int, TriggerRecord] = {}
+        for row in np.flatnonzero(suspicious).tolist():
+            triggers[row] = self._suspicious_trigger(float(amounts[row]))
+        for row in np.flatnonzero(exact_dollar).tolist():
+            triggers[row] = self._exact_dollar_trigger(float(amounts[row]))
+        return triggers
+
+    def _suspicious_trigger(self, amount: float) -> TriggerRecord:
+        return TriggerRecord(self.name, self.score_weight, self.SUSPICIOUS_REASON, (amount,))
+
+    def _exact_dollar_trigger(self, amount: float) -> TriggerRecord:
+        return TriggerRecord(self.name, self.score_weight, self.EXACT_DOLLAR_REASON, (amount,))
@@ -3,8 +3,11 @@ Rule: Flags transactions at unusual/suspicious hours.
 Fraud often occurs during early morning hours when legitimate cardholders are asleep.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch
+from app.services.features import TransactionFeatures
+from typing import Dict, Optional
+import numpy as np
 
 
 class UnusualTimeRule(BaseRule):
@@ -22,6 +25,8 @@ class UnusualTimeRule(BaseRule):
     SUSPICIOUS_START_HOUR = 1  # 1 AM
     SUSPICIOUS_END_HOUR = 5    # 5 AM
 
+    REASON = "Transaction at {0}:00 (suspicious hours: {1}:00-{2}:00). Legitimate users rarely transact during early morning."
+
     def __init__(self, score_weight: int = 25):
         """
         Args:
@@ -33,16 +38,22 @@ class UnusualTimeRule(BaseRule):
     def name(self) -> str:
         return "Unusual Time Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        # Get hour of transaction (0-23)
-        hour = transaction.timestamp.hour
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        # Hour of transaction (0-23, UTC)
+        hour = features.hour
 
         # Check if transaction is during suspicious hours
         if self.SUSPICIOUS_START_HOUR <= hour < self.SUSPICIOUS_END_HOUR:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"Transaction at {hour}:00 (suspicious hours: {self.SUSPICIOUS_START_HOUR}:00-{self.SUSPICIOUS_END_HOUR}:00). Legitimate users rarely transact during early morning.",
-                score_contribution=self.score_weight
-            )
+            return self._trigger(hour)
 
         return None
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        hours = batch.hours
+        rows = np.flatnonzero((hours >= self.SUSPICIOUS_START_HOUR) & (hours < self.SUSPICIOUS_END_HOUR))
+        return {row: self._trigger(hour) for row, hour in zip(rows.tolist(), hours[rows].tolist())}
+
+    def _trigger(self, hour: int) -> TriggerRecord:
+        return TriggerRecord(
+            self.name, self.score_weight, self.REASON, (hour, self.SUSPICIOUS_START_HOUR, self.SUSPICIOUS_END_HOUR)
+        )
@@ -1,55 +1,174 @@
 """
 Rule: Flags users with too many transactions in a short time window.
-Trade-off: Using in-memory storage instead of Redis/database for simplicity.
+Trade-off: Using an in-memory state store instead of Redis/database for simplicity.
 """
 from app.services.rules.base_rule import BaseRule
-from app.schemas import Transaction, RuleTrigger
-from typing import Optional, Dict, List
-from datetime import datetime, timedelta
-from collections import defaultdict
+from app.schemas import TriggerRecord
+from app.services.batch import TransactionBatch, MICROSECOND
+from app.services.features import TransactionFeatures, extract_features
+from app.services.state_store import NIL, StateStore, default_store
+from typing import Optional, Dict, Iterable, List
+from datetime import timedelta
+import numpy as np
 
 
 class VelocityRule(BaseRule):
     """Detects high transaction velocity (frequency) for a user."""
 
-    # In-memory storage: user_id -> list of transaction timestamps
-    # Note: In production, this would use Redis or a time-series database
-    _transaction_history: Dict[str, List[datetime]] = defaultdict(list)
+    REASON = "User has {0} transactions in last {1} minutes (max: {2})"
 
-    def __init__(self, max_transactions: int = 3, time_window_minutes: int = 10, score_weight: int = 50):
+    def __init__(
+        self,
+        max_transactions: int = 3,
+        time_window_minutes: int = 10,
+        score_weight: int = 50,
+        state_store: Optional[StateStore] = None,
+    ):
         """
         Args:
             max_transactions: Max allowed transactions in time window
             time_window_minutes: Time window to check (minutes)
             score_weight: Points added if rule triggers
+            state_store: Per-user state (shared default store if omitted)
         """
         super().__init__(score_weight)
         self.max_transactions = max_transactions
         self.time_window = timedelta(minutes=time_window_minutes)
+        # In-memory storage: user slot -> epoch-microsecond timestamps inside the window
+        # Note: In production, this would use Redis or a time-series database
+        self.state_store = state_store if state_store is not None else default_store
 
     @property
     def name(self) -> str:
         return "Velocity Rule"
 
-    def evaluate(self, transaction: Transaction) -> Optional[RuleTrigger]:
-        user_id = transaction.user_id
-        current_time = transaction.timestamp
-
-        # Get user's transaction history
-        user_history = self._transaction_history[user_id]
-
-        # Remove transactions outside the time window
-        cutoff_time = current_time - self.time_window
-        user_history[:] = [ts for ts in user_history if ts > cutoff_time]
+    @property
+    def state_horizon(self) -> timedelta:
+        return self.time_window
 
-        # Add current transaction
-        user_history.append(current_time)
+    def evaluate(self, features: TransactionFeatures) -> Optional[TriggerRecord]:
+        # Drop timestamps outside the window, add the current one, count what is left
+        # (the caller holds the user's lock: concurrent requests for one user must not interleave)
+        count = self.state_store.record_velocity(
+            features.slot, features.timestamp_us, self.time_window // MICROSECOND
+        )
 
         # Check if velocity exceeded
-        if len(user_history) > self.max_transactions:
-            return RuleTrigger(
-                rule_name=self.name,
-                reason=f"User has {len(user_history)} transactions in last {self.time_window.seconds // 60} minutes (max: {self.max_transactions})",
-                score_contribution=self.score_weight
-            )
+        if count > self.max_transactions:
+            return self._trigger(count)
         return None
+
+    def evaluate_batch(self, batch: TransactionBatch) -> Dict[int, TriggerRecord]:
+        counts = self.window_counts(batch)
+        rows = np.flatnonzero(counts > self.max_transactions)
+        return {row: self._trigger(count) for row, count in zip(rows.tolist(), counts[rows].tolist())}
+
+    def window_counts(self, batch: TransactionBatch) -> np.ndarray:
+        """
+        Vectorized velocity count over a whole batch: each row's transactions in
+        the window, itself included (what evaluate() compares to max_transactions).
+
+        Process:
+        1. Per user, lay out stored history followed by the user's batch timestamps
+        2. Window count per row = its position - searchsorted(cutoff) + 1
+        3. Write back each user's surviving history
+
+        The searchsorted count relies on a user's timestamps never going backwards
+        (then a pruned timestamp can never come back into the window). Users whose
+        history + batch timestamps do go backwards are counted sequentially, so
+        counts always match evaluate() in input order.
+
+        The batch's users stay locked from reading their history to writing it back.
+        """
+        with self.state_store.users_locked(batch.user_groups.users):
+            return self._window_counts_locked(batch)
+
+    def _window_counts_locked(self, batch: TransactionBatch) -> np.ndarray:
+        groups = batch.user_groups
+        group_count = len(groups.users)
+        window_us = self.time_window // MICROSECOND
+
+        # Stored history per user, seeded in front of the user's batch timestamps
+        seed_counts, seed_values = self.state_store.gather_velocity(self.state_store.lookup(groups.users))
+
+        # Combined layout: [seed..., batch...] per group, groups back to back
+        sizes = seed_counts + (groups.ends - groups.starts)
+        offsets = np.cumsum(sizes) - sizes
+        values = np.empty(int(sizes.sum()), dtype=np.int64)
+        value_group = np.repeat(np.arange(group_count), sizes)
+        batch_slots = (
+            offsets[groups.group] + seed_counts[groups.group]
+            + np.arange(batch.size) - groups.starts[groups.group]
+        )
+        is_seed = np.ones(len(values), dtype=bool)
+        is_seed[batch_slots] = False
+        values[batch_slots] = batch.timestamps_us[groups.order]
+        values[is_seed] = seed_values
+
+        # Users whose timestamps go backwards fall back to sequential counting
+        drops = np.flatnonzero(values[1:] < values[:-1]) + 1
+        drops = drops[value_group[drops] == value_group[drops - 1]]
+        backwards = np.zeros(group_count, dtype=bool)
+        backwards[value_group[drops]] = True
+
+        counts = np.zeros(batch.size, dtype=np.int64)
+        forward = ~backwards[value_group]
+        if forward.any():
+            self._count_forward(groups, values, value_group, batch_slots, forward, window_us, counts)
+
+        for group in np.flatnonzero(backwards).tolist():
+            for row in groups.order[groups.starts[group]:groups.ends[group]].tolist():
+                features = extract_features(batch.transactions[row], self.state_store)
+                counts[row] = self.state_store.record_velocity(features.slot, features.timestamp_us, window_us)
+        return counts
+
+    def _count_forward(self, groups, values, value_group, batch_slots, forward, window_us, counts: np.ndarray) -> None:
+        """Sliding-window counts (into `counts`, by row) for users with non-decreasing timestamps."""
+        # Compact to forward users only; slot positions shift accordingly
+        new_slot = np.cumsum(forward) - 1
+        values = values[forward]
+        value_group = value_group[forward]
+        positions = np.flatnonzero(forward[batch_slots])
+        slots = new_slot[batch_slots[positions]]
+
+        # One global searchsorted: rank timestamps and cutoffs together, then key by group
+        cutoffs = values[slots] - window_us
+        ranks = np.unique(np.concatenate([values, cutoffs]), return_inverse=True)[1].reshape(-1)
+        scale = int(ranks.max()) + 1
+        value_keys = value_group * scale + ranks[:len(values)]
+        cutoff_keys = value_group[slots] * scale + ranks[len(values):]
+        window_starts = np.searchsorted(value_keys, cutoff_keys, side="right")
+        counts[groups.order[positions]] = slots - window_starts + 1
+
+        # Write back: history after a user's last transaction is [window start, last]
+        last = np.flatnonzero(np.append(value_group[slots][1:] != value_group[slots][:-1], True))
+        for index in last.tolist():
+            user_id = groups.users[value_group[slots[index]]]
+            survivors = values[window_starts[index]:slots[index] + 1].tolist()
+            slot = self.state_store.touch(user_id, survivors[-1])
+            self.state_store.set_velocity_history(slot, survivors)
+
+    def export_user_state(self, user_ids: Iterable[str]) -> Dict[str, List[int]]:
+        """{user_id: velocity timestamps in epoch microseconds}"""
+        states = {}
+        for user_id in user_ids:
+            with self.state_store.user_lock(user_id):
+                slot = self.state_store.slot(user_id)
+                history = self.state_store.velocity_history(slot) if slot != NIL else None
+            if history:
+                states[user_id] = history
+        return states
+
+    def import_user_state(self, states: Dict[str, List[int]]) -> None:
+        for user_id, timestamps in states.items():
+            with self.state_store.user_lock(user_id):
+                slot = self.state_store.touch(user_id, max(timestamps))
+                self.state_store.set_velocity_history(slot, timestamps)
+
+    def clear_state(self) -> None:
+        self.state_store.clear()
+
+    def _trigger(self, count: int) -> TriggerRecord:
+        return TriggerRecord(
+            self.name, self.score_weight, self.REASON, (count, self.time_window.seconds // 60, self.max_transactions)
+        )
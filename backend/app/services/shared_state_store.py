@@ -0,0 +1,557 @@
+"""
+Shared-memory state backend: every worker process on the box sees the same per-user state.
+Layout: one multiprocessing.shared_memory segment holding an open-addressing
+hash table of fixed-size records (int64 words), keyed by a 128-bit digest of user_id.
+Trade-off: Table size and velocity history depth are fixed up front vs no
+external store (Redis) and no pinning users to processes.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from app.services.state_store import MIN_US, NIL, NO_COUNTRY, StateStore, UserStateStore
+
+MAGIC = 0x4347535431  # "CGST1"
+LAYOUT_VERSION = 1
+SNAPSHOT_MAGIC = b"CGSHM001"
+SNAPSHOT_PREFIX_BYTES = 16  # magic + log position
+
+# Header words
+H_MAGIC, H_VERSION, H_SLOTS, H_HISTORY, H_MAX_USERS, H_USED, H_TOMBSTONES, H_WATERMARK, \
+    H_EVICTED_IDLE, H_EVICTED_CAPACITY, H_EVICTED_ACTIVE = range(11)
+HEADER_WORDS = 16
+
+# Record words (the velocity history follows R_HISTORY)
+R_STATE, R_KEY0, R_KEY1, R_LAST_SEEN, R_LAST_TIME, R_COUNTRY, R_LATITUDE, R_LONGITUDE, \
+    R_HISTORY_LEN = range(9)
+R_HISTORY = 9
+
+# Record states
+EMPTY, USED, TOMBSTONE = 0, 1, 2
+
+# Table slots per user at most (load factor 0.75)
+SLOTS_PER_USER = 4 / 3
+
+# Users sampled per capacity eviction (approximate LRU, as in Redis)
+EVICTION_SAMPLES = 8
+
+_KEY = struct.Struct("<qq")
+
+
+def _key(user_id: str) -> Tuple[int, int]:
+    """128-bit digest of a user_id as two int64 words."""
+    return _KEY.unpack(hashlib.blake2b(user_id.encode("utf-8"), digest_size=16).digest())
+
+
+def encode_country(country: str) -> int:
+    """Two-character country code as an integer (the same in every process)."""
+    if len(country) != 2:
+        raise ValueError(f"Shared state store needs 2-character country codes, got {country!r}")
+    return ord(country[0]) << 21 | ord(country[1])
+
+
+def decode_country(code: int) -> str:
+    return chr(code >> 21) + chr(code & 0x1FFFFF)
+
+
+class _ProcessLock:
+    """
+    Reentrant lock across threads and processes: an RLock for the threads of
+    this process plus an fcntl byte-range lock on a shared lock file.
+    """
+    __slots__ = ("_lock", "_fd", "_offset", "_depth")
+
+    def __init__(self, fd: int, offset: int):
+        self._lock = threading.RLock()
+        self._fd = fd
+        self._offset = offset
+        self._depth = 0
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB), 1, self._offset)
+            except OSError:
+                self._lock.release()
+                if blocking:
+                    raise
+                return False
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._offset)
+        self._lock.release()
+
+    def __enter__(self) -> "_ProcessLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class SharedMemoryStateStore(StateStore):
+    """
+    Per-user state in a named shared memory segment, usable from any process.
+
+    Every process (e.g. each `uvicorn --workers N` worker) that constructs a
+    store with the same name attaches to the same table; the first one creates
+    it. The segment outlives the processes, so a restart keeps all state;
+    unlink() removes it.
+
+    Records (int64 words): state, user digest (2 words), last_seen, last_time,
+    last country, last latitude/longitude (float64), history length, then
+    `history_capacity` velocity timestamps.
+
+    Concurrency:
+    - Lookups probe the table without locks. A record's digest is written
+      before it is marked used, and records never move while a user's lock
+      is held, so a lock-free reader sees a user either fully or not at all.
+    - Updates run under the user's lock, striped across threads and processes
+      (RLock + fcntl byte-range lock per stripe), like UserStateStore.
+    - Inserts, evictions and counters take a table lock, after any user locks.
+      The watermark is advanced without it (a lost race only delays TTL expiry).
+
+    Differences from the in-process backend:
+    - A user's velocity history keeps at most `history_capacity` timestamps;
+      when full, the oldest is dropped. Velocity decisions stay exact while
+      history_capacity >= max_transactions; reported counts saturate at
+      history_capacity + 1.
+    - Capacity eviction is approximate LRU (oldest of a random sample), and
+      user_ids are not kept (only digests, so tracks_user_ids is False).
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        name: str = "creditguard-state",
+        ttl: timedelta = timedelta(hours=24),
+        max_users: int = 1_000_000,
+        sweep_interval_seconds: float = 0,
+        history_capacity: int = 8,
+    ):
+        """
+        Args:
+            name: Shared memory segment name (processes using the same name share state)
+            ttl: Idle time after which a user's state is dropped
+            max_users: Maximum users kept (an existing segment's own size wins)
+            sweep_interval_seconds: Background TTL sweep period (0 = no sweeper thread)
+            history_capacity: Velocity timestamps kept per user
+        """
+        super().__init__(ttl, max_users, sweep_interval_seconds)
+        self.name = name
+
+        slots = int(max_users * SLOTS_PER_USER) + 1
+        record_words = R_HISTORY + history_capacity
+        size = (HEADER_WORDS + slots * record_words) * 8
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            created = False
+        # The segment belongs to the deployment, not this process: keep it past our exit
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        self._lock_fd = os.open(
+            os.path.join(tempfile.gettempdir(), f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600
+        )
+        self._stripes = [_ProcessLock(self._lock_fd, stripe) for stripe in range(self.LOCK_STRIPES)]
+        self._table_lock = _ProcessLock(self._lock_fd, self.LOCK_STRIPES)
+
+        header = self._shm.buf[:HEADER_WORDS * 8].cast("q")
+        if created:
+            header[H_VERSION] = LAYOUT_VERSION
+            header[H_SLOTS] = slots
+            header[H_HISTORY] = history_capacity
+            header[H_MAX_USERS] = max_users
+            header[H_WATERMARK] = MIN_US
+            header[H_MAGIC] = MAGIC  # last: attaching processes wait for it
+        else:
+            deadline = time.monotonic() + 5
+            while header[H_MAGIC] != MAGIC:
+                if time.monotonic() > deadline:
+                    header.release()
+                    raise ValueError(f"Shared memory segment {name!r} is not a state store")
+                time.sleep(0.01)
+            if header[H_VERSION] != LAYOUT_VERSION:
+                header.release()
+                raise ValueError(f"Shared memory segment {name!r} has layout version {header[H_VERSION]}")
+        header.release()
+
+        self._map()
+        self._start_sweeper()
+
+    def __reduce__(self):
+        # Pickled along with rules (batch process pool): workers get a private in-process store
+        return (UserStateStore, (self.ttl, self.max_users, 0))
+
+    def _map(self) -> None:
+        """Typed views over the segment, sized from its header."""
+        header = self._shm.buf[:HEADER_WORDS * 8].cast("q")
+        self._slots = header[H_SLOTS]
+        self.history_capacity = header[H_HISTORY]
+        self.max_users = header[H_MAX_USERS]
+        header.release()
+        self._record_words = R_HISTORY + self.history_capacity
+        size = (HEADER_WORDS + self._slots * self._record_words) * 8
+        self._words = self._shm.buf[:size].cast("q")
+        self._floats = self._shm.buf[:size].cast("d")
+
+    def _table(self) -> np.ndarray:
+        """(slots, record words) int64 view of the table (temporary, do not keep)."""
+        return np.frombuffer(self._shm.buf, dtype=np.int64, count=self._slots * self._record_words,
+                             offset=HEADER_WORDS * 8).reshape(self._slots, self._record_words)
+
+    def _offset(self, slot: int) -> int:
+        return HEADER_WORDS + slot * self._record_words
+
+    # --- Slots -------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._words[H_USED]
+
+    def _stripe_index(self, user_id: str) -> int:
+        return _key(user_id)[0] & (self.LOCK_STRIPES - 1)
+
+    def slot(self, user_id: str) -> int:
+        return self._probe(*_key(user_id))[0]
+
+    def lookup(self, user_ids: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self.slot(user_id) for user_id in user_ids), dtype=np.int64, count=len(user_ids))
+
+    def touch(self, user_id: str, event_us: int) -> int:
+        key0, key1 = _key(user_id)
+        slot = self._probe(key0, key1)[0]
+        if slot == NIL:
+            with self._table_lock:
+                slot, reusable = self._probe(key0, key1)
+                if slot == NIL:
+                    slot = self._insert(reusable, key0, key1)
+
+        words = self._words
+        offset = self._offset(slot)
+        if event_us > words[offset + R_LAST_SEEN]:
+            words[offset + R_LAST_SEEN] = event_us
+        if event_us > words[H_WATERMARK]:
+            words[H_WATERMARK] = event_us
+        return slot
+
+    # --- Velocity history --------------------------------------------------
+
+    def record_velocity(self, slot: int, event_us: int, window_us: int) -> int:
+        words = self._words
+        cutoff = event_us - window_us
+        offset = self._offset(slot)
+        start = write = offset + R_HISTORY
+        for read in range(start, start + words[offset + R_HISTORY_LEN]):
+            ts = words[read]
+            if ts > cutoff:
+                words[write] = ts
+                write += 1
+        count = write - start + 1
+
+        if count > self.history_capacity:
+            # Full: drop the oldest timestamp (the first one to leave the window anyway)
+            history = words[start:write].tolist()
+            history.remove(min(history))
+            words[start:write - 1] = memoryview(struct.pack(f"{len(history)}q", *history)).cast("q")
+            write -= 1
+        words[write] = event_us
+        words[offset + R_HISTORY_LEN] = write - start + 1
+        return count
+
+    def velocity_history(self, slot: int) -> List[int]:
+        offset = self._offset(slot)
+        start = offset + R_HISTORY
+        return self._words[start:start + self._words[offset + R_HISTORY_LEN]].tolist()
+
+    def set_velocity_history(self, slot: int, timestamps: List[int]) -> None:
+        if len(timestamps) > self.history_capacity:
+            timestamps = sorted(timestamps)[-self.history_capacity:]
+        offset = self._offset(slot)
+        start = offset + R_HISTORY
+        for index, ts in enumerate(timestamps):
+            self._words[start + index] = ts
+        self._words[offset + R_HISTORY_LEN] = len(timestamps)
+
+    def gather_velocity(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        present = slots != NIL
+        table = self._table()
+        counts = np.zeros(len(slots), dtype=np.int64)
+        counts[present] = table[slots[present], R_HISTORY_LEN]
+        columns = np.arange(self.history_capacity)
+        filled = columns < counts[:, None]
+        history = np.zeros((len(slots), self.history_capacity), dtype=np.int64)
+        history[present] = table[slots[present], R_HISTORY:]
+        return counts, history[filled]
+
+    # --- Last transaction (impossible travel) ------------------------------
+
+    def last_transaction(self, slot: int) -> Optional[Tuple[str, int]]:
+        offset = self._offset(slot)
+        code = self._words[offset + R_COUNTRY]
+        if code == NO_COUNTRY:
+            return None
+        return decode_country(code), self._words[offset + R_LAST_TIME]
+
+    def last_position(self, slot: int) -> Optional[Tuple[float, float]]:
+        offset = self._offset(slot)
+        latitude = self._floats[offset + R_LATITUDE]
+        if math.isnan(latitude):
+            return None
+        return latitude, self._floats[offset + R_LONGITUDE]
+
+    def set_last_transaction(
+        self, slot: int, country: str, event_us: int,
+        latitude: Optional[float] = None, longitude: Optional[float] = None
+    ) -> None:
+        offset = self._offset(slot)
+        self._words[offset + R_COUNTRY] = encode_country(country)
+        self._words[offset + R_LAST_TIME] = event_us
+        if latitude is None or longitude is None:
+            latitude = longitude = math.nan
+        self._floats[offset + R_LATITUDE] = latitude
+        self._floats[offset + R_LONGITUDE] = longitude
+
+    def gather_last_transactions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        present = slots != NIL
+        table = self._table()
+        codes = np.full(len(slots), NO_COUNTRY, dtype=np.int64)
+        times = np.zeros(len(slots), dtype=np.int64)
+        codes[present] = table[slots[present], R_COUNTRY]
+        times[present] = table[slots[present], R_LAST_TIME]
+        return codes, times
+
+    def gather_last_positions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        present = slots != NIL
+        table = self._table().view(np.float64)
+        latitudes = np.full(len(slots), np.nan)
+        longitudes = np.full(len(slots), np.nan)
+        latitudes[present] = table[slots[present], R_LATITUDE]
+        longitudes[present] = table[slots[present], R_LONGITUDE]
+        return latitudes, longitudes
+
+    def country_name(self, code: int) -> str:
+        return decode_country(code)
+
+    # --- Maintenance -------------------------------------------------------
+
+    def sweep(self) -> int:
+        cutoff = self._words[H_WATERMARK] - self._ttl_us
+        table = self._table()
+        candidates = np.flatnonzero(
+            (table[:, R_STATE] == USED) & (table[:, R_LAST_SEEN] <= cutoff)
+        ).tolist()
+        del table
+
+        evicted = 0
+        with self._table_lock:
+            for slot in candidates:
+                offset = self._offset(slot)
+                # Re-check under the lock: the user may have transacted since the scan
+                if self._words[offset + R_STATE] == USED and self._words[offset + R_LAST_SEEN] <= cutoff:
+                    evicted += self._try_free_slot(slot)
+            self._words[H_EVICTED_IDLE] += evicted
+
+        # Tombstones lengthen probes for absent users; rebuild once they are a quarter of the table
+        if self._words[H_TOMBSTONES] > self._slots // 4:
+            with self._stripes_locked(range(self.LOCK_STRIPES)), self._table_lock:
+                self._rebuild()
+        return evicted
+
+    def discard(self, user_ids: Iterable[str]) -> int:
+        user_ids = list(user_ids)
+        dropped = 0
+        with self.users_locked(user_ids), self._table_lock:
+            for user_id in user_ids:
+                slot = self.slot(user_id)
+                if slot != NIL:
+                    self._free_slot(slot)
+                    dropped += 1
+        return dropped
+
+    def clear(self) -> None:
+        with self._stripes_locked(range(self.LOCK_STRIPES)), self._table_lock:
+            self._table()[:] = 0
+            for word in (H_USED, H_TOMBSTONES, H_EVICTED_IDLE, H_EVICTED_CAPACITY, H_EVICTED_ACTIVE):
+                self._words[word] = 0
+            self._words[H_WATERMARK] = MIN_US
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": "shared",
+            "name": self.name,
+            "users": self._words[H_USED],
+            "max_users": self.max_users,
+            "capacity": self._slots,
+            "history_capacity": self.history_capacity,
+            "table_bytes": self._slots * self._record_words * 8,
+            "tombstones": self._words[H_TOMBSTONES],
+            "ttl_seconds": self.ttl.total_seconds(),
+            "horizon_seconds": self.horizon.total_seconds(),
+            "evicted_idle": self._words[H_EVICTED_IDLE],
+            "evicted_capacity": self._words[H_EVICTED_CAPACITY],
+            "evicted_active": self._words[H_EVICTED_ACTIVE],
+        }
+
+    def write_snapshot(self, path: str, position: Optional[Callable[[], int]] = None) -> int:
+        """Snapshot = magic, log position, then the segment's bytes (header and table)."""
+        with self._stripes_locked(range(self.LOCK_STRIPES)), self._table_lock:
+            image = bytes(self._words.cast("B"))
+            users = self._words[H_USED]
+            log_position = position() if position is not None else 0
+        with open(path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<q", log_position))
+            f.write(image)
+        return users
+
+    def load_snapshot(self, path: str) -> int:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a shared state snapshot")
+            header = np.frombuffer(mapped, dtype=np.int64, count=HEADER_WORDS, offset=SNAPSHOT_PREFIX_BYTES)
+            layout = (header[H_VERSION], header[H_SLOTS], header[H_HISTORY])
+            del header
+            if layout != (LAYOUT_VERSION, self._slots, self.history_capacity):
+                raise ValueError(f"{path} has a different table layout (version, slots, history) {layout}")
+            if len(mapped) != SNAPSHOT_PREFIX_BYTES + self._words.nbytes:
+                raise ValueError(f"{path} is truncated or corrupt")
+            with self._stripes_locked(range(self.LOCK_STRIPES)), self._table_lock:
+                self._words.cast("B")[:] = mapped[SNAPSHOT_PREFIX_BYTES:]
+        return self._words[H_USED]
+
+    def close(self) -> None:
+        """Stop the sweeper and detach (the segment and its state stay)."""
+        super().close()
+        self._words.release()
+        self._floats.release()
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self) -> None:
+        """Detach and delete the segment (all processes lose the state)."""
+        self.close()
+        resource_tracker.register(self._shm._name, "shared_memory")  # unlink() unregisters it again
+        self._shm.unlink()
+
+    # --- Internals ---------------------------------------------------------
+
+    def _probe(self, key0: int, key1: int) -> Tuple[int, int]:
+        """
+        Linear probe for a key.
+
+        Returns:
+            (slot holding the key or NIL, first reusable slot on the path or NIL)
+        """
+        words = self._words
+        record_words = self._record_words
+        slots = self._slots
+        slot = key1 % slots
+        reusable = NIL
+        for _ in range(slots):
+            offset = HEADER_WORDS + slot * record_words
+            state = words[offset]
+            if state == EMPTY:
+                return NIL, (slot if reusable == NIL else reusable)
+            if state == USED:
+                if words[offset + R_KEY0] == key0 and words[offset + R_KEY1] == key1:
+                    return slot, NIL
+            elif reusable == NIL:
+                reusable = slot
+            slot += 1
+            if slot == slots:
+                slot = 0
+        return NIL, reusable
+
+    def _insert(self, slot: int, key0: int, key1: int) -> int:
+        """Claim `slot` (from _probe) for a new user. Table lock held."""
+        words = self._words
+        if words[H_USED] >= self.max_users and self._evict_sample():
+            # Eviction may have freed a slot earlier on this key's probe path
+            slot = self._probe(key0, key1)[1]
+        if slot == NIL:
+            raise RuntimeError(f"Shared state table {self.name!r} is full")
+
+        offset = self._offset(slot)
+        if words[offset + R_STATE] == TOMBSTONE:
+            words[H_TOMBSTONES] -= 1
+        words[offset + R_KEY0] = key0
+        words[offset + R_KEY1] = key1
+        words[offset + R_LAST_SEEN] = MIN_US
+        words[offset + R_LAST_TIME] = 0
+        words[offset + R_COUNTRY] = NO_COUNTRY
+        self._floats[offset + R_LATITUDE] = math.nan
+        self._floats[offset + R_LONGITUDE] = math.nan
+        words[offset + R_HISTORY_LEN] = 0
+        words[offset + R_STATE] = USED  # last: lock-free readers only match complete records
+        words[H_USED] += 1
+        return slot
+
+    def _evict_sample(self) -> bool:
+        """Evict the least recently seen of a random sample of users. Table lock held."""
+        words = self._words
+        oldest, oldest_seen = NIL, None
+        sampled = 0
+        for _ in range(EVICTION_SAMPLES * 8):
+            slot = random.randrange(self._slots)
+            offset = self._offset(slot)
+            if words[offset + R_STATE] != USED:
+                continue
+            if oldest_seen is None or words[offset + R_LAST_SEEN] < oldest_seen:
+                oldest, oldest_seen = slot, words[offset + R_LAST_SEEN]
+            sampled += 1
+            if sampled == EVICTION_SAMPLES:
+                break
+        if oldest == NIL or not self._try_free_slot(oldest):
+            return False
+        words[H_EVICTED_CAPACITY] += 1
+        words[H_EVICTED_ACTIVE] += words[H_WATERMARK] - oldest_seen < self._horizon_us
+        return True
+
+    def _try_free_slot(self, slot: int) -> bool:
+        """Free a slot unless its user's lock is held elsewhere (never blocks). Table lock held."""
+        lock = self._stripes[self._words[self._offset(slot) + R_KEY0] & (self.LOCK_STRIPES - 1)]
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            self._free_slot(slot)
+        finally:
+            lock.release()
+        return True
+
+    def _free_slot(self, slot: int) -> None:
+        self._words[self._offset(slot) + R_STATE] = TOMBSTONE
+        self._words[H_USED] -= 1
+        self._words[H_TOMBSTONES] += 1
+
+    def _rebuild(self) -> None:
+        """Re-insert all users into a tombstone-free table. Every lock held."""
+        table = self._table()
+        records = table[table[:, R_STATE] == USED].copy()
+        table[:] = 0
+        occupied = np.zeros(self._slots, dtype=bool)
+        for record, home in zip(records, (records[:, R_KEY1] % self._slots).tolist()):
+            slot = home
+            while occupied[slot]:
+                slot = (slot + 1) % self._slots
+            occupied[slot] = True
+            table[slot] = record
+        self._words[H_TOMBSTONES] = 0
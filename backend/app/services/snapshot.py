@@ -0,0 +1,166 @@
+"""
+Periodic snapshots of the per-user state store, and warm start from the latest one.
+A restarted engine resumes with velocity and travel history instead of a blind spot.
+Trade-off: Up to one snapshot interval of state is lost on a crash vs no
+per-transaction write cost.
+"""
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Dict, Optional
+from app.services.event_log import EventLog, exclusive_lock
+from app.services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshotter:
+    """
+    Writes the state store to `path` every `interval_seconds` from a background thread.
+
+    Snapshots are written to a temporary file, fsynced and renamed over `path`,
+    so a crash mid-write leaves the previous snapshot intact. Request threads
+    only pause while the store copies its columns (see StateStore.write_snapshot).
+    A final snapshot is taken at interpreter exit.
+
+    With an event log, each snapshot records the log position it covers, and
+    log segments before it are compacted away once the snapshot is in place.
+
+    One process writes a path: claim() (called by the first snapshot) takes an
+    exclusive lock on <path>.lock, so two processes never share <path>.tmp.
+    """
+
+    def __init__(
+        self, store: StateStore, path: str, interval_seconds: float = 300, event_log: Optional[EventLog] = None
+    ):
+        self.store = store
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.event_log = event_log
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+
+        self.loaded_users = 0
+        self.load_seconds: Optional[float] = None
+        self.snapshots = 0
+        self.last_snapshot_users = 0
+        self.last_snapshot_seconds: Optional[float] = None
+        self.last_snapshot_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def warm_start(self) -> int:
+        """
+        Load the snapshot at `path` into an empty store.
+
+        A missing snapshot means a cold start; an unreadable one is reported
+        (last_error) and skipped. A store that already holds state (e.g. a
+        shared memory segment that outlived the restart) is left alone.
+        Returns the event log position the loaded snapshot covers (0 if none loaded).
+        """
+        if len(self.store) or not os.path.exists(self.path):
+            return 0
+        start = time.perf_counter()
+        try:
+            position = snapshot_position(self.path)
+            self.loaded_users = self.store.load_snapshot(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            self.last_error = f"warm start from {self.path} failed: {e}"
+            logger.warning(self.last_error)
+            return 0
+        self.load_seconds = time.perf_counter() - start
+        return position
+
+    def claim(self) -> None:
+        """Become the writer of `path` (RuntimeError if another process is)."""
+        if self._lock_fd is None:
+            self._lock_fd = exclusive_lock(f"{self.path}.lock", f"Snapshot path {self.path}")
+
+    def snapshot(self) -> int:
+        """Write a snapshot now. Returns the number of users written."""
+        self.claim()
+        with self._write_lock:
+            start = time.perf_counter()
+            temporary = f"{self.path}.tmp"
+            log = self.event_log
+            users = self.store.write_snapshot(temporary, (lambda: log.next_sequence) if log else None)
+            with open(temporary, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+            if log is not None:
+                log.compact(snapshot_position(self.path))
+
+            self.snapshots += 1
+            self.last_snapshot_users = users
+            self.last_snapshot_seconds = time.perf_counter() - start
+            self.last_snapshot_at = time.time()
+            return users
+
+    def start(self) -> None:
+        """Start periodic snapshots (and the final one at exit)."""
+        if self.interval_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name="state-snapshotter", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Stop the periodic thread and write a final snapshot."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._try_snapshot()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "interval_seconds": self.interval_seconds,
+            "loaded_users": self.loaded_users,
+            "load_seconds": self.load_seconds,
+            "snapshots": self.snapshots,
+            "last_snapshot_users": self.last_snapshot_users,
+            "last_snapshot_seconds": self.last_snapshot_seconds,
+            "last_snapshot_at": self.last_snapshot_at,
+            "last_error": self.last_error,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self._try_snapshot()
+
+    def _try_snapshot(self) -> None:
+        try:
+            self.snapshot()
+        except OSError as e:
+            # Keep serving; the next interval retries
+            self.last_error = f"snapshot to {self.path} failed: {e}"
+            logger.warning(self.last_error)
+
+
+def snapshot_position(path: str) -> int:
+    """Event log position stored in a snapshot file (after its 8-byte magic)."""
+    with open(path, "rb") as f:
+        f.seek(8)
+        return struct.unpack("<q", f.read(8))[0]
+
+
+def snapshotter_from_env(store: StateStore, event_log: Optional[EventLog] = None) -> Optional[Snapshotter]:
+    """
+    Snapshotter configured from CREDITGUARD_SNAPSHOT_* environment variables.
+    None (no snapshots) unless CREDITGUARD_SNAPSHOT_PATH is set.
+    """
+    path = os.getenv("CREDITGUARD_SNAPSHOT_PATH")
+    if not path:
+        return None
+    interval_seconds = float(os.getenv("CREDITGUARD_SNAPSHOT_SECONDS", "300"))
+    snapshotter = Snapshotter(store, path, interval_seconds, event_log)
+    snapshotter.claim()  # fail at startup, not at the first snapshot
+    return snapshotter
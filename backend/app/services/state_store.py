@@ -0,0 +1,941 @@
+"""
+Per-user state store shared by the stateful rules (velocity, impossible travel).
+StateStore is the interface; UserStateStore is the default in-process backend
+(see shared_state_store.py for the cross-process shared-memory backend).
+Compact layout: user_ids are interned to integer slots and every per-user field
+lives in a typed array column - no Python objects per user.
+Bounded memory: idle users expire after a TTL, and the least recently used
+user is evicted once the store is full.
+Thread safety: per-user read-modify-write runs under striped per-user locks.
+Trade-off: Event-time TTL (deterministic, replay-friendly) vs wall-clock expiry.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+NIL = -1          # empty link / missing slot
+NO_COUNTRY = -1   # user has no last transaction
+MIN_US = -(2 ** 63)
+
+# Snapshot file: header, then 8-byte aligned sections (see _snapshot_layout)
+SNAPSHOT_MAGIC = b"CGSNAP01"
+_SNAPSHOT_HEADER = struct.Struct("<8sqIIqqqqq")  # magic, log position, history capacity, flags, users, overflow, id bytes, country bytes, watermark
+SNAPSHOT_HEADER_BYTES = 64
+SNAPSHOT_NEWLINE_IDS = 1  # header flag: user_ids section is newline-separated
+
+
+class OverflowHistory:
+    """Velocity timestamps for a user whose window holds more than the inline capacity."""
+    __slots__ = ("timestamps",)
+
+    def __init__(self, timestamps: Iterable[int]):
+        self.timestamps = array("q", timestamps)
+
+
+class StateStore(ABC):
+    """
+    Per-user rule state: user_id -> integer slot -> velocity history and last transaction.
+
+    Rules use it as:
+    1. with store.user_lock(user_id): slot = store.touch(user_id, event_us), then
+       read/write the slot's fields (batches: users_locked + lookup/gather_*)
+    2. Slots are only valid while the user's lock is held
+
+    Timestamps are int64 epoch microseconds. Backends implement slot management,
+    field access, eviction and a lock stripe per user (`_stripe_index`).
+    """
+
+    # Per-user lock stripes (power of two)
+    LOCK_STRIPES = 64
+
+    # True if the state is visible to other processes (nothing to hand off between workers)
+    shared = False
+    # True if the store keeps user_id strings and implements users()
+    tracks_user_ids = False
+
+    def __init__(self, ttl: timedelta, max_users: int, sweep_interval_seconds: float):
+        if max_users < 1:
+            raise ValueError("max_users must be at least 1")
+        self.ttl = ttl
+        self.max_users = max_users
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.horizon = timedelta(0)
+        self._ttl_us = ttl // timedelta(microseconds=1)
+        self._horizon_us = 0
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def require_horizon(self, horizon: timedelta) -> None:
+        """
+        Declare how far back a rule's state can matter.
+        Raises ValueError if the TTL could evict state a rule still needs.
+        """
+        if horizon > self.ttl:
+            raise ValueError(
+                f"State TTL {self.ttl} is shorter than a rule's state horizon {horizon}; "
+                f"eviction would change results"
+            )
+        self.horizon = max(self.horizon, horizon)
+        self._horizon_us = self.horizon // timedelta(microseconds=1)
+
+    # --- Per-user locks ----------------------------------------------------
+
+    def user_lock(self, user_id: str):
+        """Lock guarding one user's state (shared with the other users on its stripe)."""
+        return self._stripes[self._stripe_index(user_id)]
+
+    @contextmanager
+    def users_locked(self, user_ids: Iterable[str]) -> Iterator[None]:
+        """Hold the locks of all given users (for batch read-modify-write)."""
+        with self._stripes_locked(sorted({self._stripe_index(user_id) for user_id in user_ids})):
+            yield
+
+    @contextmanager
+    def _stripes_locked(self, stripes: Iterable[int]) -> Iterator[None]:
+        """Acquire lock stripes in ascending order (the global lock order), release on exit."""
+        acquired = []
+        try:
+            for stripe in stripes:
+                self._stripes[stripe].acquire()
+                acquired.append(self._stripes[stripe])
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    @abstractmethod
+    def _stripe_index(self, user_id: str) -> int:
+        """Lock stripe of a user, in [0, LOCK_STRIPES)."""
+
+    # --- Slots -------------------------------------------------------------
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of users tracked."""
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.slot(user_id) != NIL
+
+    @abstractmethod
+    def slot(self, user_id: str) -> int:
+        """User's slot without touching recency (NIL if unknown)."""
+
+    @abstractmethod
+    def lookup(self, user_ids: Sequence[str]) -> np.ndarray:
+        """Slots for many users at once (NIL where unknown)."""
+
+    @abstractmethod
+    def touch(self, user_id: str, event_us: int) -> int:
+        """Slot for an event at event_us, created if needed; advances recency and the watermark."""
+
+    # --- Velocity history --------------------------------------------------
+
+    @abstractmethod
+    def record_velocity(self, slot: int, event_us: int, window_us: int) -> int:
+        """
+        Drop timestamps at or before event_us - window_us, append event_us.
+        Returns the number of timestamps now in the window (including this one).
+        """
+
+    @abstractmethod
+    def velocity_history(self, slot: int) -> List[int]:
+        """Velocity timestamps for a slot, oldest first."""
+
+    @abstractmethod
+    def set_velocity_history(self, slot: int, timestamps: List[int]) -> None:
+        """Replace a slot's velocity timestamps."""
+
+    @abstractmethod
+    def gather_velocity(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(count per slot, all timestamps concatenated in slot order); NIL slots have none."""
+
+    # --- Last transaction (impossible travel) ------------------------------
+
+    @abstractmethod
+    def last_transaction(self, slot: int) -> Optional[Tuple[str, int]]:
+        """(country, epoch microseconds) of the slot's last transaction, if any."""
+
+    @abstractmethod
+    def last_position(self, slot: int) -> Optional[Tuple[float, float]]:
+        """(latitude, longitude) of the slot's last transaction, if it had coordinates."""
+
+    @abstractmethod
+    def set_last_transaction(
+        self, slot: int, country: str, event_us: int,
+        latitude: Optional[float] = None, longitude: Optional[float] = None
+    ) -> None:
+        """Replace a slot's last transaction."""
+
+    @abstractmethod
+    def gather_last_transactions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(country code per slot - NO_COUNTRY if none, epoch microseconds per slot)."""
+
+    @abstractmethod
+    def gather_last_positions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(latitudes, longitudes) of many slots' last transactions, NaN where unknown."""
+
+    @abstractmethod
+    def country_name(self, code: int) -> str:
+        """Country for a code returned by gather_last_transactions()."""
+
+    # --- Maintenance -------------------------------------------------------
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Drop users idle longer than the TTL. Returns the number evicted."""
+
+    @abstractmethod
+    def discard(self, user_ids: Iterable[str]) -> int:
+        """Drop the given users' state. Returns the number dropped."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Drop all state."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, object]:
+        """Size, memory and eviction counters."""
+
+    # --- Snapshots ---------------------------------------------------------
+
+    @abstractmethod
+    def write_snapshot(self, path: str, position: Optional[Callable[[], int]] = None) -> int:
+        """
+        Write every user's state to a binary snapshot file.
+        State is copied under the locks (a brief pause); encoding and I/O run without them.
+
+        Args:
+            position: Called while the state is frozen; its value (e.g. the event
+                log's next sequence number) is stored in the snapshot
+
+        Every snapshot format starts with an 8-byte magic and the int64 position.
+        Returns the number of users written.
+        """
+
+    @abstractmethod
+    def load_snapshot(self, path: str) -> int:
+        """
+        Replace all state with a snapshot file (memory-mapped, bulk copied).
+        Raises ValueError if the file is not a compatible snapshot. Returns the number of users loaded.
+        """
+
+    def close(self) -> None:
+        """Stop the background sweeper."""
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def _start_sweeper(self) -> None:
+        if self.sweep_interval_seconds > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="state-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while not self._stop.wait(self.sweep_interval_seconds):
+            self.sweep()
+
+
+class UserStateStore(StateStore):
+    """
+    In-process backend (default). Struct-of-arrays store: user_id -> integer slot -> one row in each column.
+
+    Columns are array.array (fast scalar access on the per-transaction path);
+    batch paths read them through zero-copy NumPy views.
+
+    Columns (indexed by slot):
+    - history / history_len: velocity timestamps (int64 epoch microseconds) in a
+      fixed-capacity inline buffer; longer windows spill to an OverflowHistory
+    - last_country / last_time / last_latitude / last_longitude: impossible
+      travel's last transaction (coordinates NaN when not provided)
+    - last_seen: latest event time for the user (drives idle TTL)
+    - prev / next: intrusive doubly linked LRU list
+
+    Eviction:
+    - Every touch moves the user to the most-recent end (O(1) link updates).
+    - Capacity eviction pops the least recently used user (O(1)).
+    - TTL sweeps pop from the least recent end and stop at the first user that
+      is still fresh, so each sweep costs O(evicted) - amortized O(1) per user.
+    Freed slots are reused, so columns never grow beyond max_users rows.
+
+    Idle time is measured in event time: against the latest transaction
+    timestamp the store has seen (the watermark), not the wall clock. With a TTL
+    at least as long as every rule's state horizon, an evicted user's state could
+    not have influenced their next (non-backdated) transaction, so TTL eviction
+    never changes results. Capacity eviction is the hard memory bound; if it has
+    to evict users still inside the horizon, `evicted_active` counts them and the
+    store should be sized up.
+
+    Concurrency (FastAPI runs sync endpoints in a threadpool):
+    - user_lock(user_id) guards one user's columns; rules hold it for their
+      whole read-modify-write, so concurrent requests for a user serialize
+      while other users proceed in parallel. Locks are striped: users hash
+      onto LOCK_STRIPES reentrant locks.
+    - users_locked(user_ids) holds many users' locks (batches), acquired in
+      stripe order, so threads never deadlock on each other.
+    - An internal lock guards only slot allocation and the LRU list (O(1)
+      work). Eviction never waits for a user lock: users being evaluated are
+      skipped, so max_users can briefly be exceeded by at most the number of
+      users evaluated concurrently.
+    """
+
+    # Velocity timestamps stored inline per user (covers max_transactions=3 plus the current one)
+    HISTORY_CAPACITY = 4
+
+    tracks_user_ids = True
+
+    def __init__(
+        self,
+        ttl: timedelta = timedelta(hours=24),
+        max_users: int = 1_000_000,
+        sweep_interval_seconds: float = 0,
+        initial_capacity: int = 1024,
+    ):
+        """
+        Args:
+            ttl: Idle time after which a user's state is dropped
+            max_users: Maximum users kept; least recently used beyond this are dropped
+            sweep_interval_seconds: Background TTL sweep period (0 = no sweeper thread)
+            initial_capacity: Slots allocated up front (columns double as needed)
+        """
+        super().__init__(ttl, max_users, sweep_interval_seconds)
+
+        # Guards slot allocation and the LRU list; column values are guarded by the user locks
+        self._lock = threading.Lock()
+        self._stripes = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+        self._allocate(min(initial_capacity, max_users))
+
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.evicted_active = 0
+        self._start_sweeper()
+
+    def __reduce__(self):
+        # Pickled along with rules (process pool workers): ship config, not state or threads
+        return (UserStateStore, (self.ttl, self.max_users, 0))
+
+    def __len__(self) -> int:
+        return len(self._user_ids) - len(self._free)
+
+    def users(self) -> List[str]:
+        """Snapshot of the user_ids currently tracked."""
+        with self._lock:
+            return [user_id for user_id in self._user_ids if user_id is not None]
+
+    def _stripe_index(self, user_id: str) -> int:
+        return hash(user_id) & (self.LOCK_STRIPES - 1)
+
+    # --- Slots and recency -------------------------------------------------
+
+    def slot(self, user_id: str) -> int:
+        # Read the pending index first: once it is gone, every user it held is in _slots
+        pending = self._pending
+        slot = self._slots.get(user_id, NIL)
+        if slot == NIL and pending is not None:
+            slot = self._pending_slot(pending, user_id)
+        return slot
+
+    def lookup(self, user_ids: Sequence[str]) -> np.ndarray:
+        if self._pending is not None:
+            return np.fromiter(map(self.slot, user_ids), dtype=np.int64, count=len(user_ids))
+        slots = self._slots
+        return np.fromiter((slots.get(user_id, NIL) for user_id in user_ids), dtype=np.int64, count=len(user_ids))
+
+    def touch(self, user_id: str, event_us: int) -> int:
+        """
+        Slot for an event at event_us (epoch microseconds), created if needed.
+        Marks the user most recently used and advances the watermark.
+        """
+        with self._lock:
+            slot = self._slots.get(user_id, NIL)
+            if slot == NIL and self._pending is not None:
+                slot = self._pending_slot(self._pending, user_id)
+                if slot != NIL:
+                    self._slots[user_id] = slot
+            if slot == NIL:
+                slot = self._new_slot(user_id)
+            elif slot != self._tail:
+                # Hot path: unlink + link at tail, inlined
+                prev_, next_ = self._prev, self._next
+                prev, nxt = prev_[slot], next_[slot]
+                if prev != NIL:
+                    next_[prev] = nxt
+                else:
+                    self._head = nxt
+                prev_[nxt] = prev
+                prev_[slot] = self._tail
+                next_[slot] = NIL
+                next_[self._tail] = slot
+                self._tail = slot
+
+            if event_us > self._last_seen[slot]:
+                self._last_seen[slot] = event_us
+            if event_us > self._watermark:
+                self._watermark = event_us
+            return slot
+
+    # --- Velocity history --------------------------------------------------
+
+    def record_velocity(self, slot: int, event_us: int, window_us: int) -> int:
+        """
+        Drop timestamps at or before event_us - window_us, append event_us.
+        Returns the number of timestamps now in the window (including this one).
+        """
+        cutoff = event_us - window_us
+        capacity = self.HISTORY_CAPACITY
+        length = self._history_len[slot]
+        if length <= capacity:
+            # Inline buffer: compact survivors in place, no allocation
+            history = self._history
+            start = write = slot * capacity
+            for read in range(start, start + length):
+                ts = history[read]
+                if ts > cutoff:
+                    history[write] = ts
+                    write += 1
+            count = write - start + 1
+            if count <= capacity:
+                history[write] = event_us
+                self._history_len[slot] = count
+                return count
+
+        kept = [ts for ts in self.velocity_history(slot) if ts > cutoff]
+        kept.append(event_us)
+        self.set_velocity_history(slot, kept)
+        return len(kept)
+
+    def velocity_history(self, slot: int) -> List[int]:
+        """Velocity timestamps for a slot, oldest first."""
+        length = self._history_len[slot]
+        if length > self.HISTORY_CAPACITY:
+            return self._overflow[slot].timestamps.tolist()
+        start = slot * self.HISTORY_CAPACITY
+        return self._history[start:start + length].tolist()
+
+    def set_velocity_history(self, slot: int, timestamps: List[int]) -> None:
+        length = len(timestamps)
+        if length > self.HISTORY_CAPACITY:
+            self._overflow[slot] = OverflowHistory(timestamps)
+        else:
+            if self._history_len[slot] > self.HISTORY_CAPACITY:
+                del self._overflow[slot]
+            start = slot * self.HISTORY_CAPACITY
+            self._history[start:start + length] = array("q", timestamps)
+        self._history_len[slot] = length
+
+    def gather_velocity(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Velocity histories for many slots (NIL slots have none).
+
+        Returns:
+            (count per slot, all timestamps concatenated in slot order)
+        """
+        present = slots != NIL
+        counts = np.zeros(len(slots), dtype=np.int64)
+        # Views pin the column buffers; hold the lock so no concurrent slot allocation resizes them
+        with self._lock:
+            counts[present] = np.frombuffer(self._history_len, dtype=np.int32)[slots[present]]
+        offsets = np.cumsum(counts) - counts
+        values = np.empty(int(counts.sum()), dtype=np.int64)
+
+        inline = np.flatnonzero((counts > 0) & (counts <= self.HISTORY_CAPACITY))
+        columns = np.arange(self.HISTORY_CAPACITY)
+        filled = columns < counts[inline, None]
+        with self._lock:
+            history = np.frombuffer(self._history, dtype=np.int64).reshape(-1, self.HISTORY_CAPACITY)
+            values[(offsets[inline, None] + columns)[filled]] = history[slots[inline]][filled]
+            del history
+
+        for i in np.flatnonzero(counts > self.HISTORY_CAPACITY).tolist():
+            values[offsets[i]:offsets[i] + counts[i]] = self._overflow[int(slots[i])].timestamps
+        return counts, values
+
+    # --- Last transaction (impossible travel) ------------------------------
+
+    def last_transaction(self, slot: int) -> Optional[Tuple[str, int]]:
+        """(country, epoch microseconds) of the slot's last transaction, if any."""
+        code = self._last_country[slot]
+        if code == NO_COUNTRY:
+            return None
+        return self._countries[code], self._last_time[slot]
+
+    def last_position(self, slot: int) -> Optional[Tuple[float, float]]:
+        """(latitude, longitude) of the slot's last transaction, if it had coordinates."""
+        latitude = self._last_latitude[slot]
+        if math.isnan(latitude):
+            return None
+        return latitude, self._last_longitude[slot]
+
+    def set_last_transaction(
+        self, slot: int, country: str, event_us: int,
+        latitude: Optional[float] = None, longitude: Optional[float] = None
+    ) -> None:
+        self._last_country[slot] = self.country_code(country)
+        self._last_time[slot] = event_us
+        if latitude is None or longitude is None:
+            latitude = longitude = math.nan
+        self._last_latitude[slot] = latitude
+        self._last_longitude[slot] = longitude
+
+    def gather_last_transactions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Last transactions for many slots.
+
+        Returns:
+            (country code per slot - NO_COUNTRY if none, epoch microseconds per slot)
+        """
+        present = slots != NIL
+        codes = np.full(len(slots), NO_COUNTRY, dtype=np.int64)
+        times = np.zeros(len(slots), dtype=np.int64)
+        with self._lock:
+            codes[present] = np.frombuffer(self._last_country, dtype=np.int16)[slots[present]]
+            times[present] = np.frombuffer(self._last_time, dtype=np.int64)[slots[present]]
+        return codes, times
+
+    def gather_last_positions(self, slots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(latitudes, longitudes) of many slots' last transactions, NaN where unknown."""
+        present = slots != NIL
+        latitudes = np.full(len(slots), np.nan)
+        longitudes = np.full(len(slots), np.nan)
+        with self._lock:
+            latitudes[present] = np.frombuffer(self._last_latitude, dtype=np.float64)[slots[present]]
+            longitudes[present] = np.frombuffer(self._last_longitude, dtype=np.float64)[slots[present]]
+        return latitudes, longitudes
+
+    def country_code(self, country: str) -> int:
+        """Small integer code for a country (interned on first use)."""
+        code = self._country_codes.get(country)
+        if code is None:
+            with self._lock:
+                code = self._country_codes.setdefault(country, len(self._countries))
+                if code == len(self._countries):
+                    self._countries.append(country)
+        return code
+
+    def country_name(self, code: int) -> str:
+        return self._countries[code]
+
+    # --- Maintenance -------------------------------------------------------
+
+    def sweep(self) -> int:
+        """Drop users idle longer than the TTL. Returns the number evicted."""
+        if not len(self):
+            return 0
+        cutoff = self._watermark - self._ttl_us
+        evicted = 0
+        with self._lock:
+            slot = self._head
+            while slot != NIL and self._last_seen[slot] <= cutoff:
+                following = self._next[slot]
+                # A user being evaluated right now is not idle; the next sweep gets them
+                if self._try_free_slot(slot):
+                    evicted += 1
+                slot = following
+        self.evicted_idle += evicted
+        return evicted
+
+    def discard(self, user_ids: Iterable[str]) -> int:
+        """Drop the given users' state (e.g. handed off to another process). Returns the number dropped."""
+        user_ids = list(user_ids)
+        dropped = 0
+        with self.users_locked(user_ids), self._lock:
+            for user_id in user_ids:
+                slot = self.slot(user_id)
+                if slot != NIL:
+                    self._free_slot(slot)
+                    dropped += 1
+        return dropped
+
+    def clear(self) -> None:
+        with self._stripes_locked(range(self.LOCK_STRIPES)), self._lock:
+            self._allocate(min(len(self._prev), self.max_users))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": "memory",
+            "users": len(self),
+            "max_users": self.max_users,
+            "capacity": len(self._prev),
+            "column_bytes": self.column_bytes(),
+            "overflow_users": len(self._overflow),
+            "unindexed_users": len(self._pending[0]) if self._pending is not None else 0,
+            "ttl_seconds": self.ttl.total_seconds(),
+            "horizon_seconds": self.horizon.total_seconds(),
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+            "evicted_active": self.evicted_active,
+        }
+
+    def write_snapshot(self, path: str, position: Optional[Callable[[], int]] = None) -> int:
+        """
+        Snapshot layout: users ordered least recently seen first, one section per
+        column (last_seen, last_time, coordinates, inline history, history length,
+        country code), then overflow histories, user_ids, a crc32 -> row index of
+        the user_ids (sorted by hash) and the country table.
+        """
+        # Copy under every lock: a memcpy per column, so the pause is short even at millions of users
+        with self._stripes_locked(range(self.LOCK_STRIPES)), self._lock:
+            used = len(self._user_ids)
+            capacity = self.HISTORY_CAPACITY
+            columns = {
+                "last_seen": self._last_seen[:used],
+                "last_time": self._last_time[:used],
+                "last_latitude": self._last_latitude[:used],
+                "last_longitude": self._last_longitude[:used],
+                "history": self._history[:used * capacity],
+                "history_len": self._history_len[:used],
+                "last_country": self._last_country[:used],
+            }
+            user_ids = list(self._user_ids)
+            free = list(self._free)
+            overflow = dict(self._overflow)
+            countries = list(self._countries)
+            watermark = self._watermark
+            log_position = position() if position is not None else 0
+
+        live = np.ones(used, dtype=bool)
+        live[free] = False
+        slots = np.flatnonzero(live)
+        last_seen = np.frombuffer(columns["last_seen"], dtype=np.int64)
+        order = slots[np.argsort(last_seen[slots], kind="stable")]
+        sections = {name: np.frombuffer(column, dtype=column.typecode)[order]
+                    for name, column in columns.items() if name != "history"}
+        sections["history"] = np.frombuffer(columns["history"], dtype=np.int64).reshape(-1, capacity)[order]
+
+        ordered = order.tolist()
+        ids = [user_ids[slot] for slot in ordered]
+        # Newline-separated ids split in one call on load; lengths cover ids containing newlines
+        text = "\n".join(ids)
+        flags = SNAPSHOT_NEWLINE_IDS if text.count("\n") == max(len(ids) - 1, 0) else 0
+        sections["id_lengths"] = np.fromiter(map(len, ids), dtype=np.int32, count=len(ids))
+        sections["ids"] = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        hashes = np.fromiter((zlib.crc32(user_id.encode("utf-8")) for user_id in ids), dtype=np.uint32, count=len(ids))
+        by_hash = np.argsort(hashes, kind="stable")
+        sections["index_hashes"] = hashes[by_hash]
+        sections["index_rows"] = by_hash.astype(np.int32)
+        sections["countries"] = np.frombuffer(json.dumps(countries).encode("utf-8"), dtype=np.uint8)
+        overflowed = [overflow[slot].timestamps for slot in ordered if slot in overflow]
+        sections["overflow"] = np.concatenate(
+            [np.frombuffer(timestamps, dtype=np.int64) for timestamps in overflowed]
+        ) if overflowed else np.empty(0, dtype=np.int64)
+
+        layout, size = _snapshot_layout(len(ids), len(sections["overflow"]), len(sections["ids"]),
+                                        len(sections["countries"]), capacity)
+        with open(path, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, log_position, capacity, flags, len(ids), len(sections["overflow"]),
+                len(sections["ids"]), len(sections["countries"]), watermark,
+            ).ljust(SNAPSHOT_HEADER_BYTES, b"\0"))
+            for name, (offset, _, _) in layout.items():
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(sections[name].tobytes())
+            f.write(b"\0" * (size - f.tell()))
+        return len(ids)
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Columns are bulk copied out of the memory-mapped file. The user_id -> slot
+        dict is not built up front (about half a second per million users): the
+        snapshot's hash index answers lookups until a background thread has moved
+        every user into the dict. Users beyond max_users are dropped, least
+        recently seen first.
+        """
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, _, capacity, flags, users, overflow_count, id_bytes, country_bytes, watermark = \
+                _SNAPSHOT_HEADER.unpack_from(mapped)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a state snapshot")
+            if capacity != self.HISTORY_CAPACITY:
+                raise ValueError(f"{path} has history capacity {capacity}, expected {self.HISTORY_CAPACITY}")
+            layout, size = _snapshot_layout(users, overflow_count, id_bytes, country_bytes, capacity)
+            if len(mapped) != size:
+                raise ValueError(f"{path} is truncated or corrupt ({len(mapped)} bytes, expected {size})")
+
+            def section(name: str) -> np.ndarray:
+                offset, typecode, count = layout[name]
+                return np.frombuffer(mapped, dtype=typecode, count=count, offset=offset)
+
+            keep = min(users, self.max_users)
+            skip = users - keep
+            columns = {}
+            for name in ("last_seen", "last_time", "last_latitude", "last_longitude",
+                         "history_len", "last_country"):
+                view = section(name)
+                columns[name] = _array_from(layout[name][1], view[skip:])
+                del view
+            view = section("history")
+            columns["history"] = _array_from("q", view[skip * capacity:])
+            del view
+
+            view = section("ids")
+            text = view.tobytes().decode("utf-8")
+            del view
+            if flags & SNAPSHOT_NEWLINE_IDS:
+                user_ids = text.split("\n")[skip:] if users else []
+            else:
+                view = section("id_lengths")
+                ends = np.cumsum(view, dtype=np.int64).tolist()
+                del view
+                starts = [0] + ends[:-1]
+                user_ids = [text[start:end] for start, end in zip(starts[skip:], ends[skip:])]
+            del text
+
+            # Index rows shift with the dropped users (negative = dropped)
+            view = section("index_hashes")
+            index_hashes = view.copy()
+            del view
+            view = section("index_rows")
+            index_slots = view - np.int32(skip)
+            del view
+
+            view = section("countries")
+            countries = json.loads(view.tobytes())
+            del view
+
+            # Overflow histories are stored back to back, in user order
+            overflow: Dict[int, OverflowHistory] = {}
+            view = section("overflow")
+            lengths = section("history_len")
+            offset = 0
+            for row in np.flatnonzero(lengths > capacity).tolist():
+                length = int(lengths[row])
+                if row >= skip:
+                    overflow[row - skip] = OverflowHistory(view[offset:offset + length].tolist())
+                offset += length
+            del view, lengths
+
+        # LRU list in file order (least recently seen first)
+        links = np.arange(-1, keep + 1, dtype=np.int32)
+        links[-1] = NIL
+        prev, next_ = _array_from("i", links[:keep]), _array_from("i", links[2:])
+
+        with self._stripes_locked(range(self.LOCK_STRIPES)), self._lock:
+            self._allocate(0)
+            for name, column in columns.items():
+                setattr(self, "_" + name, column)
+            self._prev, self._next = prev, next_
+            self._user_ids = user_ids
+            self._overflow = overflow
+            self._countries = countries
+            self._country_codes = {country: code for code, country in enumerate(countries)}
+            self._head, self._tail = (0, keep - 1) if keep else (NIL, NIL)
+            self._watermark = watermark
+            if keep:
+                self._pending = (index_hashes, index_slots)
+                threading.Thread(target=self._build_index, args=(self._pending,),
+                                 name="state-index", daemon=True).start()
+        return keep
+
+    def column_bytes(self) -> int:
+        """Bytes held by the per-slot columns."""
+        return sum(len(column) * column.itemsize for column in self._columns())
+
+    # --- Internals ---------------------------------------------------------
+
+    def _columns(self) -> List[array]:
+        return [self._prev, self._next, self._last_seen, self._last_time,
+                self._last_country, self._last_latitude, self._last_longitude,
+                self._history, self._history_len]
+
+    def _allocate(self, capacity: int) -> None:
+        """Reset to an empty store with `capacity` preallocated slots."""
+        self._slots: Dict[str, int] = {}
+        # After a snapshot load: (crc32 of user_id, slot) sorted by hash, for users not yet in _slots
+        self._pending: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._user_ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._overflow: Dict[int, OverflowHistory] = {}
+        self._countries: List[str] = []
+        self._country_codes: Dict[str, int] = {}
+        self._head = self._tail = NIL
+        self._watermark = MIN_US
+
+        self._prev = array("i", [NIL]) * capacity
+        self._next = array("i", [NIL]) * capacity
+        self._last_seen = array("q", [0]) * capacity
+        self._last_time = array("q", [0]) * capacity
+        self._last_country = array("h", [NO_COUNTRY]) * capacity
+        self._last_latitude = array("d", [math.nan]) * capacity
+        self._last_longitude = array("d", [math.nan]) * capacity
+        self._history = array("q", [0]) * (capacity * self.HISTORY_CAPACITY)
+        self._history_len = array("i", [0]) * capacity
+
+    def _grow(self) -> None:
+        capacity = len(self._prev)
+        # At max_users only when every resident user was being evaluated (see class docstring)
+        extra = max(min(capacity * 2, self.max_users) - capacity, 1)
+        self._prev.extend(array("i", [NIL]) * extra)
+        self._next.extend(array("i", [NIL]) * extra)
+        self._last_seen.extend(array("q", [0]) * extra)
+        self._last_time.extend(array("q", [0]) * extra)
+        self._last_country.extend(array("h", [NO_COUNTRY]) * extra)
+        self._last_latitude.extend(array("d", [math.nan]) * extra)
+        self._last_longitude.extend(array("d", [math.nan]) * extra)
+        self._history.extend(array("q", [0]) * (extra * self.HISTORY_CAPACITY))
+        self._history_len.extend(array("i", [0]) * extra)
+
+    def _new_slot(self, user_id: str) -> int:
+        if len(self) >= self.max_users:
+            self._evict_lru()
+        if self._free:
+            slot = self._free.pop()
+            self._user_ids[slot] = user_id
+        else:
+            slot = len(self._user_ids)
+            if slot == len(self._prev):
+                self._grow()
+            self._user_ids.append(user_id)
+        self._slots[user_id] = slot
+        self._last_seen[slot] = MIN_US
+        self._link_tail(slot)
+        return slot
+
+    def _pending_slot(self, pending: Tuple[np.ndarray, np.ndarray], user_id: str) -> int:
+        """Slot of a user loaded from a snapshot and not yet in _slots (NIL if none)."""
+        hashes, slots = pending
+        key = zlib.crc32(user_id.encode("utf-8"))
+        position = int(np.searchsorted(hashes, key))
+        # Equal hashes are adjacent; the user_id check also rejects slots freed or reused since the load
+        while position < len(hashes) and hashes[position] == key:
+            slot = int(slots[position])
+            if slot >= 0 and self._user_ids[slot] == user_id:
+                return slot
+            position += 1
+        return NIL
+
+    def _build_index(self, pending: Tuple[np.ndarray, np.ndarray], chunk: int = 10_000) -> None:
+        """Move snapshot-loaded users into _slots, a chunk per lock hold, then drop the hash index."""
+        total = len(self._user_ids)
+        for start in range(0, total, chunk):
+            with self._lock:
+                if self._pending is not pending:
+                    return  # cleared or reloaded meanwhile
+                user_ids, slots = self._user_ids, self._slots
+                for slot in range(start, min(start + chunk, total)):
+                    user_id = user_ids[slot]
+                    if user_id is not None:
+                        slots.setdefault(user_id, slot)
+        with self._lock:
+            if self._pending is pending:
+                self._pending = None
+
+    def _free_slot(self, slot: int) -> None:
+        self._unlink(slot)
+        self._slots.pop(self._user_ids[slot], None)
+        self._user_ids[slot] = None
+        self._overflow.pop(slot, None)
+        self._history_len[slot] = 0
+        self._last_country[slot] = NO_COUNTRY
+        self._last_latitude[slot] = math.nan
+        self._free.append(slot)
+
+    def _evict_lru(self) -> None:
+        """Evict the least recently used user that is not being evaluated."""
+        slot = self._head
+        while slot != NIL:
+            active = self._watermark - self._last_seen[slot] < self._horizon_us
+            if self._try_free_slot(slot):
+                self.evicted_active += active
+                self.evicted_capacity += 1
+                return
+            slot = self._next[slot]
+
+    def _try_free_slot(self, slot: int) -> bool:
+        """Free a slot unless its user's lock is held by another thread (never blocks)."""
+        lock = self.user_lock(self._user_ids[slot])
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            self._free_slot(slot)
+        finally:
+            lock.release()
+        return True
+
+    def _link_tail(self, slot: int) -> None:
+        self._prev[slot] = self._tail
+        self._next[slot] = NIL
+        if self._tail != NIL:
+            self._next[self._tail] = slot
+        else:
+            self._head = slot
+        self._tail = slot
+
+    def _unlink(self, slot: int) -> None:
+        prev, nxt = self._prev[slot], self._next[slot]
+        if prev != NIL:
+            self._next[prev] = nxt
+        else:
+            self._head = nxt
+        if nxt != NIL:
+            self._prev[nxt] = prev
+        else:
+            self._tail = prev
+
+
+def _array_from(typecode: str, values: np.ndarray) -> array:
+    """array.array copy of a contiguous NumPy array (one memcpy)."""
+    column = array(typecode)
+    column.frombytes(memoryview(values).cast("B"))
+    return column
+
+
+def _snapshot_layout(
+    users: int, overflow: int, id_bytes: int, country_bytes: int, history_capacity: int
+) -> Tuple[Dict[str, Tuple[int, str, int]], int]:
+    """Snapshot sections {name: (byte offset, typecode, items)} and the total file size."""
+    sections = [
+        ("last_seen", "q", users),
+        ("last_time", "q", users),
+        ("last_latitude", "d", users),
+        ("last_longitude", "d", users),
+        ("history", "q", users * history_capacity),
+        ("history_len", "i", users),
+        ("last_country", "h", users),
+        ("id_lengths", "i", users),
+        ("index_hashes", "I", users),
+        ("index_rows", "i", users),
+        ("overflow", "q", overflow),
+        ("ids", "B", id_bytes),
+        ("countries", "B", country_bytes),
+    ]
+    layout = {}
+    offset = SNAPSHOT_HEADER_BYTES
+    for name, typecode, count in sections:
+        layout[name] = (offset, typecode, count)
+        offset += -(-count * np.dtype(typecode).itemsize // 8) * 8
+    return layout, offset
+
+
+def state_store_from_env() -> StateStore:
+    """
+    Store configured from CREDITGUARD_STATE_* environment variables.
+    CREDITGUARD_STATE_BACKEND selects "memory" (default) or "shared" (shared memory).
+    """
+    ttl = timedelta(hours=float(os.getenv("CREDITGUARD_STATE_TTL_HOURS", "24")))
+    max_users = int(os.getenv("CREDITGUARD_STATE_MAX_USERS", "1000000"))
+    sweep_interval_seconds = float(os.getenv("CREDITGUARD_STATE_SWEEP_SECONDS", "60"))
+
+    backend = os.getenv("CREDITGUARD_STATE_BACKEND", "memory")
+    if backend == "memory":
+        return UserStateStore(ttl=ttl, max_users=max_users, sweep_interval_seconds=sweep_interval_seconds)
+    if backend == "shared":
+        from app.services.shared_state_store import SharedMemoryStateStore
+        return SharedMemoryStateStore(
+            name=os.getenv("CREDITGUARD_STATE_SHM_NAME", "creditguard-state"),
+            ttl=ttl, max_users=max_users, sweep_interval_seconds=sweep_interval_seconds,
+        )
+    raise ValueError(f"Unknown CREDITGUARD_STATE_BACKEND {backend!r} (expected 'memory' or 'shared')")
+
+
+# Store used by stateful rules constructed without one (shared, like the old class-level dicts)
+default_store = UserStateStore()
@@ -0,0 +1,352 @@
+"""
+Binary batch formats (MessagePack, Arrow IPC) and response compression for /batch-evaluate.
+Trade-off: Optional dependencies and a columnar validator kept in line with
+Transaction's constraints vs JSON text for every large upload and download.
+
+MessagePack bodies decode to the same plain values as JSON and go through the
+same checks (app.utils.serialization). Arrow IPC bodies are validated column
+by column and handed to the engine as TransactionColumns, which the batch path
+reads without building an object per transaction.
+"""
+import gzip
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.schemas import FraudResult
+from app.services.batch import EPOCH, MICROSECOND, TransactionColumns
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack bodies are refused (415)
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # optional: Arrow bodies and responses are refused (415)
+    pa = pc = None
+
+try:
+    import zstandard
+except ImportError:  # optional: only gzip is offered
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+NDJSON = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class UnsupportedFormat(Exception):
+    """A format whose optional dependency is not installed."""
+
+
+class BodyFormatError(ValueError):
+    """
+    A body that cannot be decoded or violates Transaction's constraints.
+    `errors` are Pydantic-style error dicts, `loc` relative to the body.
+    """
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} validation errors")
+        self.errors = errors
+
+
+def media_type(header: Optional[str]) -> str:
+    """The bare, lower-case media type of a Content-Type header ("" if absent)."""
+    return (header or "").split(";", 1)[0].strip().lower()
+
+
+def _preferences(header: str) -> Dict[str, float]:
+    """{token: q} from an Accept or Accept-Encoding header."""
+    preferences = {}
+    for entry in header.split(","):
+        token, *params = entry.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        preferences[token] = q
+    return preferences
+
+
+def wants_arrow(accept: Optional[str]) -> bool:
+    """True if the Accept header prefers Arrow IPC (stream) over JSON and pyarrow is installed."""
+    if not accept or pa is None:
+        return False
+    preferences = _preferences(accept)
+    arrow = preferences.get(ARROW_STREAM, 0.0)
+    json_q = max(preferences.get(JSON, 0.0), preferences.get("application/*", 0.0), preferences.get("*/*", 0.0))
+    return arrow > 0 and arrow >= json_q
+
+
+# --- MessagePack --------------------------------------------------------------
+
+def unpack_msgpack(body: bytes) -> Any:
+    """Plain values of a MessagePack body (timestamps as UTC datetimes)."""
+    if msgpack is None:
+        raise UnsupportedFormat("MessagePack bodies need the msgpack package")
+    try:
+        return msgpack.unpackb(body, timestamp=3)
+    except (ValueError, TypeError) as e:
+        raise BodyFormatError([
+            {"type": "msgpack_invalid", "loc": (), "msg": "MessagePack decode error", "input": {}, "ctx": {"error": str(e)}}
+        ])
+
+
+# --- Arrow IPC ----------------------------------------------------------------
+
+def read_arrow(body: bytes, file_format: bool = False) -> TransactionColumns:
+    """
+    Transactions of an Arrow IPC stream (or file), one row each, as columns.
+
+    Columns: user_id, amount, currency, country, merchant (required, no nulls);
+    timestamp (Arrow timestamp, naive = UTC; absent = now), latitude, longitude
+    (optional, nullable), transaction_id (optional, nullable string). Extra columns are ignored. Raises BodyFormatError with
+    the same checks and messages as validating each row as a Transaction.
+    """
+    if pa is None:
+        raise UnsupportedFormat("Arrow bodies need the pyarrow package")
+    try:
+        reader = pa.ipc.open_file(body) if file_format else pa.ipc.open_stream(body)
+        table = reader.read_all().combine_chunks()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BodyFormatError([
+            {"type": "arrow_invalid", "loc": (), "msg": "Arrow IPC decode error", "input": {}, "ctx": {"error": str(e)}}
+        ])
+
+    errors: List[Tuple[int, int, Dict[str, Any]]] = []  # (row, field position, error) for sorting
+    columns = {}
+    for position, (field, kind) in enumerate(_ARROW_FIELDS):
+        if field not in table.column_names:
+            if field not in _ARROW_OPTIONAL:
+                errors.append((-1, position, {"type": "missing", "loc": (field,), "msg": "Field required", "input": None}))
+            continue
+        column = _single_array(table.column(field))
+        converted = _convert(column, kind)
+        if converted is None:
+            errors.append((-1, position, _TYPE_ERRORS[kind](field, column.type)))
+            continue
+        columns[field] = converted
+        errors.extend((row, position, error) for row, error in _check(field, converted))
+
+    if errors:
+        errors.sort(key=lambda entry: (entry[0], entry[1]))
+        raise BodyFormatError([error for _, _, error in errors])
+
+    rows = table.num_rows
+    countries, country_index = _country_codes(columns["country"])
+    timestamp = columns.get("timestamp")
+    if timestamp is None:
+        timestamps_us = np.full(rows, (datetime.now(timezone.utc) - EPOCH) // MICROSECOND, dtype=np.int64)
+    else:
+        timestamps_us = timestamp.cast(pa.int64()).to_numpy()
+    return TransactionColumns(
+        user_ids=_strings(columns["user_id"]),
+        amounts=columns["amount"].to_numpy(),
+        currencies=_strings(columns["currency"]),
+        countries=countries,
+        country_index=country_index,
+        merchants=_strings(columns["merchant"]),
+        timestamps_us=timestamps_us,
+        latitudes=_coordinates(columns.get("latitude"), rows),
+        longitudes=_coordinates(columns.get("longitude"), rows),
+        transaction_ids=_strings(columns["transaction_id"]) if "transaction_id" in columns else None,
+    )
+
+
+_ARROW_FIELDS = (
+    ("user_id", "string"), ("amount", "number"), ("currency", "string"), ("country", "string"),
+    ("merchant", "string"), ("timestamp", "timestamp"), ("latitude", "number"), ("longitude", "number"),
+    ("transaction_id", "string"),
+)
+_ARROW_OPTIONAL = {"timestamp", "latitude", "longitude", "transaction_id"}
+_NULLABLE = {"latitude", "longitude", "transaction_id"}
+
+_TYPE_ERRORS = {
+    "string": lambda field, arrow_type: {
+        "type": "string_type", "loc": (field,), "msg": "Input should be a valid string", "input": str(arrow_type)},
+    "number": lambda field, arrow_type: {
+        "type": "float_type", "loc": (field,), "msg": "Input should be a valid number", "input": str(arrow_type)},
+    "timestamp": lambda field, arrow_type: {
+        "type": "datetime_type", "loc": (field,), "msg": "Input should be a valid datetime", "input": str(arrow_type)},
+}
+_NULL_ERRORS = {
+    "user_id": "string", "currency": "string", "country": "string", "merchant": "string",
+    "amount": "number", "timestamp": "timestamp",
+}
+
+# Transaction's Field constraints: (field, bound kind, bound, error type, message), in
+# the order Pydantic checks them (le before ge); a value reports only its first failure
+_BOUNDS = (
+    ("amount", "gt", 0.0, "greater_than", "Input should be greater than 0"),
+    ("latitude", "le", 90.0, "less_than_equal", "Input should be less than or equal to 90"),
+    ("latitude", "ge", -90.0, "greater_than_equal", "Input should be greater than or equal to -90"),
+    ("longitude", "le", 180.0, "less_than_equal", "Input should be less than or equal to 180"),
+    ("longitude", "ge", -180.0, "greater_than_equal", "Input should be greater than or equal to -180"),
+)
+# (min, max) characters
+_LENGTHS = {"user_id": (0, 128), "currency": (3, 3), "country": (2, 2), "merchant": (0, 256), "transaction_id": (1, 128)}
+
+
+_CANONICAL = {"string": pa.string(), "number": pa.float64(), "timestamp": pa.timestamp("us", tz="UTC")} if pa else {}
+
+
+def _single_array(column) -> "pa.Array":
+    """One contiguous array for a table column (tables are combined first)."""
+    if column.num_chunks == 1:
+        return column.chunk(0)
+    return pa.concat_arrays(column.chunks) if column.num_chunks else pa.array([], column.type)
+
+
+def _convert(column: "pa.Array", kind: str) -> Optional["pa.Array"]:
+    """The column in its canonical Arrow type, or None if it has the wrong type."""
+    arrow_type = column.type
+    if pa.types.is_dictionary(arrow_type):
+        column = column.dictionary_decode()
+        arrow_type = column.type
+    if pa.types.is_null(arrow_type):  # all nulls: any type (nulls are checked by _check)
+        return column.cast(_CANONICAL[kind])
+    if kind == "string":
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return column.cast(_CANONICAL[kind])
+    elif kind == "number":
+        if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+            return column.cast(_CANONICAL[kind])
+    elif pa.types.is_timestamp(arrow_type):
+        # Stored values are UTC instants; naive timestamps are taken as UTC, like Transaction does
+        return column.cast(_CANONICAL[kind], safe=False)
+    return None
+
+
+def _check(field: str, column: "pa.Array"):
+    """(row, error) for each constraint violation in one converted column."""
+    if column.null_count and field not in _NULLABLE:
+        error = _TYPE_ERRORS[_NULL_ERRORS[field]](field, None)
+        for row in np.flatnonzero(column.is_null().to_numpy(zero_copy_only=False)).tolist():
+            yield row, {**error, "loc": (row, field), "input": None}
+
+    if field in _LENGTHS:
+        shortest, longest = _LENGTHS[field]
+        lengths = pc.utf8_length(column).to_numpy(zero_copy_only=False)  # nulls read as NaN (never fail)
+        for row in np.flatnonzero(lengths < shortest).tolist():
+            yield row, {
+                "type": "string_too_short", "loc": (row, field), "msg": f"String should have at least {shortest} character{'' if shortest == 1 else 's'}",
+                "input": column[row].as_py(), "ctx": {"min_length": shortest},
+            }
+        for row in np.flatnonzero(lengths > longest).tolist():
+            yield row, {
+                "type": "string_too_long", "loc": (row, field), "msg": f"String should have at most {longest} character{'' if longest == 1 else 's'}",
+                "input": column[row].as_py(), "ctx": {"max_length": longest},
+            }
+
+    unchecked = None  # rows not null and without an error yet
+    for bound_field, kind, bound, error_type, message in _BOUNDS:
+        if bound_field != field:
+            continue
+        values = column.to_numpy(zero_copy_only=False)  # nulls read as NaN
+        if unchecked is None:
+            unchecked = ~column.is_null().to_numpy(zero_copy_only=False)
+        with np.errstate(invalid="ignore"):
+            passed = values > bound if kind == "gt" else values >= bound if kind == "ge" else values <= bound
+        failed = unchecked & ~passed
+        unchecked &= passed
+        for row in np.flatnonzero(failed).tolist():
+            yield row, {
+                "type": error_type, "loc": (row, field), "msg": message, "input": _number(values[row]), "ctx": {kind: bound},
+            }
+
+
+def _number(value) -> Any:
+    """An offending value for an error body (JSON has no NaN or infinity)."""
+    value = float(value)
+    return value if math.isfinite(value) else str(value)
+
+
+def _strings(column: "pa.Array") -> List[str]:
+    # Through NumPy: an order of magnitude faster than Array.to_pylist()
+    return column.to_numpy(zero_copy_only=False).tolist()
+
+
+def _country_codes(column: "pa.Array") -> Tuple[List[str], np.ndarray]:
+    """Sorted distinct codes and each row's index into them (as np.unique gives)."""
+    encoded = column.dictionary_encode()
+    codes = encoded.dictionary.to_pylist()
+    order = sorted(range(len(codes)), key=codes.__getitem__)
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[order] = np.arange(len(codes))
+    indices = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    return [codes[i] for i in order], rank[indices] if len(codes) else indices
+
+
+def _coordinates(column: Optional["pa.Array"], rows: int) -> np.ndarray:
+    if column is None:
+        return np.full(rows, np.nan)
+    return column.fill_null(np.nan).to_numpy()
+
+
+def results_arrow(results: List[FraudResult], reasons: bool = True) -> bytes:
+    """
+    Results as an Arrow IPC stream, one row per result with FraudResult's
+    fields as columns; triggered_rules is a list<struct> column (reason left
+    out with reasons=False).
+    """
+    if pa is None:
+        raise UnsupportedFormat("Arrow responses need the pyarrow package")
+    offsets = np.zeros(len(results) + 1, dtype=np.int32)
+    np.cumsum([len(result.triggered_rules) for result in results], out=offsets[1:])
+    triggers = [trigger for result in results for trigger in result.triggered_rules]
+    trigger_fields = {"rule_name": pa.array([trigger.rule_name for trigger in triggers], pa.string())}
+    if reasons:
+        trigger_fields["reason"] = pa.array([trigger.reason for trigger in triggers], pa.string())
+    trigger_fields["score_contribution"] = pa.array([trigger.score_contribution for trigger in triggers], pa.int64())
+    triggered_rules = pa.ListArray.from_arrays(
+        pa.array(offsets), pa.StructArray.from_arrays(list(trigger_fields.values()), names=list(trigger_fields))
+    )
+    table = pa.table({
+        "user_id": pa.array([result.user_id for result in results], pa.string()),
+        "risk_level": pa.array([result.risk_level for result in results], pa.string()),
+        "total_score": pa.array([result.total_score for result in results], pa.int64()),
+        "triggered_rules": triggered_rules,
+        "timestamp": pa.array([result.timestamp for result in results], pa.timestamp("us", tz="UTC")),
+        "complete": pa.array([result.complete for result in results], pa.bool_()),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# --- Compression --------------------------------------------------------------
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """
+    (body, content coding): compressed with the client's preferred coding
+    among zstd (if installed) and gzip, or unchanged (None) if it accepts
+    neither or the body is small.
+    """
+    if not accept_encoding or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    preferences = _preferences(accept_encoding)
+    wildcard = preferences.get("*", 0.0)
+    zstd_q = preferences.get("zstd", wildcard) if zstandard is not None else 0.0
+    gzip_q = preferences.get("gzip", wildcard)
+    if zstd_q > 0 and zstd_q >= gzip_q:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    if gzip_q > 0:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+    return body, None
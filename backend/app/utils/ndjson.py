@@ -0,0 +1,131 @@
+"""
+Incremental newline-delimited JSON (NDJSON) helpers for streaming endpoints and batch jobs.
+Trade-off: Line-at-a-time parsing keeps memory bounded but cannot report
+errors before the response has started.
+"""
+import json
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterator, List, Tuple
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from app.schemas import Transaction
+from app.utils.serialization import parse_transaction, result_json
+
+# Longest single transaction line we accept; protects memory from a missing newline
+MAX_LINE_BYTES = 64 * 1024
+
+
+class LineTooLong(ValueError):
+    """Raised when an NDJSON line exceeds MAX_LINE_BYTES."""
+
+
+async def iter_lines(
+    chunks: AsyncIterable[bytes], max_line_bytes: int = MAX_LINE_BYTES
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Split a byte stream into NDJSON lines as it arrives.
+
+    Yields:
+        (line number starting at 1, line bytes) for every non-blank line.
+        Only the current partial line is buffered.
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if len(line) > max_line_bytes:
+                raise LineTooLong(f"Line {line_number} exceeds {max_line_bytes} bytes")
+            if line.strip():
+                yield line_number, line
+        if len(buffer) > max_line_bytes:
+            raise LineTooLong(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def read_lines(file: BinaryIO, max_line_bytes: int = MAX_LINE_BYTES, block_bytes: int = 1 << 20) -> Iterator[Tuple[int, bytes]]:
+    """iter_lines for a file: (line number, line bytes) for every non-blank line."""
+    buffer = b""
+    line_number = 0
+    while True:
+        block = file.read(block_bytes)
+        if not block:
+            break
+        buffer += block
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if len(line) > max_line_bytes:
+                raise LineTooLong(f"Line {line_number} exceeds {max_line_bytes} bytes")
+            if line.strip():
+                yield line_number, line
+        if len(buffer) > max_line_bytes:
+            raise LineTooLong(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+async def iter_chunks(
+    lines: AsyncIterable[Tuple[int, bytes]], chunk_size: int
+) -> AsyncIterator[List[Tuple[int, bytes]]]:
+    """Group numbered lines into lists of at most chunk_size."""
+    chunk: List[Tuple[int, bytes]] = []
+    async for item in lines:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def evaluate_chunk(engine, chunk: List[Tuple[int, bytes]], reasons: bool = True) -> bytes:
+    """
+    Validate and evaluate one chunk of (line number, line) pairs with
+    engine.evaluate_batch(); returns NDJSON output, one line per input line.
+    Invalid lines produce {"line": n, "detail": [...]} in place of a result.
+    """
+    transactions: List[Transaction] = []
+    output: List[bytes] = []
+    pending: List[int] = []  # output slots awaiting a result
+
+    for line_number, line in chunk:
+        try:
+            transaction = parse_transaction(line)
+            transactions.append(Transaction.model_validate_json(line) if transaction is None else transaction)
+            pending.append(len(output))
+            output.append(b"")
+        except ValidationError as e:
+            output.append(json.dumps({
+                "line": line_number,
+                "detail": e.errors(include_url=False, include_context=False, include_input=False)
+            }).encode())
+
+    for slot, result in zip(pending, engine.evaluate_batch(transactions)):
+        output[slot] = result_json(result, reasons)
+
+    return b"\n".join(output) + b"\n"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose generator may still be reading the request body.
+
+    Starlette's StreamingResponse listens for client disconnects by calling
+    receive(), which would swallow the request body messages we are reading
+    incrementally. Here only the body iterator talks to receive(); a client
+    disconnect surfaces as ClientDisconnect from request.stream() instead.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -2,6 +2,8 @@
 Simple scoring logic to map total fraud score to risk levels.
 Trade-off: Using fixed thresholds rather than ML-based probability.
 """
+from typing import List
+from app.schemas import FraudResult, TriggerRecord
 
 
 def calculate_risk_level(total_score: int) -> str:
@@ -24,3 +26,23 @@ def calculate_risk_level(total_score: int) -> str:
         return "MEDIUM"
     else:
         return "LOW"
+
+
+def build_result(user_id: str, triggered_rules: List[TriggerRecord], complete: bool = True) -> FraudResult:
+    """
+    Sum trigger scores and map the total to a risk level.
+    Built without validation: the triggers stay lazy TriggerRecords until serialized.
+    """
+    # Calculate total score
+    total_score = sum(trigger.score_contribution for trigger in triggered_rules)
+
+    # Determine risk level
+    risk_level = calculate_risk_level(total_score)
+
+    return FraudResult.model_construct(
+        user_id=user_id,
+        risk_level=risk_level,
+        total_score=total_score,
+        triggered_rules=triggered_rules,
+        complete=complete
+    )
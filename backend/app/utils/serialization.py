@@ -0,0 +1,166 @@
+"""
+JSON decoding of transactions and encoding of engine results for API responses.
+Trigger reason text is rendered here, at serialization time, or left out
+altogether when a request asks for reasons=false.
+
+Both directions bypass Pydantic when they can: requests are decoded with
+orjson (if installed) into TransactionRecords checked against Transaction's
+constraints by hand, and results are written straight to bytes without
+revalidation. Anything the fast checks do not accept is left to Pydantic, so
+results and validation errors are the same either way.
+"""
+import json
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from pydantic import TypeAdapter
+from app.schemas import FraudResult, TransactionRecord
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json and Pydantic's serializer are used instead
+    orjson = None
+
+_RESULT = TypeAdapter(FraudResult)
+_RESULTS = TypeAdapter(List[FraudResult])
+_NO_REASON_CONTEXT = {"reasons": False}
+
+# RFC 3339 timestamps datetime.fromisoformat reads exactly as Pydantic does;
+# other forms Pydantic accepts (unix times, dates, >6 fraction digits) take the slow path
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:\d{2})?", re.ASCII)
+_NUMBER = (int, float)  # exact types: bool is an int subclass, left to Pydantic
+
+
+def _loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+
+
+def parse_transaction(body: bytes) -> Optional[TransactionRecord]:
+    """
+    One transaction from a JSON object, or None if the fast checks cannot
+    accept it (invalid, or in a form only Pydantic handles): validate it as a
+    Transaction then, for the result or the error.
+    """
+    try:
+        return _transaction(_loads(body))
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_transactions(body: bytes) -> Optional[List[TransactionRecord]]:
+    """A JSON array of transactions, or None (see parse_transaction)."""
+    try:
+        return transaction_records(_loads(body))
+    except (ValueError, OverflowError):
+        return None
+
+
+def transaction_records(data: Any) -> Optional[List[TransactionRecord]]:
+    """
+    A decoded list of transaction objects (JSON, MessagePack) checked by the
+    fast path, or None if any item needs Pydantic validation.
+    """
+    if type(data) is not list:
+        return None
+    transactions = []
+    for item in data:
+        transaction = _transaction(item)
+        if transaction is None:
+            return None
+        transactions.append(transaction)
+    return transactions
+
+
+def _transaction(data: Any) -> Optional[TransactionRecord]:
+    """Transaction's field constraints and timezone normalization, for plain decoded values."""
+    if type(data) is not dict:
+        return None
+    user_id = data.get("user_id")
+    amount = data.get("amount")
+    currency = data.get("currency")
+    country = data.get("country")
+    merchant = data.get("merchant")
+    if (
+        type(user_id) is not str or len(user_id) > 128
+        or type(merchant) is not str or len(merchant) > 256
+        or type(currency) is not str or len(currency) != 3
+        or type(country) is not str or len(country) != 2
+        or type(amount) not in _NUMBER or not amount > 0
+    ):
+        return None
+
+    timestamp = data.get("timestamp")
+    if type(timestamp) is str:
+        if _TIMESTAMP.fullmatch(timestamp) is None:
+            return None
+        timestamp = datetime.fromisoformat(timestamp)
+    elif type(timestamp) is not datetime:  # MessagePack timestamps decode to datetime
+        if timestamp is not None or "timestamp" in data:
+            return None
+        timestamp = datetime.now(timezone.utc)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    elif timestamp.tzinfo is not timezone.utc:  # "Z" and "+00:00" already parse to it
+        timestamp = timestamp.astimezone(timezone.utc)
+
+    latitude = data.get("latitude")
+    longitude = data.get("longitude")
+    if latitude is not None:
+        if type(latitude) not in _NUMBER or not -90 <= latitude <= 90:
+            return None
+        latitude = float(latitude)
+    if longitude is not None:
+        if type(longitude) not in _NUMBER or not -180 <= longitude <= 180:
+            return None
+        longitude = float(longitude)
+
+    transaction_id = data.get("transaction_id")
+    if transaction_id is not None and (type(transaction_id) is not str or not 1 <= len(transaction_id) <= 128):
+        return None
+    return TransactionRecord(
+        user_id, float(amount), currency, country, merchant, timestamp, latitude, longitude, transaction_id
+    )
+
+
+def result_json(result: FraudResult, reasons: bool = True) -> bytes:
+    """One result as JSON; reasons=False drops every trigger's reason (never rendered)."""
+    if orjson is not None:
+        return _dumps(_result_dict(result, reasons))
+    if reasons:
+        return _RESULT.dump_json(result)
+    return _RESULT.dump_json(result, context=_NO_REASON_CONTEXT)
+
+
+def results_json(results: List[FraudResult], reasons: bool = True) -> bytes:
+    """A JSON array of results (see result_json)."""
+    if orjson is not None:
+        return _dumps([_result_dict(result, reasons) for result in results])
+    if reasons:
+        return _RESULTS.dump_json(results)
+    return _RESULTS.dump_json(results, context=_NO_REASON_CONTEXT)
+
+
+def _result_dict(result: FraudResult, reasons: bool) -> Dict[str, Any]:
+    """FraudResult's JSON fields, in order (what its serializer would produce)."""
+    if reasons:
+        triggers = [
+            {"rule_name": trigger.rule_name, "reason": trigger.reason, "score_contribution": trigger.score_contribution}
+            for trigger in result.triggered_rules
+        ]
+    else:
+        triggers = [
+            {"rule_name": trigger.rule_name, "score_contribution": trigger.score_contribution}
+            for trigger in result.triggered_rules
+        ]
+    return {
+        "user_id": result.user_id,
+        "risk_level": result.risk_level,
+        "total_score": result.total_score,
+        "triggered_rules": triggers,
+        "timestamp": result.timestamp,
+        "complete": result.complete,
+    }
@@ -0,0 +1,86 @@
+"""
+Backtest sweep cost: the same stream scored under 1 configuration and under
+a grid of --configs configurations with Backtest, against one
+FraudEngine.evaluate_batch() run per configuration would cost.
+
+Usage (from backend/):
+    python -m benchmarks.backtest_sweep --transactions 1000000 --configs 1 10 100
+
+The grid varies the high amount threshold, velocity max_transactions and
+window (two windows), a weight and the MEDIUM band. Reports seconds per run,
+transactions x configurations per second, the cost relative to the
+one-configuration backtest, and the default configuration's agreement with
+the engine's scores.
+"""
+import argparse
+import time
+from itertools import islice
+from typing import List
+
+import numpy as np
+
+from app.services.backtest import Backtest, BacktestConfig, config_grid
+from app.services.fraud_engine import FraudEngine
+from benchmarks.generator import generate
+
+GRID = {
+    "high_amount_threshold": [250, 500, 1000, 2000, 5000],
+    "velocity_max_transactions": [2, 3, 4, 5, 6],
+    "velocity_window_minutes": [10, 5],
+    "weights": {"velocity": [50, 60]},
+    "medium_score": [50, 40],
+}
+
+
+def chunks(args) -> List[List]:
+    transactions = (transaction for transaction, _ in generate(
+        args.transactions, users=args.users, rate_per_hour=args.rate_per_hour, fraud_share=args.fraud_share, seed=args.seed,
+    ))
+    result = []
+    while True:
+        chunk = list(islice(transactions, args.chunk_size))
+        if not chunk:
+            return result
+        result.append(chunk)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backtest sweep benchmark")
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--configs", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--rate-per-hour", type=float, default=1.0)
+    parser.add_argument("--fraud-share", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stream = chunks(args)
+    engine = FraudEngine()
+    engine.wait_ready()
+    engine.state_store.clear()
+    start = time.perf_counter()
+    expected = np.concatenate([
+        np.fromiter((result.total_score for result in engine.evaluate_batch(chunk)), dtype=np.int64) for chunk in stream
+    ])
+    engine_seconds = time.perf_counter() - start
+    print(f"{args.transactions:,} transactions; engine evaluate_batch(): {engine_seconds:.2f}s per configuration")
+
+    grid = config_grid(GRID)
+    print(f"{'configs':>7} | {'seconds':>8} | {'x single':>8} | {'engine runs s':>13} | {'txn x cfg/s':>12}")
+    single = None
+    for count in args.configs:
+        configs = grid[:count] if count > 1 else [BacktestConfig()]
+        backtest = Backtest(configs)
+        scores = [backtest.add(chunk) for chunk in stream]
+        seconds = backtest.seconds
+        if count == 1:
+            agrees = np.array_equal(np.concatenate(scores, axis=1)[0], expected)
+            print(f"default configuration matches the engine: {agrees}")
+        single = single or seconds
+        print(f"{len(configs):>7} | {seconds:8.2f} | {seconds / single:8.2f} | {engine_seconds * len(configs):13.1f} | "
+              f"{args.transactions * len(configs) / seconds:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+/batch-evaluate body formats: decode + evaluate cost per input format, and
+size/encode cost per response format.
+
+Usage (from backend/):
+    python -m benchmarks.batch_formats --transactions 100000
+
+Input: the same transactions as JSON (fast path), MessagePack and Arrow IPC,
+decoded the way the endpoint does and evaluated with FraudEngine.evaluate_batch()
+(Arrow feeds TransactionColumns straight into the columnar path). Output: the
+results as JSON, JSON + gzip, JSON + zstd and Arrow IPC. Reports best-of
+--repeat milliseconds and sizes, and checks that every input format gives the
+same results.
+"""
+import argparse
+import json
+import time
+from typing import Callable, Tuple
+
+import msgpack
+import pyarrow as pa
+
+from app.services.fraud_engine import FraudEngine
+from app.utils import formats
+from app.utils.formats import read_arrow, results_arrow, unpack_msgpack
+from app.utils.serialization import parse_transactions, results_json, transaction_records
+from benchmarks.decision_only import build_traffic
+
+
+def best(function: Callable, repeat: int) -> Tuple[float, object]:
+    """Best wall time (ms) of `repeat` calls, and the last call's value."""
+    fastest = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest * 1000, value
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch body formats benchmark")
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    transactions = build_traffic(args.transactions, fraud_share=0.3)
+    for row, transaction in enumerate(transactions[::5]):
+        transaction.latitude, transaction.longitude = 40.0 + row % 10 * 0.5, -74.25
+    rows = [transaction.model_dump() for transaction in transactions]
+
+    table = pa.Table.from_pylist(rows)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    bodies = {
+        "json": json.dumps([transaction.model_dump(mode="json") for transaction in transactions]).encode(),
+        "msgpack": msgpack.packb(rows, datetime=True),
+        "arrow": sink.getvalue().to_pybytes(),
+    }
+    decoders = {
+        "json": lambda body: parse_transactions(body),
+        "msgpack": lambda body: transaction_records(unpack_msgpack(body)),
+        "arrow": lambda body: read_arrow(body),
+    }
+
+    engine = FraudEngine()
+    engine.wait_ready()
+    expected = None
+    print(f"{args.transactions:,} transactions")
+    print(f"{'input':>8} | {'body MB':>8} | {'decode ms':>9} | {'evaluate ms':>11} | {'total ms':>8}")
+    for name, body in bodies.items():
+        decode_ms, decoded = best(lambda: decoders[name](body), args.repeat)
+
+        def evaluate():
+            engine.state_store.clear()
+            return engine.evaluate_batch(decoded)
+
+        evaluate_ms, results = best(evaluate, args.repeat)
+        comparable = [result.model_dump(exclude={"timestamp"}) for result in results]
+        if expected is None:
+            expected = comparable
+        assert comparable == expected, f"{name} results differ"
+        print(f"{name:>8} | {len(body) / 1e6:8.2f} | {decode_ms:9.1f} | {evaluate_ms:11.1f} | {decode_ms + evaluate_ms:8.1f}")
+
+    print(f"{'output':>10} | {'body MB':>8} | {'encode ms':>9}")
+    encoders = {
+        "json": lambda: results_json(results),
+        "json+gzip": lambda: formats.compress(results_json(results), "gzip")[0],
+        "json+zstd": lambda: formats.compress(results_json(results), "zstd")[0],
+        "arrow": lambda: results_arrow(results),
+    }
+    for name, encode in encoders.items():
+        if name == "json+zstd" and formats.zstandard is None:
+            continue
+        encode_ms, body = best(encode, args.repeat)
+        print(f"{name:>10} | {len(body) / 1e6:8.2f} | {encode_ms:9.1f}")
+    print("results match across input formats")
+
+
+if __name__ == "__main__":
+    main()
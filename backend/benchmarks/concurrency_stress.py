@@ -0,0 +1,108 @@
+"""
+Concurrency stress test for the stateful rules.
+
+Usage (from backend/):
+    python -m benchmarks.concurrency_stress --users 20 --per-user 2000 --threads 32
+
+Fires every user's transactions from many threads at once, the way FastAPI's
+threadpool runs concurrent /evaluate requests, with /batch-evaluate calls
+mixed in. All of a user's transactions share one timestamp, so whatever the
+interleaving, the n-th transaction to be recorded sees n in the velocity
+window: each user must get exactly per_user - max_transactions velocity
+triggers and end with per_user timestamps in the store (or the store's
+history_capacity, for the shared-memory backend). Impossible travel
+alternates between two countries at that instant; its trigger count depends
+on the interleaving, so only the stored last transaction is checked.
+Exits non-zero on any mismatch.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from app.schemas import Transaction
+from app.services.batch import to_epoch_us
+from app.services.fraud_engine import FraudEngine
+
+TIMESTAMP = datetime(2024, 1, 15, 12, 0, tzinfo=timezone.utc)
+COUNTRIES = ("US", "GB")
+
+
+def build_transactions(users: int, per_user: int):
+    """Users' transactions interleaved round-robin; all at one instant."""
+    return [
+        Transaction(
+            user_id=f"stress_{user}", amount=10.0 + k % 7, currency="USD",
+            country=COUNTRIES[k % 2], merchant="Stress Store", timestamp=TIMESTAMP,
+        )
+        for k in range(per_user)
+        for user in range(users)
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Concurrent evaluation stress test")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--per-user", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=50,
+                        help="every batch-size'th request is a /batch-evaluate of this many (0 = singles only)")
+    args = parser.parse_args()
+
+    # Switch threads as often as possible to surface races
+    sys.setswitchinterval(1e-6)
+
+    engine = FraudEngine()
+    engine.state_store.clear()
+    velocity_rule = next(rule for rule in engine.rules if rule.name == "Velocity Rule")
+
+    transactions = build_transactions(args.users, args.per_user)
+    requests = []
+    position = 0
+    while position < len(transactions):
+        size = args.batch_size if args.batch_size and len(requests) % args.batch_size == 0 else 1
+        requests.append(transactions[position:position + size])
+        position += size
+
+    def send(request):
+        if len(request) == 1:
+            return [engine.evaluate(request[0])]
+        return engine.evaluate_batch(request)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = [result for response in pool.map(send, requests) for result in response]
+    elapsed = time.perf_counter() - start
+
+    velocity_hits = {}
+    for result in results:
+        fired = any(trigger.rule_name == "Velocity Rule" for trigger in result.triggered_rules)
+        velocity_hits[result.user_id] = velocity_hits.get(result.user_id, 0) + fired
+
+    store = engine.state_store
+    expected_velocity = max(args.per_user - velocity_rule.max_transactions, 0)
+    expected_history = min(args.per_user, getattr(store, "history_capacity", args.per_user))
+    failures = []
+    for user in range(args.users):
+        user_id = f"stress_{user}"
+        slot = store.slot(user_id)
+        history = len(store.velocity_history(slot)) if slot >= 0 else 0
+        last = store.last_transaction(slot) if slot >= 0 else None
+        if velocity_hits.get(user_id) != expected_velocity:
+            failures.append(f"{user_id}: {velocity_hits.get(user_id)} velocity triggers, expected {expected_velocity}")
+        if history != expected_history:
+            failures.append(f"{user_id}: {history} stored timestamps, expected {expected_history}")
+        if last is None or last[0] not in COUNTRIES or last[1] != to_epoch_us(TIMESTAMP):
+            failures.append(f"{user_id}: stored last transaction {last}")
+
+    print(f"{len(transactions):,} transactions, {len(requests):,} requests, {args.threads} threads: "
+          f"{elapsed:.2f}s ({len(transactions) / elapsed:,.0f} txn/s)")
+    for failure in failures[:20]:
+        print("FAIL", failure)
+    print("FAILED" if failures else "OK")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
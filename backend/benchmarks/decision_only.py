@@ -0,0 +1,95 @@
+"""
+Latency of full vs decision-only evaluation on normal and high-fraud traffic.
+
+Usage (from backend/):
+    python -m benchmarks.decision_only --transactions 50000 --fraud-share 0.8
+
+Fraudulent transactions come from users hopping between distant countries
+every few seconds (impossible travel + velocity), often with round amounts at
+night; the rest are ordinary purchases. Each mix runs through
+FraudEngine.evaluate() in full and in decision-only mode from a fresh state
+store (alternating, best of --repeat runs each), reporting mean/p50/p99
+latency per call, and checks that every risk level matches.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from app.schemas import FraudResult, Transaction
+from app.services.fraud_engine import FraudEngine
+
+START = datetime(2024, 1, 15, tzinfo=timezone.utc)
+HOME_COUNTRIES = ["US", "CA", "GB", "FR", "DE"]
+HOP_COUNTRIES = ["US", "GB", "CN", "JP", "IR", "BR"]
+
+
+def build_traffic(count: int, fraud_share: float, users: int = 5_000, seed: int = 0) -> List[Transaction]:
+    rng = random.Random(seed)
+    transactions = []
+    for i in range(count):
+        timestamp = START + timedelta(seconds=i * 2)
+        if rng.random() < fraud_share:
+            # Few compromised cards, used in quick succession across the globe
+            transactions.append(Transaction(
+                user_id=f"fraud_{rng.randrange(50)}", amount=rng.choice([1.0, 5.0, 100.0, 2500.0]),
+                currency="USD", country=rng.choice(HOP_COUNTRIES), merchant="Benchmark Store",
+                timestamp=timestamp.replace(hour=rng.choice([2, 3, 14])),
+            ))
+        else:
+            transactions.append(Transaction(
+                user_id=f"user_{rng.randrange(users)}", amount=round(rng.uniform(5, 300), 2), currency="USD",
+                country=rng.choice(HOME_COUNTRIES), merchant="Benchmark Store", timestamp=timestamp,
+            ))
+    return transactions
+
+
+def run(engine: FraudEngine, transactions: List[Transaction], decision_only: bool) -> Tuple[List[float], List[FraudResult]]:
+    """Per-call latencies and results, from an empty state store."""
+    engine.state_store.clear()
+    latencies, results = [], []
+    for transaction in transactions:
+        start = time.perf_counter()
+        results.append(engine.evaluate(transaction, decision_only))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def describe(latencies: List[float]) -> str:
+    percentiles = statistics.quantiles(latencies, n=100)
+    return (f"mean {statistics.fmean(latencies) * 1e6:6.1f} us | p50 {percentiles[49] * 1e6:6.1f} us "
+            f"| p99 {percentiles[98] * 1e6:6.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Decision-only evaluation benchmark")
+    parser.add_argument("--transactions", type=int, default=50_000)
+    parser.add_argument("--fraud-share", type=float, default=0.8, help="share of fraudulent traffic in the high-fraud mix")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = FraudEngine()
+    engine.wait_ready()
+    for label, fraud_share in (("normal", 0.02), ("high-fraud", args.fraud_share)):
+        transactions = build_traffic(args.transactions, fraud_share)
+        best = {}
+        for _ in range(args.repeat):
+            for decision_only in (False, True):
+                latencies, results = run(engine, transactions, decision_only)
+                if decision_only not in best or statistics.fmean(latencies) < statistics.fmean(best[decision_only][0]):
+                    best[decision_only] = (latencies, results)
+        (full_latencies, full), (decision_latencies, decided) = best[False], best[True]
+        assert [r.risk_level for r in full] == [r.risk_level for r in decided], "risk levels differ"
+        skipped = sum(not result.complete for result in decided) / len(decided)
+        high = sum(result.risk_level == "HIGH" for result in full) / len(full)
+        saved = 1 - statistics.fmean(decision_latencies) / statistics.fmean(full_latencies)
+        print(f"{label} ({high:.0%} HIGH)")
+        print(f"  full:          {describe(full_latencies)}")
+        print(f"  decision-only: {describe(decision_latencies)} | {skipped:.0%} exited early, {saved:+.1%} mean saved")
+    print(f"risk levels match; rule order: {engine.scheduler.stats()['order']}")
+
+
+if __name__ == "__main__":
+    main()
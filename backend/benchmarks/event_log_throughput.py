@@ -0,0 +1,84 @@
+"""
+Evaluate throughput with the write-ahead event log on and off.
+
+Usage (from backend/):
+    python -m benchmarks.event_log_throughput --transactions 50000 --threads 8
+
+Runs the same synthetic transactions through FraudEngine.evaluate() (from a
+thread pool, like FastAPI's) and evaluate_batch(), without a log and with a
+group-commit EventLog in a temporary directory. Also reports commits (fsyncs)
+and bytes per logged event.
+"""
+import argparse
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from app.schemas import Transaction
+from app.services.event_log import EventLog
+from app.services.fraud_engine import FraudEngine
+
+START = datetime(2024, 1, 15, tzinfo=timezone.utc)
+COUNTRIES = ["US", "CA", "GB", "FR", "DE", "JP", "AU", "BR", "IN", "CN"]
+
+
+def build_transactions(count: int, users: int, seed: int = 0) -> List[Transaction]:
+    rng = random.Random(seed)
+    return [
+        Transaction(
+            user_id=f"user_{rng.randrange(users)}", amount=round(rng.uniform(1, 2000), 2), currency="USD",
+            country=rng.choice(COUNTRIES), merchant="Benchmark Store", timestamp=START + timedelta(seconds=i),
+        )
+        for i in range(count)
+    ]
+
+
+def run(engine: FraudEngine, transactions: List[Transaction], threads: int, batch_size: int) -> float:
+    """Transactions per second, single calls from `threads` threads or batches of `batch_size`."""
+    engine.state_store.clear()
+    start = time.perf_counter()
+    if batch_size:
+        for i in range(0, len(transactions), batch_size):
+            engine.evaluate_batch(transactions[i:i + batch_size])
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for _ in pool.map(engine.evaluate, transactions, chunksize=64):
+                pass
+    return len(transactions) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event log throughput benchmark")
+    parser.add_argument("--transactions", type=int, default=50_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    parser.add_argument("--commit-ms", type=float, default=10, help="group commit interval")
+    args = parser.parse_args()
+
+    transactions = build_transactions(args.transactions, args.users)
+    engine = FraudEngine()
+    engine.wait_ready()
+    assert engine.event_log is None, "unset CREDITGUARD_EVENT_LOG_DIR for this benchmark"
+
+    for label, batch_size in (("evaluate", 0), (f"evaluate_batch({args.batch_size})", args.batch_size)):
+        off = run(engine, transactions, args.threads, batch_size)
+        with tempfile.TemporaryDirectory() as directory:
+            engine.event_log = EventLog(directory, commit_interval_seconds=args.commit_ms / 1000)
+            try:
+                on = run(engine, transactions, args.threads, batch_size)
+                engine.event_log.flush()
+                stats = engine.event_log.stats()
+            finally:
+                engine.event_log.close()
+                engine.event_log = None
+        print(f"{label:>24}: log off {off:>10,.0f} txn/s | log on {on:>10,.0f} txn/s "
+              f"({on / off - 1:+.1%}) | {stats['commits']:,} fsyncs, "
+              f"{stats['bytes_written'] / len(transactions):.0f} bytes/event")
+
+
+if __name__ == "__main__":
+    main()
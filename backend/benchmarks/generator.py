@@ -0,0 +1,181 @@
+"""
+Seeded synthetic transaction stream for benchmarks.
+
+Usage (from backend/):
+    python -m benchmarks.generator --transactions 1000000 --output transactions.ndjson
+
+Ordinary traffic: `users` cardholders, each transacting `rate_per_hour` times
+an hour on average (Poisson arrivals, so the stream is in timestamp order),
+mostly in a home country drawn from `country_mix`, with log-normal amounts;
+`coordinates_share` of transactions carry latitude/longitude near the country
+centroid. About `fraud_share` of all transactions belong to injected fraud
+episodes, each on one cardholder:
+
+- card_testing: 4-10 small round amounts ($1, $5, $10...) within minutes
+- impossible_travel: a purchase at home, then one in a distant country minutes later
+- burst: 6-12 ordinary-looking purchases within a few minutes (velocity)
+
+The same arguments and seed always give the same stream.
+"""
+import argparse
+import heapq
+import math
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.schemas import TransactionRecord
+from app.utils.geo import COUNTRY_CENTROIDS
+
+START = datetime(2024, 1, 15, tzinfo=timezone.utc)
+
+# Home countries of cardholders (weights), including a few the country risk rule flags
+COUNTRY_MIX: Dict[str, float] = {
+    "US": 0.40, "GB": 0.12, "DE": 0.10, "FR": 0.08, "CA": 0.08, "JP": 0.06,
+    "BR": 0.05, "IN": 0.05, "AU": 0.04, "NG": 0.015, "IR": 0.005,
+}
+# Where stolen cards turn up in impossible travel episodes
+FAR_COUNTRIES = ("CN", "RU", "BR", "AU", "ZA", "IR", "KP", "AR", "SG")
+MERCHANTS = ("Grocery Store", "Coffee Shop", "Gas Station", "Online Retail", "Restaurant", "Electronics Store", "Pharmacy")
+TEST_AMOUNTS = (1.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+PATTERNS = ("card_testing", "impossible_travel", "burst")
+# Mean transactions per episode (to turn fraud_share into an episode rate)
+_EPISODE_SIZE = {"card_testing": 7.0, "impossible_travel": 2.0, "burst": 9.0}
+
+# (transaction, pattern): pattern is "" for ordinary traffic
+Labelled = Tuple[TransactionRecord, str]
+
+
+def generate(
+    count: int,
+    users: int = 100_000,
+    rate_per_hour: float = 1.0,
+    country_mix: Mapping[str, float] = COUNTRY_MIX,
+    fraud_share: float = 0.02,
+    patterns: Sequence[str] = PATTERNS,
+    coordinates_share: float = 0.2,
+    seed: int = 0,
+    start: datetime = START,
+) -> Iterator[Labelled]:
+    """`count` labelled transactions in timestamp order, generated lazily (constant memory per user)."""
+    rng = random.Random(seed)
+    countries = list(country_mix)
+    weights = np.array([country_mix[country] for country in countries], dtype=np.float64)
+    homes = np.random.default_rng(seed).choice(len(countries), size=users, p=weights / weights.sum()).astype(np.int16)
+    patterns = [pattern for pattern in patterns if pattern in _EPISODE_SIZE]
+    mean_episode = sum(_EPISODE_SIZE[pattern] for pattern in patterns) / len(patterns) if patterns else 1.0
+    # Share of arrivals that start an episode, so that episodes make up ~fraud_share of transactions
+    episode_share = fraud_share / (mean_episode * (1 - fraud_share) + fraud_share) if patterns else 0.0
+    mean_gap = 3600.0 / (users * rate_per_hour)
+
+    clock = 0.0  # seconds after start
+    pending: List[Tuple[float, int, TransactionRecord, str]] = []  # episode transactions not yet due
+    sequence = 0
+    emitted = 0
+    while emitted < count:
+        clock += rng.expovariate(1.0 / mean_gap)
+        while pending and pending[0][0] <= clock and emitted < count:
+            _, _, transaction, pattern = heapq.heappop(pending)
+            yield transaction, pattern
+            emitted += 1
+        if emitted >= count:
+            return
+
+        user = rng.randrange(users)
+        home = countries[homes[user]]
+        if rng.random() < episode_share:
+            pattern = rng.choice(patterns)
+            for offset, transaction in _episode(rng, pattern, f"user_{user}", home, start, clock):
+                heapq.heappush(pending, (clock + offset, sequence, transaction, pattern))
+                sequence += 1
+            continue
+
+        country = home if rng.random() < 0.99 else rng.choice(countries)
+        amount = round(min(math.exp(rng.gauss(3.6, 1.0)), 20_000.0), 2)
+        yield _transaction(rng, f"user_{user}", amount, country, rng.choice(MERCHANTS), start, clock, coordinates_share), ""
+        emitted += 1
+
+
+def transactions(count: int, **options) -> List[TransactionRecord]:
+    """generate() without labels, as a list."""
+    return [transaction for transaction, _ in generate(count, **options)]
+
+
+def _episode(rng: random.Random, pattern: str, user_id: str, home: str, start: datetime, clock: float) -> Iterator[Tuple[float, TransactionRecord]]:
+    """(seconds after the episode starts, transaction) for one fraud episode."""
+    if pattern == "card_testing":
+        offset = 0.0
+        for _ in range(rng.randint(4, 10)):
+            yield offset, _transaction(rng, user_id, rng.choice(TEST_AMOUNTS), home, "Online Retail", start, clock + offset, 0.0)
+            offset += rng.uniform(5, 90)
+    elif pattern == "impossible_travel":
+        far = rng.choice([country for country in FAR_COUNTRIES if country != home])
+        yield 0.0, _transaction(rng, user_id, round(rng.uniform(20, 200), 2), home, rng.choice(MERCHANTS), start, clock, 1.0)
+        later = rng.uniform(60, 1800)
+        yield later, _transaction(rng, user_id, round(rng.uniform(300, 3000), 2), far, "Electronics Store", start, clock + later, 1.0)
+    else:  # burst
+        offset = 0.0
+        for _ in range(rng.randint(6, 12)):
+            amount = round(rng.uniform(30, 600), 2)
+            yield offset, _transaction(rng, user_id, amount, home, rng.choice(MERCHANTS), start, clock + offset, 0.0)
+            offset += rng.uniform(2, 40)
+
+
+def _transaction(
+    rng: random.Random, user_id: str, amount: float, country: str, merchant: str,
+    start: datetime, clock: float, coordinates_share: float,
+) -> TransactionRecord:
+    latitude = longitude = None
+    if coordinates_share and rng.random() < coordinates_share:
+        centroid_latitude, centroid_longitude = COUNTRY_CENTROIDS[country]
+        latitude = max(-90.0, min(90.0, round(centroid_latitude + rng.uniform(-2, 2), 4)))
+        longitude = max(-180.0, min(180.0, round(centroid_longitude + rng.uniform(-2, 2), 4)))
+    timestamp = start + timedelta(microseconds=round(clock * 1e6))
+    return TransactionRecord(user_id, amount, "USD", country, merchant, timestamp, latitude, longitude)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic transaction stream as NDJSON")
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--rate-per-hour", type=float, default=1.0, help="mean transactions per user per hour")
+    parser.add_argument("--fraud-share", type=float, default=0.02)
+    parser.add_argument("--patterns", nargs="+", choices=PATTERNS, default=list(PATTERNS))
+    parser.add_argument("--coordinates-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--labels", action="store_true", help="add the injected pattern as \"pattern\" (non-schema field)")
+    parser.add_argument("--output", help="NDJSON file (default: stdout)")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for transaction, pattern in generate(
+            args.transactions, users=args.users, rate_per_hour=args.rate_per_hour, fraud_share=args.fraud_share,
+            patterns=args.patterns, coordinates_share=args.coordinates_share, seed=args.seed,
+        ):
+            output.write(to_json(transaction, pattern if args.labels else None) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def to_json(transaction: TransactionRecord, pattern: Optional[str] = None) -> str:
+    """The transaction as a JSON object (the API's request schema), plus "pattern" if given."""
+    fields = [
+        f'"user_id":"{transaction.user_id}"', f'"amount":{transaction.amount!r}', f'"currency":"{transaction.currency}"',
+        f'"country":"{transaction.country}"', f'"merchant":"{transaction.merchant}"',
+        f'"timestamp":"{transaction.timestamp.isoformat().replace("+00:00", "Z")}"',
+    ]
+    if transaction.latitude is not None:
+        fields.append(f'"latitude":{transaction.latitude!r},"longitude":{transaction.longitude!r}')
+    if pattern is not None:
+        fields.append(f'"pattern":"{pattern}"')
+    return "{" + ",".join(fields) + "}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Request decoding and response encoding: fast path vs the default FastAPI/Pydantic path.
+
+Usage (from backend/):
+    python -m benchmarks.json_fast_path --sizes 1 1000 100000
+
+For each batch size, the same transactions are sent as JSON bodies of that
+many transactions (size 1 = one /evaluate object, otherwise a /batch-evaluate
+array) and their results encoded back, both ways:
+
+- pydantic: json.loads + full Transaction validation, then response_model
+  revalidation of every result and the default JSON encoder (what the
+  endpoints did before the fast path)
+- fast: parse_transaction(s) and result(s)_json from app.utils.serialization
+
+Reports microseconds per transaction to decode and to encode (best of --repeat),
+and checks that both paths decode the same transactions and produce the same JSON.
+The engine itself is not timed (it is the same on both paths).
+"""
+import argparse
+import json
+import time
+from typing import Callable, List, Tuple
+
+from pydantic import TypeAdapter
+
+from app.schemas import FraudResult, Transaction
+from app.services.fraud_engine import FraudEngine
+from app.utils import serialization
+from app.utils.serialization import parse_transaction, parse_transactions, result_json, results_json
+from benchmarks.decision_only import build_traffic
+
+TRANSACTION = TypeAdapter(Transaction)
+TRANSACTIONS = TypeAdapter(List[Transaction])
+RESULT = TypeAdapter(FraudResult)
+RESULTS = TypeAdapter(List[FraudResult])
+
+
+def default_json(content) -> bytes:
+    """Starlette JSONResponse.render."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def pydantic_decode(body: bytes, single: bool):
+    data = json.loads(body)
+    if single:
+        return TRANSACTION.validate_python(data, from_attributes=True)
+    return TRANSACTIONS.validate_python(data, from_attributes=True)
+
+
+def pydantic_encode(results, single: bool) -> bytes:
+    # FastAPI's serialize_response: dump, validate against response_model, dump again as JSON
+    if single:
+        return default_json(RESULT.dump_python(RESULT.validate_python(results.model_dump()), mode="json"))
+    content = [result.model_dump() for result in results]
+    return default_json(RESULTS.dump_python(RESULTS.validate_python(content), mode="json"))
+
+
+def fast_decode(body: bytes, single: bool):
+    return parse_transaction(body) if single else parse_transactions(body)
+
+
+def fast_encode(results, single: bool) -> bytes:
+    return result_json(results) if single else results_json(results)
+
+
+def timed(function: Callable, items: List, single: bool, repeat: int) -> Tuple[float, List]:
+    """Best total seconds of `repeat` passes over items, and the last pass's outputs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [function(item, single) for item in items]
+        best = min(best, time.perf_counter() - start)
+    return best, outputs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JSON fast path benchmark")
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 1_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    transactions = build_traffic(args.transactions, fraud_share=0.3)
+    for row, transaction in enumerate(transactions[::5]):
+        transaction.latitude, transaction.longitude = 40.0 + row % 10 * 0.5, -74.25
+    payloads = [transaction.model_dump(mode="json") for transaction in transactions]
+    engine = FraudEngine()
+    engine.wait_ready()
+    results = engine.evaluate_batch(transactions)
+
+    print(f"orjson {'installed' if serialization.orjson is not None else 'not installed (stdlib json fallback)'}")
+    print(f"{'batch size':>10} | {'decode us/txn':>24} | {'encode us/txn':>24}")
+    for size in args.sizes:
+        single = size == 1
+        if single:
+            bodies = [json.dumps(payload).encode() for payload in payloads]
+            batches = results
+        else:
+            bodies = [json.dumps(payloads[i:i + size]).encode() for i in range(0, len(payloads), size)]
+            batches = [results[i:i + size] for i in range(0, len(results), size)]
+
+        slow_decode_s, slow_decoded = timed(pydantic_decode, bodies, single, args.repeat)
+        fast_decode_s, fast_decoded = timed(fast_decode, bodies, single, args.repeat)
+        slow_encode_s, slow_encoded = timed(pydantic_encode, batches, single, args.repeat)
+        fast_encode_s, fast_encoded = timed(fast_encode, batches, single, args.repeat)
+
+        assert fast_decoded == slow_decoded, "decoded transactions differ"
+        assert all(json.loads(a) == json.loads(b) for a, b in zip(fast_encoded, slow_encoded)), "encoded results differ"
+        per = 1e6 / len(transactions)
+        print(f"{size:>10} | {slow_decode_s * per:7.2f} -> {fast_decode_s * per:6.2f} ({slow_decode_s / fast_decode_s:4.1f}x) "
+              f"| {slow_encode_s * per:7.2f} -> {fast_encode_s * per:6.2f} ({slow_encode_s / fast_encode_s:4.1f}x)")
+    print("decoded transactions and encoded results match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Open-loop HTTP load test of /evaluate and /batch-evaluate: latency percentiles,
+throughput and error rate at target request rates.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --rps 200 500 1000                 # the app in-process (ASGI transport)
+    python -m benchmarks.load_test --target uvicorn --uvicorn-workers 1 --rps 500 2000
+    python -m benchmarks.load_test --target url --url http://127.0.0.1:8000 --endpoints evaluate
+
+Targets:
+- asgi: app.main's `app` in this process through httpx.ASGITransport (no
+  sockets or HTTP parsing; client and server share one event loop and CPU).
+  --threadpool sets the size of the thread pool sync work runs in.
+- uvicorn: a uvicorn server spawned on 127.0.0.1 for the run (stopped after).
+- url: an already running server.
+
+Requests are sent on a fixed schedule (--arrivals poisson or uniform at each
+--rps) whether or not earlier ones have completed, so a slow server builds a
+queue instead of slowing the client down (open loop). Latency is measured from
+each request's scheduled time, so it includes any lag of the client itself
+("send lag" reports that lag on its own). At most --max-in-flight requests are
+outstanding; arrivals beyond that are counted as dropped errors.
+
+Bodies are built from the seeded synthetic stream (benchmarks.generator): a
+pool of --pool transactions, reused round-robin if a run needs more.
+Requests scheduled during the first --warmup seconds are not reported.
+httpx is required (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from benchmarks.generator import generate, to_json
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = {"evaluate": "/evaluate", "batch-evaluate": "/batch-evaluate"}
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+class Run:
+    """Outcome of one endpoint at one rate: (scheduled time, latency, send lag, status) per request."""
+
+    def __init__(self, endpoint: str, rps: float, transactions_per_request: int):
+        self.endpoint = endpoint
+        self.rps = rps
+        self.transactions_per_request = transactions_per_request
+        self.requests: List[Tuple[float, float, float, int]] = []
+        self.dropped = 0
+        self.errors: Counter = Counter()  # status code (or exception name) -> count
+
+    def report(self, warmup: float, duration: float) -> Dict[str, object]:
+        measured = [request for request in self.requests if request[0] >= warmup]
+        ok = [request for request in measured if 200 <= request[3] < 300]
+        attempted = len(measured) + self.dropped
+        report: Dict[str, object] = {
+            "endpoint": self.endpoint,
+            "offered_rps": self.rps,
+            "requests": attempted,
+            "ok": len(ok),
+            "dropped": self.dropped,
+            "error_rate": (attempted - len(ok)) / attempted if attempted else 0.0,
+            "errors": dict(self.errors),
+        }
+        if ok:
+            # Completions per second over the measured window, up to the last response
+            end = max(scheduled + latency for scheduled, latency, _, _ in ok)
+            elapsed = max(end - warmup, duration)
+            latencies = np.array([latency for _, latency, _, _ in ok]) * 1000
+            lags = np.array([lag for _, _, lag, _ in measured]) * 1000
+            report.update(
+                throughput_rps=len(ok) / elapsed,
+                transactions_per_second=len(ok) * self.transactions_per_request / elapsed,
+                mean_ms=float(latencies.mean()),
+                max_ms=float(latencies.max()),
+                p99_send_lag_ms=float(np.percentile(lags, 99)),
+                **{f"p{q:g}_ms".replace(".", ""): float(np.percentile(latencies, q)) for q in PERCENTILES},
+            )
+        return report
+
+
+def build_bodies(endpoint: str, pool: int, batch_size: int, args) -> List[bytes]:
+    """Request bodies from `pool` generated transactions (one per /evaluate, batch_size per /batch-evaluate)."""
+    records = [to_json(transaction) for transaction, _ in generate(pool, users=args.users, seed=args.seed)]
+    if endpoint == "evaluate":
+        return [record.encode() for record in records]
+    return [
+        ("[" + ",".join(records[start:start + batch_size]) + "]").encode()
+        for start in range(0, max(len(records) - batch_size, 0) + 1, batch_size)
+    ]
+
+
+async def open_loop(
+    client, path: str, bodies: Sequence[bytes], run: Run, seconds: float, arrivals: str, max_in_flight: int, seed: int,
+) -> None:
+    """Send requests at run.rps for `seconds`, independent of responses, and wait for the last ones."""
+    rng = random.Random(seed)
+    in_flight = set()
+    headers = {"content-type": "application/json"}
+
+    async def send(scheduled: float, body: bytes, began: float) -> None:
+        lag = time.perf_counter() - began - scheduled
+        try:
+            response = await client.post(path, content=body, headers=headers)
+            status = response.status_code
+            await response.aclose()
+        except Exception as e:  # timeouts, refused connections, ...
+            status = 0
+            run.errors[type(e).__name__] += 1
+        else:
+            if not 200 <= status < 300:
+                run.errors[str(status)] += 1
+        run.requests.append((scheduled, time.perf_counter() - began - scheduled, lag, status))
+
+    began = time.perf_counter()
+    scheduled = 0.0
+    sent = 0
+    while scheduled < seconds:
+        delay = began + scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            run.dropped += 1
+        else:
+            task = asyncio.create_task(send(scheduled, bodies[sent % len(bodies)], began))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            sent += 1
+        scheduled += rng.expovariate(run.rps) if arrivals == "poisson" else 1.0 / run.rps
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_uvicorn(port: int, workers: int, extra: Sequence[str]) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log", *extra,
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR)
+
+
+async def wait_ready(client, timeout: float, process: Optional[subprocess.Popen] = None) -> None:
+    """Poll GET /ready until it answers 200 (the engine has loaded its state)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"uvicorn exited with code {process.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"server not ready after {timeout:.0f}s")
+
+
+def print_report(report: Dict[str, object]) -> None:
+    if not report["ok"]:
+        print(f"{report['endpoint']:>15} | {report['offered_rps']:>8,.0f} | no successful requests | errors {report['errors']}")
+        return
+    print(
+        f"{report['endpoint']:>15} | {report['offered_rps']:>8,.0f} | {report['throughput_rps']:>8,.0f} | "
+        f"{report['transactions_per_second']:>9,.0f} | {report['error_rate'] * 100:>6.2f} | "
+        f"{report['p50_ms']:>7.2f} | {report['p95_ms']:>7.2f} | {report['p99_ms']:>7.2f} | {report['p999_ms']:>7.2f} | "
+        f"{report['p99_send_lag_ms']:>8.2f}"
+    )
+
+
+async def main_async(args) -> List[Dict[str, object]]:
+    process = None
+    if args.target == "asgi":
+        # Configuration (CREDITGUARD_*) is read from the environment at import
+        from app.main import app
+        import anyio.to_thread
+
+        if args.threadpool:
+            anyio.to_thread.current_default_thread_limiter().total_tokens = args.threadpool
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://creditguard"
+    else:
+        transport = None
+        if args.target == "uvicorn":
+            port = free_port()
+            process = spawn_uvicorn(port, args.uvicorn_workers, args.uvicorn_args.split())
+            base_url = f"http://127.0.0.1:{port}"
+        else:
+            base_url = args.url.rstrip("/")
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    reports = []
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url=base_url, timeout=args.timeout, limits=limits,
+            params={} if args.reasons else {"reasons": "false"},
+        ) as client:
+            await wait_ready(client, args.ready_timeout, process)
+            print(f"target {args.target} ({base_url}), {args.duration:g}s per rate after {args.warmup:g}s warmup, "
+                  f"{args.arrivals} arrivals")
+            print(f"{'endpoint':>15} | {'offered':>8} | {'req/s':>8} | {'txn/s':>9} | {'err %':>6} | "
+                  f"{'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7} | {'p999 ms':>7} | {'lag p99':>8}")
+            for endpoint in args.endpoints:
+                per_request = 1 if endpoint == "evaluate" else args.batch_size
+                bodies = build_bodies(endpoint, max(args.pool, per_request), per_request, args)
+                for rps in args.rps:
+                    # /batch-evaluate rates are in transactions per second unless --batch-rps is given
+                    request_rps = rps / per_request if endpoint == "batch-evaluate" and not args.batch_rps else rps
+                    run = Run(endpoint, request_rps, per_request)
+                    await open_loop(
+                        client, PATHS[endpoint], bodies, run, args.warmup + args.duration,
+                        args.arrivals, args.max_in_flight, args.seed,
+                    )
+                    report = run.report(args.warmup, args.duration)
+                    print_report(report)
+                    reports.append(report)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Open-loop HTTP load test of /evaluate and /batch-evaluate")
+    parser.add_argument("--target", choices=("asgi", "uvicorn", "url"), default="asgi")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server for --target url")
+    parser.add_argument("--uvicorn-workers", type=int, default=1)
+    parser.add_argument("--uvicorn-args", default="", help='extra uvicorn options, e.g. "--loop uvloop --http httptools"')
+    parser.add_argument("--threadpool", type=int, help="sync work thread pool size (--target asgi; default 40)")
+    parser.add_argument("--endpoints", nargs="+", choices=tuple(PATHS), default=list(PATHS))
+    parser.add_argument("--rps", type=float, nargs="+", default=[100, 500, 1000],
+                        help="target rates: requests/s for /evaluate, transactions/s for /batch-evaluate")
+    parser.add_argument("--batch-rps", action="store_true", help="--rps is requests/s for /batch-evaluate too")
+    parser.add_argument("--batch-size", type=int, default=100, help="transactions per /batch-evaluate request")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per rate")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unreported seconds before each measurement")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="outstanding requests before arrivals are dropped")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (seconds)")
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--no-reasons", dest="reasons", action="store_false", help="send reasons=false")
+    parser.add_argument("--pool", type=int, default=100_000, help="distinct transactions to build bodies from")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the reports as JSON")
+    args = parser.parse_args()
+    if httpx is None:
+        parser.error("httpx is required: pip install httpx")
+
+    reports = asyncio.run(main_async(args))
+    if args.save:
+        options = {key: value for key, value in vars(args).items() if key != "save"}
+        with open(args.save, "w") as f:
+            json.dump({"options": options, "reports": reports}, f, indent=2)
+        print(f"saved {args.save}")
+
+
+if __name__ == "__main__":
+    main()
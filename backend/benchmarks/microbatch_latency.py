@@ -0,0 +1,99 @@
+"""
+Throughput and latency of /evaluate-style single calls with and without micro-batching.
+
+Usage (from backend/):
+    python -m benchmarks.microbatch_latency --clients 64 --window-ms 1 2
+
+Runs `--clients` concurrent asyncio clients, each sending its transactions one
+at a time, through the same paths the API uses: FraudEngine.evaluate() in the
+thread pool (micro-batching off) and MicroBatcher.evaluate() for each window.
+Reports transactions per second, p50/p99 latency and the mean batch size, and
+checks that micro-batched results match the unbatched ones. "batch path" is the
+ceiling: the same transactions through FraudEngine.evaluate_batch() directly,
+--clients at a time (one per client, as a full micro-batch would be), no asyncio.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List, Tuple
+
+from app.schemas import FraudResult, Transaction
+from app.services.fraud_engine import FraudEngine
+from app.services.microbatch import MicroBatcher
+from benchmarks.event_log_throughput import build_transactions
+
+
+async def run(evaluate, transactions: List[Transaction], clients: int) -> Tuple[float, List[float], List[FraudResult]]:
+    """Transactions per second, per-call latencies and results (in input order)."""
+    results: List[FraudResult] = [None] * len(transactions)
+    latencies: List[float] = []
+
+    async def client(rows: range) -> None:
+        for row in rows:
+            start = time.perf_counter()
+            results[row] = await evaluate(transactions[row])
+            latencies.append(time.perf_counter() - start)
+
+    # Each client owns a contiguous run of transactions, so per-user order is the same on every path
+    per_client = -(-len(transactions) // clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(range(i, min(i + per_client, len(transactions)))) for i in range(0, len(transactions), per_client)
+    ))
+    return len(transactions) / (time.perf_counter() - start), latencies, results
+
+
+def percentile(values: List[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def main_async(args) -> None:
+    # One user per client keeps the result check independent of request interleaving
+    transactions = build_transactions(args.transactions, args.clients)
+    per_client = -(-len(transactions) // args.clients)
+    for row, transaction in enumerate(transactions):
+        transaction.user_id = f"user_{row // per_client}"
+
+    engine = FraudEngine()
+    engine.wait_ready()
+    loop = asyncio.get_running_loop()
+
+    def unbatched(transaction):
+        return loop.run_in_executor(None, engine.evaluate, transaction)
+
+    engine.state_store.clear()
+    rate, latencies, expected = await run(unbatched, transactions, args.clients)
+    print(f"{'off':>10}: {rate:>9,.0f} txn/s | p50 {percentile(latencies, 50) * 1000:6.2f} ms "
+          f"| p99 {percentile(latencies, 99) * 1000:6.2f} ms")
+
+    engine.state_store.clear()
+    rows = sorted(range(len(transactions)), key=lambda row: (row % per_client, row))
+    start = time.perf_counter()
+    for i in range(0, len(rows), args.clients):
+        engine.evaluate_batch([transactions[row] for row in rows[i:i + args.clients]])
+    print(f"{'batch path':>10}: {len(transactions) / (time.perf_counter() - start):>9,.0f} txn/s")
+
+    for window_ms in args.window_ms:
+        engine.state_store.clear()
+        batcher = MicroBatcher(engine, window_ms / 1000, args.max_batch)
+        rate, latencies, results = await run(batcher.evaluate, transactions, args.clients)
+        stats = batcher.stats()
+        print(f"{window_ms:>7} ms: {rate:>9,.0f} txn/s | p50 {percentile(latencies, 50) * 1000:6.2f} ms "
+              f"| p99 {percentile(latencies, 99) * 1000:6.2f} ms | mean batch {stats['mean_batch']:.1f}")
+        for got, want in zip(results, expected):
+            assert got.model_dump(exclude={"timestamp"}) == want.model_dump(exclude={"timestamp"})
+    print("results match")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-batching throughput/latency benchmark")
+    parser.add_argument("--transactions", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent callers")
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[0.5, 1, 2])
+    parser.add_argument("--max-batch", type=int, default=256)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Snapshot and warm-start cost of the per-user state store.
+
+Usage (from backend/):
+    python -m benchmarks.snapshot_warm_start --users 2000000
+
+Fills a UserStateStore with synthetic users (velocity history + last
+transaction), then reports:
+- pause: time request threads are blocked while the store copies its columns
+- write: total snapshot time (copy, encode, write, fsync, rename)
+- load: warm start of a fresh store from the snapshot
+and checks that the loaded store holds the same state.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.services.batch import to_epoch_us
+from app.services.snapshot import Snapshotter
+from app.services.state_store import UserStateStore
+
+START_US = to_epoch_us(datetime(2024, 1, 1, tzinfo=timezone.utc))
+COUNTRIES = ["US", "CA", "GB", "FR", "DE", "JP", "AU", "BR", "IN", "CN"]
+WINDOW_US = 600 * 1_000_000
+
+
+def fill(store: UserStateStore, users: int, events: int) -> None:
+    for i in range(users):
+        user_id = f"user_{i}"
+        event_us = START_US + (i % 86400) * 1_000_000
+        for k in range(events):
+            slot = store.touch(user_id, event_us + k * 60_000_000)
+            store.record_velocity(slot, event_us + k * 60_000_000, WINDOW_US)
+        store.set_last_transaction(slot, COUNTRIES[i % len(COUNTRIES)], event_us + (events - 1) * 60_000_000,
+                                   *((40.7, -74.0) if i % 2 else (None, None)))
+
+
+def longest_pause(store: UserStateStore, action) -> float:
+    """Run action() while a thread keeps taking a user lock; longest wait for it."""
+    stop = threading.Event()
+    longest = [0.0]
+
+    def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            with store.user_lock("user_0"):
+                pass
+            longest[0] = max(longest[0], time.perf_counter() - start)
+            time.sleep(0.0005)
+
+    thread = threading.Thread(target=probe)
+    thread.start()
+    action()
+    stop.set()
+    thread.join()
+    return longest[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="State snapshot / warm start benchmark")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--events", type=int, default=3, help="velocity timestamps per user")
+    args = parser.parse_args()
+
+    store = UserStateStore(max_users=args.users)
+    start = time.perf_counter()
+    fill(store, args.users, args.events)
+    print(f"filled {len(store):,} users in {time.perf_counter() - start:.1f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshotter = Snapshotter(store, os.path.join(directory, "state.snapshot"), interval_seconds=0)
+        start = time.perf_counter()
+        pause = longest_pause(store, snapshotter.snapshot)
+        write = time.perf_counter() - start
+        size = os.path.getsize(snapshotter.path)
+        print(f"snapshot: {write * 1000:,.0f} ms total, longest request pause {pause * 1000:,.1f} ms, "
+              f"{size / 1e6:,.1f} MB ({size / max(len(store), 1):.0f} bytes/user)")
+
+        restored = UserStateStore(max_users=args.users)
+        warm = Snapshotter(restored, snapshotter.path, interval_seconds=0)
+        start = time.perf_counter()
+        warm.warm_start()
+        print(f"warm start: {warm.loaded_users:,} users in {(time.perf_counter() - start) * 1000:,.0f} ms")
+
+    for i in range(0, args.users, max(args.users // 1000, 1)):
+        user_id = f"user_{i}"
+        before, after = store.slot(user_id), restored.slot(user_id)
+        assert store.velocity_history(before) == restored.velocity_history(after), user_id
+        assert store.last_transaction(before) == restored.last_transaction(after), user_id
+        assert store.last_position(before) == restored.last_position(after), user_id
+    print("state matches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Memory per tracked user: legacy per-user objects vs the slot-indexed UserStateStore.
+
+Usage (from backend/):
+    python -m benchmarks.state_memory --users 10000000
+
+Every synthetic user gets `--events` velocity timestamps and a last
+transaction, i.e. what the velocity and impossible travel rules keep.
+Allocations are measured with tracemalloc, so user_id strings (shared by
+both layouts) are created before measuring starts.
+"""
+import argparse
+import gc
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from app.services.batch import to_epoch_us
+from app.services.state_store import UserStateStore
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+COUNTRIES = ["US", "CA", "GB", "FR", "DE", "JP", "AU", "BR", "IN", "CN"]
+
+
+class LegacyUserState:
+    """Per-user state as kept before the slot-indexed store (one object per user)."""
+
+    def __init__(self):
+        self.velocity_history: List[datetime] = []
+        self.last_country: Optional[str] = None
+        self.last_time: Optional[datetime] = None
+        self.last_seen: Optional[datetime] = None
+
+
+def fill_legacy(user_ids: List[str], events: int) -> object:
+    users: "OrderedDict[str, LegacyUserState]" = OrderedDict()
+    for i, user_id in enumerate(user_ids):
+        state = LegacyUserState()
+        times = [START + timedelta(seconds=i % 86400, minutes=k) for k in range(events)]
+        state.velocity_history = times
+        state.last_country = COUNTRIES[i % len(COUNTRIES)]
+        state.last_time = times[-1]
+        state.last_seen = times[-1]
+        users[user_id] = state
+    return users
+
+
+def fill_compact(user_ids: List[str], events: int) -> object:
+    store = UserStateStore(max_users=max(len(user_ids), 1))
+    window_us = 24 * 3600 * 1_000_000
+    for i, user_id in enumerate(user_ids):
+        first_us = to_epoch_us(START + timedelta(seconds=i % 86400))
+        for k in range(events):
+            event_us = first_us + k * 60_000_000
+            slot = store.touch(user_id, event_us)
+            store.record_velocity(slot, event_us, window_us)
+        store.set_last_transaction(slot, COUNTRIES[i % len(COUNTRIES)], event_us)
+    return store
+
+
+def measure(fill: Callable[[List[str], int], object], user_ids: List[str], events: int) -> int:
+    """Bytes still allocated by fill() after it returns."""
+    gc.collect()
+    tracemalloc.start()
+    state = fill(user_ids, events)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    gc.collect()
+    return allocated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000_000)
+    parser.add_argument("--events", type=int, default=3, help="velocity timestamps per user")
+    args = parser.parse_args()
+
+    user_ids = [f"user_{i:08d}" for i in range(args.users)]
+    print(f"{args.users:,} users, {args.events} velocity events each")
+    results = {}
+    for name, fill in (("legacy objects", fill_legacy), ("slot arrays", fill_compact)):
+        allocated = measure(fill, user_ids, args.events)
+        results[name] = allocated / args.users
+        print(f"{name:15} {allocated / 2**20:10.1f} MiB  {results[name]:7.1f} bytes/user")
+    print(f"reduction       {results['legacy objects'] / results['slot arrays']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Benchmark suite: per-rule microbenchmarks, FraudEngine.evaluate() and the batch
+path at several sizes, on the seeded synthetic stream (benchmarks.generator).
+
+Usage (from backend/):
+    python -m benchmarks.suite                                  # 1k, 1M, 10M transactions
+    python -m benchmarks.suite --sizes 1000 100000 --compare benchmarks/results/suite-20240115-120000.json
+
+Parts:
+- rules: each rule in FraudEngine.rules, timed alone on --rule-transactions
+  transactions: evaluate() per call (features extracted untimed, rules run in
+  engine order so state evolves as in the engine) and evaluate_batch() per
+  transaction over --chunk-size batches
+- sizes: for every --sizes count, the stream is evaluated through
+  FraudEngine.evaluate() (one call per transaction, mean/p50/p99 latency) and
+  through FraudEngine.evaluate_batch() (--chunk-size chunks), each from an
+  empty state store; reports throughput, process RSS growth and peak, and
+  state store users/bytes. Transactions are generated chunk by chunk, so the
+  stream itself never has to fit in memory.
+
+Results (with Python/NumPy versions, CPU count and git commit) are saved as
+JSON under benchmarks/results/ (or --save). --compare prints every metric's
+change against a saved run and lists timings worse by more than --threshold
+percent; hit rates and user counts are flagged on any change, since with the
+same seed they only move when rule behaviour does.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from app.services.batch import TransactionBatch
+from app.services.features import extract_features
+from app.services.fraud_engine import FraudEngine
+from benchmarks.generator import generate
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Metrics where a larger value is better (timings: smaller is better)
+HIGHER_IS_BETTER = ("per_second",)
+# Not timings: any change means the stream or the rules' behaviour changed
+BEHAVIOUR = ("hit_rate", "state_users")
+# Memory: reported, not flagged (depends on the allocator and what ran before)
+MEMORY = ("_mb",)
+
+
+def stream(count: int, args, chunk_size: int) -> Iterator[List]:
+    """The generator's transactions in chunks (same seed and options -> same stream)."""
+    transactions = (transaction for transaction, _ in generate(
+        count, users=args.users, rate_per_hour=args.rate_per_hour, fraud_share=args.fraud_share, seed=args.seed,
+    ))
+    while True:
+        chunk = list(islice(transactions, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def rss_bytes() -> int:
+    """Current resident set size."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def timer_overhead_ns() -> float:
+    """Cost of one perf_counter_ns() pair, subtracted from per-call rule timings."""
+    samples = []
+    for _ in range(5):
+        start = time.perf_counter_ns()
+        for _ in range(10_000):
+            time.perf_counter_ns()
+        samples.append((time.perf_counter_ns() - start) / 10_000)
+    return min(samples)
+
+
+def bench_rules(engine: FraudEngine, args) -> Dict[str, Dict[str, float]]:
+    """Per-rule evaluate() us/call and evaluate_batch() us/transaction."""
+    overhead = timer_overhead_ns()
+    transactions = [transaction for chunk in stream(args.rule_transactions, args, args.chunk_size) for transaction in chunk]
+    store = engine.state_store
+    store.clear()
+    per_call = {rule.name: [] for rule in engine.rules}
+    for transaction in transactions:
+        with store.user_lock(transaction.user_id):
+            features = extract_features(transaction, store)
+            for rule in engine.rules:
+                start = time.perf_counter_ns()
+                rule.evaluate(features)
+                per_call[rule.name].append(time.perf_counter_ns() - start - overhead)
+
+    store.clear()
+    batch_seconds = {rule.name: 0.0 for rule in engine.rules}
+    hits = {rule.name: 0 for rule in engine.rules}
+    for start in range(0, len(transactions), args.chunk_size):
+        batch = TransactionBatch(transactions[start:start + args.chunk_size])
+        for rule in engine.rules:
+            began = time.perf_counter()
+            hits[rule.name] += len(rule.evaluate_batch(batch))
+            batch_seconds[rule.name] += time.perf_counter() - began
+
+    results = {}
+    for rule in engine.rules:
+        calls = sorted(per_call[rule.name])
+        results[rule.name] = {
+            "evaluate_mean_us": statistics.fmean(calls) / 1000,
+            "evaluate_p99_us": calls[int(len(calls) * 0.99)] / 1000,
+            "batch_us_per_transaction": batch_seconds[rule.name] / len(transactions) * 1e6,
+            "hit_rate": hits[rule.name] / len(transactions),
+        }
+    return results
+
+
+def bench_size(engine: FraudEngine, count: int, args) -> Dict[str, Dict[str, float]]:
+    """evaluate() and evaluate_batch() over `count` generated transactions."""
+    results = {}
+    for path in args.paths:
+        engine.state_store.clear()
+        rss_before = rss_bytes()
+        latencies: List[float] = []
+        busy = 0.0
+        evaluated = 0
+        for chunk in stream(count, args, args.chunk_size):
+            if path == "evaluate":
+                for transaction in chunk:
+                    start = time.perf_counter()
+                    engine.evaluate(transaction)
+                    latencies.append(time.perf_counter() - start)
+            else:
+                start = time.perf_counter()
+                engine.evaluate_batch(chunk, workers=args.workers)
+                busy += time.perf_counter() - start
+            evaluated += len(chunk)
+        if path == "evaluate":
+            busy = sum(latencies)
+        store = engine.state_store.stats()
+        entry = {
+            "transactions_per_second": evaluated / busy if busy else 0.0,
+            "rss_growth_mb": (rss_bytes() - rss_before) / 1e6,
+            "peak_rss_mb": peak_rss_bytes() / 1e6,
+            "state_users": store.get("users", 0),
+            "state_mb": store.get("column_bytes", store.get("table_bytes", 0)) / 1e6,
+        }
+        if latencies:
+            latencies = np.sort(np.asarray(latencies) * 1e6)
+            entry.update(
+                mean_us=float(latencies.mean()),
+                p50_us=float(latencies[len(latencies) // 2]),
+                p99_us=float(latencies[int(len(latencies) * 0.99)]),
+            )
+        results[path] = entry
+    return results
+
+
+def environment() -> Dict[str, Optional[str]]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": str(os.cpu_count()),
+        "commit": commit,
+    }
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """{"rules/Velocity Rule/evaluate_mean_us": value, ...} for comparing runs."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> None:
+    now, before = flatten(current["results"]), flatten(baseline["results"])
+    print(f"\ncompared with {baseline['environment'].get('commit')} ({baseline['created_at']}):")
+    differing = sorted(key for key, value in current["options"].items() if baseline.get("options", {}).get(key) != value)
+    if differing:
+        print(f"  note: options differ ({', '.join(differing)}), results are not comparable one to one")
+    regressions = []
+    for name in sorted(set(now) & set(before)):
+        if not before[name]:
+            continue
+        change = (now[name] - before[name]) / abs(before[name]) * 100
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if name.endswith(BEHAVIOUR):
+            flag = " <-- changed" if now[name] != before[name] else ""
+        elif not name.endswith(MEMORY) and worse > threshold:
+            flag = " <-- regression"
+            regressions.append(name)
+        print(f"  {name:<60} {before[name]:>12.4g} -> {now[name]:>12.4g} ({change:+6.1f}%){flag}")
+    print(f"{len(regressions)} regression(s) over {threshold:.0f}%" + (": " + ", ".join(regressions) if regressions else ""))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CreditGuard benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 1_000_000, 10_000_000])
+    parser.add_argument("--paths", nargs="+", choices=("evaluate", "batch"), default=["evaluate", "batch"])
+    parser.add_argument("--rule-transactions", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="transactions per generated chunk / batch call")
+    parser.add_argument("--workers", type=int, default=1, help="evaluate_batch() worker processes")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--rate-per-hour", type=float, default=1.0)
+    parser.add_argument("--fraud-share", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="results file (default: benchmarks/results/suite-<UTC time>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold (percent)")
+    args = parser.parse_args()
+
+    engine = FraudEngine()
+    engine.wait_ready()
+    results: Dict[str, Dict] = {}
+
+    print(f"rules ({args.rule_transactions:,} transactions)")
+    print(f"{'rule':>24} | {'evaluate us':>11} | {'p99 us':>7} | {'batch us/txn':>12} | {'hit rate':>8}")
+    results["rules"] = bench_rules(engine, args)
+    for name, entry in results["rules"].items():
+        print(f"{name:>24} | {entry['evaluate_mean_us']:11.2f} | {entry['evaluate_p99_us']:7.2f} | "
+              f"{entry['batch_us_per_transaction']:12.3f} | {entry['hit_rate']:8.3f}")
+
+    print(f"\n{'size':>10} | {'path':>8} | {'txn/s':>10} | {'p50 us':>7} | {'p99 us':>7} | {'RSS +MB':>8} | {'peak MB':>8} | {'state users':>11} | {'state MB':>8}")
+    for count in args.sizes:
+        results[str(count)] = bench_size(engine, count, args)
+        for path, entry in results[str(count)].items():
+            print(f"{count:>10,} | {path:>8} | {entry['transactions_per_second']:10,.0f} | "
+                  f"{entry.get('p50_us', float('nan')):7.2f} | {entry.get('p99_us', float('nan')):7.2f} | "
+                  f"{entry['rss_growth_mb']:8.1f} | {entry['peak_rss_mb']:8.1f} | {entry['state_users']:11,} | {entry['state_mb']:8.1f}")
+
+    now = datetime.now(timezone.utc)
+    report = {
+        "created_at": now.isoformat(),
+        "environment": environment(),
+        "options": {key: value for key, value in vars(args).items() if key not in ("save", "compare", "threshold")},
+        "results": results,
+    }
+    path = args.save or os.path.join(RESULTS_DIR, f"suite-{now:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f), args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,11 @@ import ResultCard from "./components/ResultCard";
 import TransactionHistory from "./components/TransactionHistory";
 import DatasetImport from "./components/DatasetImport";
 import { Transaction, FraudResult } from "./types";
-import { evaluateTransaction, batchEvaluateTransactions } from "./api";
+import {
+  evaluateTransaction,
+  batchEvaluateTransactions,
+  streamBatchEvaluate,
+} from "./api";
 
 function App() {
   const [result, setResult] = useState<FraudResult | null>(null);
@@ -40,6 +44,13 @@ function App() {
     return results;
   };
 
+  // Streamed datasets can be millions of rows: summarized in DatasetImport, not added to history
+  const handleStreamEvaluate = (
+    file: File,
+    onResults: (results: FraudResult[]) => void,
+    onProgress: (bytesProcessed: number, totalBytes: number) => void
+  ): Promise<number> => streamBatchEvaluate(file, onResults, onProgress);
+
   const handleClearHistory = () => {
     setHistory([]);
     setResult(null);
@@ -87,7 +98,10 @@ function App() {
 
         {/* Batch Import */}
         <div style={styles.gridItem}>
-          <DatasetImport onBatchEvaluate={handleBatchEvaluate} />
+          <DatasetImport
+            onBatchEvaluate={handleBatchEvaluate}
+            onStreamEvaluate={handleStreamEvaluate}
+          />
         </div>
 
         {/* Transaction History */}
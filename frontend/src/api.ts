@@ -37,3 +37,88 @@ export async function batchEvaluateTransactions(transactions: Transaction[]): Pr
 
   return response.json();
 }
+
+/**
+ * Stream a newline-delimited JSON (NDJSON) file through /batch-evaluate/stream.
+ *
+ * The file is read and sent in line-aligned slices, one request per slice, and
+ * result lines are handed to onResults as they arrive. Memory stays bounded on
+ * both sides, even for multi-GB files. Backend state carries over between
+ * slices, so results match a single upload.
+ *
+ * Returns the number of input lines the backend rejected as invalid.
+ */
+export async function streamBatchEvaluate(
+  file: Blob,
+  onResults: (results: FraudResult[]) => void,
+  onProgress?: (bytesProcessed: number, totalBytes: number) => void,
+  sliceBytes: number = 8 * 1024 * 1024,
+): Promise<number> {
+  let offset = 0;
+  let carry = new Uint8Array(0);
+  let invalidLines = 0;
+
+  while (offset < file.size) {
+    const bytes = new Uint8Array(await file.slice(offset, offset + sliceBytes).arrayBuffer());
+    offset += bytes.length;
+
+    const data = new Uint8Array(carry.length + bytes.length);
+    data.set(carry);
+    data.set(bytes, carry.length);
+
+    // Send complete lines only; the partial last line waits for the next slice
+    const cut = offset >= file.size ? data.length : data.lastIndexOf(10) + 1;
+    carry = data.slice(cut);
+    if (cut > 0) {
+      invalidLines += await postNdjsonSlice(data.subarray(0, cut), onResults);
+    }
+    onProgress?.(offset - carry.length, file.size);
+  }
+
+  return invalidLines;
+}
+
+async function postNdjsonSlice(
+  body: Uint8Array,
+  onResults: (results: FraudResult[]) => void,
+): Promise<number> {
+  const response = await fetch(`${API_BASE_URL}/batch-evaluate/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/x-ndjson',
+    },
+    body,
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`API error: ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let invalidLines = 0;
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value, { stream: !done });
+
+    const lines = buffer.split('\n');
+    buffer = done ? '' : lines.pop() ?? '';
+
+    const results: FraudResult[] = [];
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const item = JSON.parse(line);
+      if ('error' in item) throw new Error(item.error);
+      if ('detail' in item) {
+        invalidLines += 1;
+        continue;
+      }
+      results.push(item as FraudResult);
+    }
+    if (results.length > 0) onResults(results);
+
+    if (done) return invalidLines;
+  }
+}
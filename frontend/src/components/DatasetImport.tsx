@@ -1,17 +1,48 @@
 /**
  * Dataset Import Component
- * Allows batch evaluation of transactions from JSON file
+ * Allows batch evaluation of transactions from JSON file,
+ * or streaming evaluation of NDJSON files with live progress
  */
 import { useState } from 'react';
 import { Transaction, FraudResult } from '../types';
 
 interface DatasetImportProps {
   onBatchEvaluate: (transactions: Transaction[]) => Promise<FraudResult[]>;
+  onStreamEvaluate: (
+    file: File,
+    onResults: (results: FraudResult[]) => void,
+    onProgress: (bytesProcessed: number, totalBytes: number) => void,
+  ) => Promise<number>;
 }
 
-export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
+interface Summary {
+  high: number;
+  medium: number;
+  low: number;
+  total: number;
+}
+
+const EMPTY_SUMMARY: Summary = { high: 0, medium: 0, low: 0, total: 0 };
+
+function addToSummary(summary: Summary, results: FraudResult[]): Summary {
+  const next = { ...summary, total: summary.total + results.length };
+  for (const r of results) {
+    if (r.risk_level === 'HIGH') next.high += 1;
+    else if (r.risk_level === 'MEDIUM') next.medium += 1;
+    else next.low += 1;
+  }
+  return next;
+}
+
+function isNdjson(file: File): boolean {
+  return /\.(ndjson|jsonl)$/i.test(file.name);
+}
+
+export default function DatasetImport({ onBatchEvaluate, onStreamEvaluate }: DatasetImportProps) {
   const [isProcessing, setIsProcessing] = useState(false);
-  const [results, setResults] = useState<FraudResult[] | null>(null);
+  const [summary, setSummary] = useState<Summary | null>(null);
+  const [progress, setProgress] = useState<number | null>(null);
+  const [invalidLines, setInvalidLines] = useState(0);
   const [error, setError] = useState<string | null>(null);
 
   const handleFileUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
@@ -20,17 +51,31 @@ export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
 
     setIsProcessing(true);
     setError(null);
-    setResults(null);
+    setSummary(null);
+    setProgress(null);
+    setInvalidLines(0);
 
     try {
-      const text = await file.text();
-      const data = JSON.parse(text);
+      if (isNdjson(file)) {
+        // Streaming path: only running counts are kept, never the full result set
+        setSummary(EMPTY_SUMMARY);
+        setProgress(0);
+        const invalid = await onStreamEvaluate(
+          file,
+          (results) => setSummary((prev) => addToSummary(prev ?? EMPTY_SUMMARY, results)),
+          (bytesProcessed, totalBytes) => setProgress(totalBytes > 0 ? bytesProcessed / totalBytes : 1),
+        );
+        setInvalidLines(invalid);
+      } else {
+        const text = await file.text();
+        const data = JSON.parse(text);
 
-      // Support both single object and array
-      const transactions: Transaction[] = Array.isArray(data) ? data : [data];
+        // Support both single object and array
+        const transactions: Transaction[] = Array.isArray(data) ? data : [data];
 
-      const batchResults = await onBatchEvaluate(transactions);
-      setResults(batchResults);
+        const batchResults = await onBatchEvaluate(transactions);
+        setSummary(addToSummary(EMPTY_SUMMARY, batchResults));
+      }
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to process file');
     } finally {
@@ -40,22 +85,10 @@ export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
     }
   };
 
-  const getSummary = () => {
-    if (!results) return null;
-
-    const high = results.filter(r => r.risk_level === 'HIGH').length;
-    const medium = results.filter(r => r.risk_level === 'MEDIUM').length;
-    const low = results.filter(r => r.risk_level === 'LOW').length;
-
-    return { high, medium, low, total: results.length };
-  };
-
-  const summary = getSummary();
-
   return (
     <div style={styles.card}>
       <h2 style={styles.heading}>Batch Evaluation</h2>
-      <p style={styles.description}>Upload a JSON file with transaction data for bulk analysis</p>
+      <p style={styles.description}>Upload a JSON file with transaction data for bulk analysis, or an NDJSON file to stream large datasets</p>
 
       <div style={styles.uploadSection}>
         <label
@@ -86,18 +119,28 @@ export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
             }
           }}
         >
-          {isProcessing ? 'Processing...' : 'Choose JSON File'}
+          {isProcessing
+            ? progress !== null
+              ? `Processing... ${Math.floor(progress * 100)}%`
+              : 'Processing...'
+            : 'Choose JSON File'}
         </label>
         <input
           id="file-upload"
           type="file"
-          accept=".json"
+          accept=".json,.ndjson,.jsonl"
           onChange={handleFileUpload}
           disabled={isProcessing}
           style={styles.fileInput}
         />
       </div>
 
+      {progress !== null && (
+        <div style={styles.progressTrack}>
+          <div style={{ ...styles.progressBar, width: `${Math.floor(progress * 100)}%` }} />
+        </div>
+      )}
+
       {error && (
         <div style={styles.error}>
           <strong>Error:</strong> {error}
@@ -106,9 +149,10 @@ export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
 
       {summary && (
         <div style={styles.results}>
-          <h3 style={styles.resultsHeading}>Batch Results</h3>
+          <h3 style={styles.resultsHeading}>{isProcessing ? 'Batch Results (streaming)' : 'Batch Results'}</h3>
           <p style={styles.totalText}>
             <strong>{summary.total}</strong> transactions evaluated
+            {invalidLines > 0 && ` (${invalidLines} invalid lines skipped)`}
           </p>
           <div style={styles.summaryGrid}>
             <div style={{ ...styles.summaryCard, borderLeft: '3px solid #D4002A' }}>
@@ -128,7 +172,7 @@ export default function DatasetImport({ onBatchEvaluate }: DatasetImportProps) {
       )}
 
       <div style={styles.hint}>
-        <strong>Example JSON format:</strong>
+        <strong>Example JSON format</strong> (NDJSON: one transaction object per line):
         <pre style={styles.codeBlock}>
 {`[
   {
@@ -183,6 +227,18 @@ const styles = {
   fileInput: {
     display: 'none',
   },
+  progressTrack: {
+    height: '6px',
+    backgroundColor: '#E5E5E5',
+    borderRadius: '3px',
+    overflow: 'hidden' as const,
+    marginBottom: '16px',
+  },
+  progressBar: {
+    height: '100%',
+    backgroundColor: '#004879',
+    transition: 'width 0.2s ease',
+  },
   error: {
     backgroundColor: '#FEE',
     color: '#D4002A',
@@ -10,6 +10,9 @@ export interface Transaction {
   country: string;
   merchant: string;
   timestamp?: string;
+  latitude?: number;
+  longitude?: number;
+  transaction_id?: string;
 }
 
 export interface RuleTrigger {